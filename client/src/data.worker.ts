@@ -7,6 +7,9 @@ import * as models from './models';
 
 declare const GENERATE_MOCKING: boolean;
 
+// see server/columnar.py
+const COLUMNAR_CONTENT_TYPE = 'application/vnd.timeclock.shifts';
+
 let obj: models.Sig;
 
 if (GENERATE_MOCKING) {
@@ -126,40 +129,14 @@ if (GENERATE_MOCKING) {
       const url = new URL(`/data/shifts`, location.origin);
       url.searchParams.set('minDate', minDate.toISOString());
       url.searchParams.set('maxDate', maxDate.toISOString());
-      const res = await fetch(url.toString(), {headers: {'Accept': 'application/bson'}});
-      if (res.status < 200 || res.status >= 400) {
-        throw new Error(`failed to fetch shifts: ${res.statusText}`);
-      }
-      let content;
-      if (res.headers.has('Content-Type') && res.headers.get('Content-Type') === 'application/bson') {
-        let buf = await res.arrayBuffer();
-        buf = new Uint8Array(buf)
-        content = deserialize(buf);
-      } else {
-        content = await res.json();
-        interpretResponse(content);
-      }
-      return content;
+      return fetchShifts(url);
     },
     async getShiftsByEmployeeInRange(employeeId: models.EmployeeID, [minDate, maxDate]: models.DateRange) {
       const url = new URL(`/data/shifts`, location.origin);
       url.searchParams.set('minDate', minDate.toISOString());
       url.searchParams.set('maxDate', maxDate.toISOString());
       url.searchParams.set('employee', employeeId);
-      const res = await fetch(url.toString(), {headers: {'Accept': 'application/bson'}});
-      if (res.status < 200 || res.status >= 400) {
-        throw new Error(`failed to fetch shifts: ${res.statusText}`);
-      }
-      let content;
-      if (res.headers.has('Content-Type') && res.headers.get('Content-Type') === 'application/bson') {
-        let buf = await res.arrayBuffer();
-        buf = new Uint8Array(buf)
-        content = deserialize(buf);
-      } else {
-        content = await res.json();
-        interpretResponse(content);
-      }
-      return content;
+      return fetchShifts(url);
     },
     async getGraphData(dateRange?: models.DateRange): Promise<models.GraphDataResponse> {
       const url = new URL(`/data/graph`, location.origin);
@@ -273,6 +250,100 @@ Object.assign(obj, {
 });
 */
 
+const TYPED_ARRAYS = {
+  float64: Float64Array,
+  int32: Int32Array,
+  int16: Int16Array,
+  uint16: Uint16Array,
+  uint8: Uint8Array,
+  uint32: Uint32Array,
+};
+
+function toHex(bytes: Uint8Array, i: number) {
+  let s = '';
+  for (let j = i * 12; j < i * 12 + 12; j++) {
+    s += (bytes[j] < 16 ? '0' : '') + bytes[j].toString(16);
+  }
+  return s;
+}
+
+// columns are viewed in place, only the shift objects are built
+function decodeColumnar(buf: ArrayBuffer) {
+  const view = new DataView(buf);
+  const metaLength = view.getUint32(4, true);
+  const meta = deserialize(new Uint8Array(buf, 8, metaLength));
+  const base = Math.ceil((8 + metaLength) / 8) * 8;
+  const cols: {[name: string]: any} = {};
+  for (const [name, type, offset, size] of meta.columns) {
+    const TypedArray = TYPED_ARRAYS[type];
+    cols[name] = new TypedArray(buf, base + offset, size / TypedArray.BYTES_PER_ELEMENT);
+  }
+  const {employees, employeeIds, expectedDuration, next} = meta;
+  const shifts = [];
+  for (let i = 0; i < meta.count; i++) {
+    const components = [];
+    for (let j = cols.components[i]; j < cols.components[i + 1]; j++) {
+      const _id = toHex(cols.componentId, j);
+      const end = cols.componentEnd[j];
+      components.push({
+        _id,
+        id: _id,
+        start: new Date(cols.componentStart[j]),
+        end: isNaN(end) ? null : new Date(end),
+        duration: cols.componentDuration[j],
+      });
+    }
+    const end = cols.end[i];
+    const employee = cols.employee[i];
+    const id = toHex(cols.id, i);
+    shifts.push({
+      id,
+      employee: employee === 0xffff ? null : employeeIds[employee],
+      start: new Date(cols.start[i]),
+      end: isNaN(end) ? null : new Date(end),
+      duration: cols.duration[i],
+      row: cols.row[i] === -1 ? null : cols.row[i],
+      state: cols.flags[i] & 1 ? models.ShiftState.Complete : models.ShiftState.Incomplete,
+      expectedDuration,
+      components,
+    });
+  }
+  return {employees, employeeIds, shifts, next};
+}
+
+// /data/shifts is paged, follow 'next' until the range is read
+async function fetchShifts(url: URL) {
+  let content;
+  let after = null;
+  do {
+    if (after != null) {
+      url.searchParams.set('after', after);
+    }
+    const res = await fetch(url.toString(), {headers: {'Accept': `${COLUMNAR_CONTENT_TYPE}, application/bson`}});
+    if (res.status < 200 || res.status >= 400) {
+      throw new Error(`failed to fetch shifts: ${res.statusText}`);
+    }
+    let page;
+    if (res.headers.has('Content-Type') && res.headers.get('Content-Type') === COLUMNAR_CONTENT_TYPE) {
+      page = decodeColumnar(await res.arrayBuffer());
+    } else if (res.headers.has('Content-Type') && res.headers.get('Content-Type') === 'application/bson') {
+      let buf = await res.arrayBuffer();
+      buf = new Uint8Array(buf)
+      page = deserialize(buf);
+    } else {
+      page = await res.json();
+      interpretResponse(page);
+    }
+    if (content == null) {
+      content = page;
+    } else {
+      content.shifts.push(...page.shifts);
+    }
+    after = page.next;
+  } while (after != null);
+  return content;
+}
+
 function sortBy(arr) {
   return function (a, b) {
     for (const key of arr) {
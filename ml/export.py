@@ -32,25 +32,13 @@ PIPELINE = [
         'startHour': {'$divide': ['$startHour', 3600]},
         'endHour': {'$divide': ['$endHour', 3600]},
     }},
-    # join with components
-    {'$unwind': '$components'},
-    {'$lookup': {
-        'from': 'components',
-        'localField': 'components',
-        'foreignField': '_id',
-        'as': 'components',
-    }},
-    {'$unwind': '$components'},
-    {'$group': {
-        '_id': '$_id',
-        'root': {'$first': '$$ROOT'},
-        'components': {'$push': '$components'},
-    }},
-    {'$addFields': {'root.components': '$components'}},
-    {'$replaceRoot': {'newRoot': '$root'}},
-    # recalculate cumulative duration from components
-    {'$addFields': {'duration': {'$map': {'input': '$components', 'in': {'$subtract': ['$$this.end', '$$this.start']}}}}},
-    {'$addFields': {'duration': {'$sum': '$duration'}}},
+    # shifts written before components were embedded (no 'parts') join them instead
+    {'$addFields': {'joined': {'$cond': [{'$eq': [{'$type': '$parts'}, 'missing']}, '$components', []]}}},
+    {'$lookup': {'from': 'components', 'localField': 'joined', 'foreignField': '_id', 'as': 'joined'}},
+    {'$addFields': {'parts': {'$ifNull': ['$parts', {'$map': {'input': '$joined', 'in': {
+        'duration': {'$subtract': ['$$this.end', '$$this.start']}}}}]}}},
+    # cumulative duration of the embedded components (ms)
+    {'$addFields': {'duration': {'$sum': '$parts.duration'}}},
     # use hours instead of milliseconds
     {'$addFields': {'duration': {'$divide': ['$duration', 3.6e6]}}},
     {'$sort': {'start': 1}},
@@ -95,7 +83,7 @@ PIPELINE = [
     {'$project': {'shifts': 1}},
     {'$unwind': '$shifts'},
     {'$replaceRoot': {'newRoot': '$shifts'}},
-    {'$project': {'components': 0, 'state': 0, 'row': 0, 'weekYear': 0}},
+    {'$project': {'components': 0, 'parts': 0, 'joined': 0, 'state': 0, 'row': 0, 'weekYear': 0}},
 ]
 
 
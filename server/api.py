@@ -3,63 +3,219 @@
 # /shifts, /employees
 # gunicorn?
 import time
+import gzip
+import asyncio
+import hashlib
 import pymongo
 import configparser
 from aiohttp import web
 from datetime import datetime, timedelta
 import bson
 from bson.json_util import dumps
-from aiojobs.aiohttp import setup, spawn
-
-from util import get_mongo_db
-from graph import get_graph_data, get_weekly_graph_data
+from aiojobs.aiohttp import setup
+from collections import OrderedDict
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from util import get_mongo_db, tail
+from cache import ResponseCache, quantize
+import columnar
+import interval
+import paging
+from roster import watch_roster
+from calculate_rows import Layout, layout_rows
+from graph import get_graph_data, get_weekly_graph_data, iter_weekly_graph_data
 
 
 routes = web.RouteTableDef()
 
-async def coro():
-    print('sleeping...')
-    await asyncio.sleep(2)
-    print('done sleeping')
-
+# cached on-read layouts, by (minDate, maxDate, employee)
+LAYOUT_CACHE_SIZE = 128
+# how long to wait for the sync_history entry after a state snapshot, polled every SYNC_POLL seconds
+SYNC_TIMEOUT = 600
+SYNC_POLL = 1
+# streamed responses are written in chunks of about this many bytes
+STREAM_CHUNK = 64 * 1024
+
+# streamed formats by content type, a header document then one document per shift / bucket
+# bson documents start with their length so they are simply concatenated
+STREAM_TYPES = {
+    'application/x-ndjson': lambda doc: dumps(doc).encode() + b'\n',
+    'application/bson-seq': bson.encode,
+}
+
+# content codings by preference, brotli if installed
+ENCODINGS = {
+    **({'br': lambda body: brotli.compress(body, quality=5)} if brotli else {}),
+    'gzip': lambda body: gzip.compress(body, compresslevel=6),
+}
+# smaller bodies are sent as they are
+MIN_COMPRESS = 1024
 
 @routes.get('/recheck')
 async def recheck(request):
-    await spawn(request, coro())
+    # wakes the daemon, see scheduler.watch_triggers
+    db = request.app['db'].timeclock;
+    await db.triggers.insert_one({'date': datetime.utcnow()})
     return web.Response(text='checking')
 
 
+# plain response bodies by format name
+FORMATS = {
+    'json': lambda obj: dumps(obj).encode(),
+    'bson': bson.encode,
+}
+
+
+def encode(obj, name: str) -> dict:
+    '''
+    body of `obj` in the format `name` only, the others are cached separately once asked for
+    '''
+    return {name: FORMATS[name](obj)}
+
+
+# accepted content types by preference, and the encoded body each is served from
+RESPONSE_TYPES = [(columnar.CONTENT_TYPE, 'columnar'), ('application/bson', 'bson')]
+
+
+def negotiate_encoding(header: str):
+    '''
+    preferred content coding allowed by an Accept-Encoding header, None for identity
+    '''
+    accepted = {}
+    for part in header.split(','):
+        name, *params = [p.strip() for p in part.split(';')]
+        try:
+            accepted[name.lower()] = float(next((p[2:] for p in params if p.startswith('q=')), 1))
+        except ValueError:
+            pass
+    return next((encoding for encoding in ENCODINGS if accepted.get(encoding, accepted.get('*', 0)) > 0), None)
+
+
+def etag(app, key, variant: str) -> str:
+    '''
+    changes with every sync (and state snapshot / roster update) and every cache ttl, or every cache
+    bucket without one, so running durations of open shifts are not answered with 304s until the next sync
+    '''
+    period = app['cache'].ttl or app['cache_bucket'].total_seconds() or 1
+    parts = (*app['version'].values(), int(time.time() // period), key, variant)
+    return '"' + hashlib.sha1(repr(parts).encode()).hexdigest()[:24] + '"'
+
+
+def not_modified(request, tag: str) -> bool:
+    tags = [t.strip() for t in request.headers.get('if-none-match', '').split(',')]
+    return '*' in tags or tag in (t[2:] if t.startswith('W/') else t for t in tags)
+
+
+async def cached(request, key, compute, formats=('bson',)) -> web.Response:
+    '''
+    encoded response for `key` from the cache, or `compute(format name)` it
+    each format is cached on its own and only computed when asked for. answers If-None-Match without
+    computing anything, compressed bodies are cached next to the plain ones
+    '''
+    app, cache = request.app, request.app['cache']
+    accept = request.headers.get('accept', '')
+    name, content_type = next(((name, content_type) for content_type, name in RESPONSE_TYPES
+            if name in formats and content_type in accept), ('json', 'text/plain'))
+    encoding = negotiate_encoding(request.headers.get('accept-encoding', ''))
+    variant = f'{name}.{encoding}' if encoding else name
+
+    generation = cache.generation
+    tag = etag(app, key, variant)
+    headers = {'Vary': 'Accept, Accept-Encoding', 'Cache-Control': 'no-cache', 'ETag': tag}
+    if not_modified(request, tag):
+        return web.Response(status=304, headers=headers)
+
+    key = (*key, name)
+    bodies = await cache.fetch(key, lambda: compute(name))
+    if cache.generation != generation:
+        # changed while computing, the tag may not match the body
+        del headers['ETag']
+    body = bodies[name]
+    if encoding and len(body) >= MIN_COMPRESS:
+        if (compressed := bodies.get(variant)) is None:
+            compressed = ENCODINGS[encoding](body)
+            cache.add(key, variant, compressed)
+        body = compressed
+        headers['Content-Encoding'] = encoding
+    if name == 'json':
+        return web.Response(body=body, content_type=content_type, charset='utf-8', headers=headers)
+    return web.Response(body=body, content_type=content_type, headers=headers)
+
+
+def stream_type(request):
+    accept = request.headers.get('accept', '')
+    return next((content_type for content_type in STREAM_TYPES if content_type in accept), None)
+
+
+async def stream(request, content_type, header: dict, docs) -> web.StreamResponse:
+    '''
+    write `header` right away, then `docs` as they are read, never cached
+    '''
+    encode = STREAM_TYPES[content_type]
+    resp = web.StreamResponse()
+    resp.content_type = content_type
+    await resp.prepare(request)
+    await resp.write(encode(header))
+    buf = bytearray()
+    async for doc in docs:
+        buf += encode(doc)
+        if len(buf) >= STREAM_CHUNK:
+            await resp.write(buf)
+            buf = bytearray()
+    if buf:
+        await resp.write(buf)
+    await resp.write_eof()
+    return resp
+
+
+def date_range(app, q):
+    '''
+    minDate / maxDate widened to the cache bucket
+    '''
+    bucket = app['cache_bucket']
+    return quantize(q.get('minDate'), bucket), quantize(q.get('maxDate'), bucket, up=True)
+
+
 @routes.get('/data/graph')
 async def get_graph(request):
     db = request.app['db'].timeclock;
-    res = await get_graph_data(db)
-    return web.Response(text=dumps(res))
+
+    async def compute(name):
+        return encode(await get_graph_data(db), name)
+
+    return await cached(request, ('graph',), compute)
 
 
 @routes.get('/data/weekly')
 async def get_weekly_graph(request: web.Request):
     q = parse_qs(request.query)
-    min_date, max_date = q.get('minDate'), q.get('maxDate')
-
-    _range = [min_date, max_date or (datetime.now() + timedelta(hours=24))] if min_date is not None else None
+    min_date, max_date = date_range(request.app, q)
     db = request.app['db'].timeclock;
-    obj = await get_weekly_graph_data(db, _range)
-    obj = {'data': obj, 'minDate': min_date, 'maxDate': max_date}
-
-    if 'application/bson' in request.headers.get('accept'):
-        resp = web.StreamResponse()
-        resp.content_type = 'application/bson'
-        await resp.prepare(request) 
-        buf = bson.encode(obj)
-        resp.content_length = len(buf)
-        await resp.write(buf)
-    else:
-        resp = web.Response(text=dumps(obj))
-        resp.content_type = 'text/plain'
+    _range = [min_date, max_date or (datetime.now() + timedelta(hours=24))] if min_date is not None else None
+
+    if (content_type := stream_type(request)) is not None:
+        return await stream(request, content_type, {'minDate': min_date, 'maxDate': max_date},
+                iter_weekly_graph_data(db, _range))
+
+    async def compute(name):
+        obj = await get_weekly_graph_data(db, _range)
+        return encode({'data': obj, 'minDate': min_date, 'maxDate': max_date}, name)
+
+    return await cached(request, ('weekly', min_date, max_date), compute)
 
-    return resp
 
+# ms
+EXPECTED_DURATION = 1000 * 60 * 60 * 8
+MAX_DURATION = 13 * 60 * 60 * 1000
 
+# shifts per /data/shifts page, clients may ask for up to MAX_PAGE_SIZE with 'limit'
+PAGE_SIZE = 2000
+MAX_PAGE_SIZE = 10000
+
+# for shifts without embedded components, see SERVER.EMBEDDED_COMPONENTS
 SHIFTS_PIPELINE = [
     {'$unwind': '$components'},
     {'$lookup': {'from': 'components', 'localField': 'components', 'foreignField': '_id', 'as': 'components'}},
@@ -74,75 +230,246 @@ SHIFTS_PIPELINE = [
     {'$match': {'row': {'$ne': [None]}}},
     {'$addFields': {
         'id': {'$toString': '$_id'},
-        'expectedDuration': 1000 * 60 * 60 * 8,
+        'expectedDuration': EXPECTED_DURATION,
     }},
-    {'$match': {'duration': {'$lt': 13 * 60 * 60 * 1000}}},
-    {'$project': {'_id': 0}},
+    # back in paging.SORT order after the $group, longer than MAX_DURATION are dropped by the caller
+    {'$sort': {'start': 1, '_id': 1}},
+    {'$project': {'_id': 0, 'parts': 0, 'days': 0, 'relayout': 0}},
 ]
 
 @routes.get('/data/shifts')
 async def get_shifts(request):
     q = parse_qs(request.query)
+    min_date, max_date = date_range(request.app, q)
+    employee_id = q.get('employee')
+    layout = q.get('layout', request.app['layout'])
+
+    employees = await get_employees(request.app)
+    if employee_id and employee_id not in employees:
+        return web.HTTPNotFound(body=f'no employee with id: "{employee_id}"')
+    if employee_id:
+        employees = {employee_id: employees[employee_id]}
+
+    filters = (min_date, max_date, employee_id)
+    try:
+        position = paging.decode_token(q['after'], filters) if 'after' in q else None
+    except paging.InvalidToken as e:
+        return web.HTTPBadRequest(body=str(e))
+
+    if (content_type := stream_type(request)) is not None:
+        # not cut into pages, shifts are written as they are read
+        shifts = short(iter_shifts(request.app, paging.after(shifts_query(*filters), position)))
+        if layout == 'window':
+            shifts = laid_out(shifts, await window_rows(request.app, filters))
+        header = {'employees': employees, 'employeeIds': list(employees.keys())}
+        return await stream(request, content_type, header, shifts)
+
+    limit = q.get('limit', request.app['page_size'])
+    return await cached(request, ('shifts', *filters, layout, position, limit),
+            lambda name: get_shifts_data(request.app, filters, employees, layout, position, limit, name),
+            formats=('columnar', 'bson'))
+
+
+def from_parts(shift: dict, now: datetime) -> dict:
+    '''
+    shift document with embedded components as SHIFTS_PIPELINE returns it
+    '''
+    components = [{**c, 'id': str(c['_id']),
+            'duration': c['duration'] if c['end'] is not None else (now - c['start']) // timedelta(milliseconds=1)}
+            for c in shift.pop('parts')]
+    shift_id = shift.pop('_id')
+    return {**shift, 'components': components, 'duration': sum(c['duration'] for c in components),
+            'id': str(shift_id), 'expectedDuration': EXPECTED_DURATION}
+
+
+async def join_parts(db, component_ids) -> list:
+    '''
+    'parts' of a shift written before components were embedded
+    '''
+    components = await db.components.find({'_id': {'$in': component_ids}}, projection={'start': True, 'end': True},
+            sort=[('start', 1)]).to_list(None)
+    return [{**c, 'duration': None if c['end'] is None else (c['end'] - c['start']) // timedelta(milliseconds=1)}
+            for c in components]
+
+
+def shifts_query(min_date, max_date, employee_id) -> dict:
+    return interval.overlaps(min_date, max_date, employee_id or None)
+
+
+async def iter_shifts(app, query, limit=0):
+    '''
+    shifts in paging.SORT order, the first `limit` if given
+    including those longer than MAX_DURATION so a page can end on one, see short
+    '''
+    db = app['db'].timeclock;
+    if app['embedded']:
+        now = datetime.utcnow()
+        async for doc in db.shifts.find(query, projection={'days': False, 'relayout': False}, sort=paging.SORT, limit=limit):
+            if 'parts' not in doc:
+                # not migrated yet, see migrate.py embed
+                doc['parts'] = await join_parts(db, doc['components'])
+            yield from_parts(doc, now)
+    else:
+        pipeline = [{'$match': query}, {'$sort': dict(paging.SORT)}, *([{'$limit': limit}] if limit else []), *SHIFTS_PIPELINE]
+        async for shift in db.shifts.aggregate(pipeline):
+            yield shift
+
+
+async def shifts_page(app, query, limit):
+    '''
+    the first `limit` shifts matching `query` and the position after the last of them, None if there are
+    no more. the page is cut before the join, which drops shifts without components
+    '''
+    if app['embedded']:
+        shifts = [shift async for shift in iter_shifts(app, query, limit + 1)]
+        keys = [(shift['start'], bson.ObjectId(shift['id'])) for shift in shifts]
+    else:
+        keys = [(doc['start'], doc['_id']) async for doc in app['db'].timeclock.shifts.find(query,
+                projection={'start': True}, sort=paging.SORT, limit=limit + 1)]
+        # only the page is joined
+        shifts = [shift async for shift in iter_shifts(app, {'_id': {'$in': [_id for _, _id in keys[:limit]]}})]
+    return shifts[:limit], keys[limit - 1] if len(keys) > limit else None
+
+
+async def short(shifts):
+    async for shift in shifts:
+        if shift['duration'] < MAX_DURATION:
+            yield shift
+
+
+async def laid_out(shifts, rows):
+    '''
+    shifts with their row from window_rows
+    '''
+    async for shift in shifts:
+        shift['row'] = rows.get(shift['id'])
+        yield shift
+
+
+async def get_shifts_data(app, filters, employees, layout, position, limit, name: str = 'json') -> dict:
+    '''
+    one page of at most `limit` shifts after `position` encoded as `name`, 'next' is the token for the one
+    after it (None on the last page)
+    '''
+    page, last = await shifts_page(app, paging.after(shifts_query(*filters), position), limit)
+    next_token = paging.encode_token(*last, filters) if last is not None else None
+    shifts = [shift for shift in page if shift['duration'] < MAX_DURATION]
+    if layout == 'window':
+        rows = await window_rows(app, filters, [shift['id'] for shift in shifts])
+        for shift in shifts:
+            shift['row'] = rows.get(shift['id'])
+
+    if name == 'columnar':
+        return {name: columnar.encode_shifts(employees, list(employees.keys()), shifts, EXPECTED_DURATION, next_token)}
+    obj = {
+        'employees': employees,
+        'employeeIds': list(employees.keys()),
+        'shifts': shifts,
+        'next': next_token,
+    }
+    return encode(obj, name)
+
+
+async def get_employees(app):
+    '''
+    employee map by id, cached until the daemon announces a roster change
+    not kept if one arrived while it was loading
+    '''
+    if (employees := app['employees']) is None:
+        roster = app['version'].get('roster')
+        db = app['db'].timeclock
+        docs = await db.employees.find({}, projection={'_id': False, 'fingerprint': False}).to_list(None)
+        employees = {id: employee for employee in docs if (id := employee.get('id'))}
+        if app['version'].get('roster') == roster:
+            app['employees'] = employees
+    return employees
+
+
+async def window_rows(app, filters, ids=()) -> dict:
+    '''
+    rows for the shifts in `filters` laid out on their own (by id), cached until the next sync
+    computed over the whole range so pages and streams of it agree, only what the layout reads is kept
+    laid out again if any of `ids` is missing
+    '''
+    cache = app['layouts']
+    rows = cache.get(filters)
+    if rows is None or any(shift_id not in rows for shift_id in ids):
+        shifts = [{k: shift[k] for k in ('id', 'start', 'end', 'duration')}
+                async for shift in short(iter_shifts(app, shifts_query(*filters)))]
+        rows = cache[filters] = layout_rows(shifts, app['layout_rows'], key='id')
+        if len(cache) > LAYOUT_CACHE_SIZE:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(filters)
+    return rows
 
-    min_date, max_date = q.get('minDate'), q.get('maxDate')
-    limit = 2000
 
-    db = request.app['db'].timeclock;
+def drop_cached(app):
+    app['layouts'].clear()
+    app['cache'].clear()
 
-    if max_date is None and min_date is None:
-        query = {}
-    elif min_date is None:
-        query = {'start': {'$lt': max_date}}
-    elif max_date is None:
-        query = {'$or': [{'start': {'$gt': min_date}, 'end': None}, {'end': {'$gt': min_date}}]}
-    else: 
-        query = {
-            '$or': [
-                {'start': {'$gt': min_date, '$lt': max_date}},
-                {'$and': [{'end': None}, {'start': {'$lt': max_date}}]},
-                {'end': {'$gt': min_date, '$lt': max_date}},
-                {'$and': [{'start': {'$lt': min_date}}, {'end': {'$gt': max_date}}]},
-            ],
-        }
-
-    # uggglyy
-    #query['flagged'] = False
-
-    if employee_id := q.get('employee'):
-        employee = await db.employees.find_one({'id': employee_id}, projection={'_id': False})
-        if employee is None:
-            return web.HTTPNotFound(body=f'no employee with id: "{employee_id}"')
-        query['employee'] = employee_id
-        employees = {employee_id: employee}
-    else:
-        employees = await db.employees.find({}, projection={'_id': False}).to_list(100)
-        employees = {id: employee for employee in employees if (id := employee.get('id'))}
 
-    # ayy join
+async def latest_id(collection):
+    return d['_id'] if (d := await collection.find_one({}, projection={'_id': True}, sort=[('_id', pymongo.DESCENDING)])) else None
 
 
-    pipeline = [{'$match': query}, *SHIFTS_PIPELINE]
+async def load_version(db) -> dict:
+    '''
+    latest state snapshot, sync and roster update, the same in every api process
+    '''
+    return {'state': await latest_id(db.state), 'sync': await latest_id(db.sync_history),
+            'roster': await latest_id(db.roster_updates)}
 
-    shifts = await db.shifts.aggregate(pipeline).to_list(None)
 
-    obj = {
-        'employees': employees,
-        'employeeIds': list(employees.keys()),
-        'shifts': shifts,
-    }
+async def watch_syncs(app):
+    # the daemon writes a state snapshot once shifts are merged and a sync_history entry once rows are
+    # laid out, cached responses are dropped on both. sync_history is not capped so it is polled until then,
+    # next to the tail so the next snapshot is not held up
+    db = app['db'].timeclock
+    waiting = None
+    try:
+        async for doc in tail(db.state):
+            app['version']['state'] = doc['_id']
+            drop_cached(app)
+            if waiting is not None:
+                waiting.cancel()
+            waiting = asyncio.create_task(wait_for_sync(app))
+    finally:
+        if waiting is not None:
+            waiting.cancel()
 
-    if 'application/bson' in request.headers.get('accept'):
-        resp = web.StreamResponse()
-        resp.content_type = 'application/bson'
-        await resp.prepare(request) 
-        buf = bson.encode(obj)
-        resp.content_length = len(buf)
-        await resp.write(buf)
-    else:
-        resp = web.Response(text=dumps(obj))
-        resp.content_type = 'text/plain'
 
-    return resp
+async def wait_for_sync(app):
+    '''
+    poll sync_history until an entry follows the last one seen, up to SYNC_TIMEOUT
+    '''
+    db = app['db'].timeclock
+    for _ in range(int(SYNC_TIMEOUT / SYNC_POLL)):
+        await asyncio.sleep(SYNC_POLL)
+        if (sync := await latest_id(db.sync_history)) != app['version']['sync']:
+            app['version']['sync'] = sync
+            drop_cached(app)
+            break
+
+
+async def watch_employees(app):
+    def invalidate(doc):
+        app['employees'] = None
+        app['version']['roster'] = doc['_id']
+        # the employee map is part of /data/shifts
+        app['cache'].clear()
+    await watch_roster(app['db'].timeclock, invalidate)
+
+
+async def start_background_tasks(app):
+    app['version'] = await load_version(app['db'].timeclock)
+    app['watch_employees'] = asyncio.create_task(watch_employees(app))
+    app['watch_syncs'] = asyncio.create_task(watch_syncs(app))
+
+
+async def cleanup_background_tasks(app):
+    app['watch_employees'].cancel()
+    app['watch_syncs'].cancel()
 
 
 def parse_qs(query):
@@ -159,6 +486,16 @@ def parse_qs(query):
             result['employee'] = query['employee']
         except ValueError:
             pass
+    if 'limit' in query:
+        try:
+            result['limit'] = min(max(int(query['limit']), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            pass
+    if 'after' in query:
+        result['after'] = query['after']
+    # 'stored' rows written by the daemon, or 'window' to lay out just the requested shifts
+    if query.get('layout') in ('stored', 'window'):
+        result['layout'] = query['layout']
 
     return result
 
@@ -169,6 +506,18 @@ async def main():
     app = web.Application()
     app.add_routes(routes)
     app['db'] = await get_mongo_db(config['MONGO'])
+    app['employees'] = None
+    app['layout'] = config.get('SERVER', 'layout', fallback='stored')
+    app['layout_rows'] = Layout.from_config(config['DAEMON'] if config.has_section('DAEMON') else {})
+    app['layouts'] = OrderedDict()
+    app['embedded'] = config.getboolean('SERVER', 'embedded_components', fallback=False)
+    app['cache'] = ResponseCache(config.getint('SERVER', 'cache_max_entries', fallback=256),
+            config.getint('SERVER', 'cache_max_mb', fallback=64) * 2 ** 20,
+            config.getfloat('SERVER', 'cache_ttl', fallback=60))
+    app['page_size'] = min(config.getint('SERVER', 'page_size', fallback=PAGE_SIZE), MAX_PAGE_SIZE)
+    app['cache_bucket'] = timedelta(seconds=config.getfloat('SERVER', 'cache_bucket', fallback=300))
+    app.on_startup.append(start_background_tasks)
+    app.on_cleanup.append(cleanup_background_tasks)
     setup(app)
     return app
 
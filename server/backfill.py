@@ -0,0 +1,143 @@
+# rebuild components / shifts for an arbitrary date range
+# employees are partitioned across a process pool, each worker fetches its slice,
+# assembles shifts in memory and writes them, rows are recalculated once at the end
+# workers checkpoint after each window / employee chunk, running the same command again resumes
+#
+# python backfill.py --from 2015-01-01 [--to 2020-01-01] [--workers 4] [--ingest mysql]
+import sys
+import hashlib
+import asyncio
+import logging
+import argparse
+import configparser
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from bson.codec_options import CodecOptions, TypeRegistry
+
+from util import get_async_rpc_connection, get_mysql_db, get_mongo_db
+from daemon import fetch_timecards, merge_windows, parse_timecards, timedelta_encoder
+from checkpoint import Checkpoint
+from punches import fetch_punches
+from calculate_rows import Layout, recalculate
+
+# timecards are requested by local date, pad so components near the edges are not missed
+PAD = timedelta(days=1)
+
+
+async def get_range(mongo_db, employee_ids, from_date, to_date):
+    '''
+    widen [from_date, to_date) so no existing shift straddles either edge
+    '''
+    async for shift in mongo_db.shifts.find({'employee': {'$in': employee_ids},
+            'start': {'$lt': from_date}, '$or': [{'end': None}, {'end': {'$gt': from_date}}]}):
+        from_date = min(from_date, shift['start'])
+    async for shift in mongo_db.shifts.find({'employee': {'$in': employee_ids},
+            'start': {'$lt': to_date}, '$or': [{'end': None}, {'end': {'$gt': to_date}}]}):
+        to_date = max(to_date, shift['end'] or datetime.utcnow())
+    return from_date, to_date
+
+
+async def in_range(windows, from_date, to_date):
+    async for a, b, employee_components in windows:
+        yield a, b, [(employee_id, [c for c in it if c['start'] is not None and from_date <= c['start'] < to_date])
+                for employee_id, it in employee_components]
+
+
+async def rebuild(config, employee_ids, from_date, to_date, chunk_size=50, concurrency=4, ingest='rpc'):
+    '''
+    replace components / shifts for `employee_ids` in [from_date, to_date)
+    punches are read from tam.tr_clock if `ingest` is 'mysql'
+    returns the number of components written and the (possibly widened) start of the range
+    '''
+    mongo_client = await get_mongo_db(config['MONGO'])
+    proxy = get_async_rpc_connection(config['AMG'])
+    mysql_db = await get_mysql_db(config['MYSQL']) if ingest == 'mysql' else None
+    mongo_db = mongo_client.timeclock
+    type_registry = TypeRegistry(fallback_encoder=timedelta_encoder)
+    shifts_col = mongo_db.get_collection('shifts', codec_options=CodecOptions(type_registry=type_registry))
+    ids = [str(employee_id) for employee_id in employee_ids]
+
+    # same command, same partition
+    name = f'backfill {from_date.isoformat()} {hashlib.sha1(",".join(ids).encode()).hexdigest()[:12]}'
+
+    try:
+        if (checkpoint := await Checkpoint.load(mongo_db, name)) is not None:
+            from_date, to_date = checkpoint.doc['min_date'], checkpoint.doc['end_date']
+            logging.info(f'resuming {len(ids)} employees {from_date} - {to_date} from {checkpoint.window}')
+        else:
+            from_date, to_date = await get_range(mongo_db, ids, from_date, to_date)
+            logging.info(f'rebuilding {len(ids)} employees {from_date} - {to_date}')
+
+            query = {'employee': {'$in': ids}, 'start': {'$gte': from_date, '$lt': to_date}}
+            await mongo_db.shifts.delete_many(query)
+            await mongo_db.components.delete_many(query)
+            checkpoint = await Checkpoint.start(mongo_db, name, from_date, to_date, from_date - PAD)
+
+        if mysql_db is None:
+            windows = ((a, b, parse_timecards(timecards)) async for a, b, timecards in fetch_timecards(proxy,
+                    employee_ids, checkpoint.window, to_date + PAD, chunk_size=chunk_size, concurrency=concurrency))
+        else:
+            windows = fetch_punches(mysql_db, employee_ids, checkpoint.window, to_date + PAD)
+
+        count = await merge_windows(mongo_db, shifts_col, in_range(windows, from_date, to_date),
+                chunk_size=chunk_size, checkpoint=checkpoint)
+        await checkpoint.finish()
+        return count, from_date
+    finally:
+        await proxy.close()
+        if mysql_db is not None:
+            mysql_db.close()
+            await mysql_db.wait_closed()
+        mongo_client.close()
+
+
+def run_worker(config, employee_ids, from_date, to_date, chunk_size, concurrency, ingest):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(process)d %(message)s')
+    return asyncio.run(rebuild(config, employee_ids, from_date, to_date, chunk_size, concurrency, ingest))
+
+
+async def main(config, from_date, to_date, workers, ingest='rpc'):
+    mongo_client = await get_mongo_db(config['MONGO'])
+    mongo_db = mongo_client.timeclock
+    employee_ids = sorted(int(empl['id']) for empl in await mongo_db.employees.find({}).to_list(None))
+    chunk_size = int(config['AMG'].get('chunk_size', 50))
+    concurrency = int(config['AMG'].get('concurrency', 4))
+
+    # interleave so long-tenured employees spread across workers
+    partitions = [employee_ids[i::workers] for i in range(workers)]
+    loop = asyncio.get_running_loop()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = await asyncio.gather(*[loop.run_in_executor(executor, run_worker, config, ids,
+                from_date, to_date, chunk_size, concurrency, ingest) for ids in partitions if ids])
+        logging.info(f'rebuilt {sum(count for count, _ in results)} components, recalculating rows')
+        # shifts were deleted, the saved frontiers after them are not to be trusted
+        await recalculate(mongo_db, min((d for _, d in results), default=from_date),
+                Layout.from_config(config.get('DAEMON', {})), converge=False)
+    finally:
+        mongo_client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='rebuild components / shifts for a date range')
+    parser.add_argument('--from', dest='from_date', type=datetime.fromisoformat, required=True)
+    parser.add_argument('--to', dest='to_date', type=datetime.fromisoformat, default=datetime.utcnow())
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--ingest', choices=['rpc', 'mysql'], help='punch source, defaults to DAEMON.INGEST')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    ingest = args.ingest or config.get('DAEMON', 'ingest', fallback='rpc')
+    # plain dicts so sections can be sent to worker processes
+    config = {section: dict(config[section]) for section in config.sections()}
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(process)d %(message)s')
+    logging.info('backfill starting up')
+    sys.stdout.flush()
+    try:
+        asyncio.run(main(config, args.from_date, args.to_date, args.workers, ingest))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logging.info('closing')
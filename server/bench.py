@@ -0,0 +1,186 @@
+# sync throughput benchmarks
+# runs daemon.update + calculate_rows.recalculate against a local mongod and the mocking.py stand-in
+# reports components/sec, mongo operations per component, rpc wait time and peak rss
+#
+# python bench.py --employees 50 --years 2 --latency 0.1 --output bench.json [--compare previous.json]
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+import configparser
+from collections import Counter
+from datetime import datetime, timedelta
+from aiohttp import web
+from pymongo import monitoring
+
+import mocking
+from util import get_async_rpc_connection, get_mongo_db
+from daemon import update, get_sunday
+from calculate_rows import recalculate
+
+# fixed so runs are comparable
+END = datetime(2020, 6, 3, 12)
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.counts = Counter()
+
+    def started(self, event):
+        self.counts[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def total(self):
+        return sum(v for k, v in self.counts.items() if k not in ('ismaster', 'isMaster', 'hello', 'endSessions'))
+
+
+class TimedProxy:
+    '''
+    wraps the rpc proxy, accumulates time spent waiting on GetTimecards
+    '''
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.wait = 0
+        self.calls = 0
+
+    async def GetTimecards(self, *args):
+        t = time.perf_counter()
+        try:
+            return await self.proxy.GetTimecards(*args)
+        finally:
+            self.wait += time.perf_counter() - t
+            self.calls += 1
+
+    async def close(self):
+        await self.proxy.close()
+
+
+async def run(name, db, proxy, counter, min_date, now, **kwargs):
+    counter.counts.clear()
+    proxy.wait, proxy.calls = 0, 0
+    components = await db.components.count_documents({})
+
+    t = time.perf_counter()
+    await update(db, proxy, min_date, now, **kwargs)
+    t_update = time.perf_counter() - t
+    await recalculate(db, min_date)
+    elapsed = time.perf_counter() - t
+
+    # components touched, new ones plus the ones re-synced in the window
+    touched = await db.components.count_documents({'start': {'$gte': min_date}})
+    ops = counter.total()
+    result = {
+        'seconds': elapsed,
+        'updateSeconds': t_update,
+        'recalculateSeconds': elapsed - t_update,
+        'components': touched,
+        'newComponents': await db.components.count_documents({}) - components,
+        'componentsPerSecond': touched / elapsed if elapsed else None,
+        'mongoOps': ops,
+        'mongoOpsPerComponent': ops / touched if touched else None,
+        'mongoOpsByCommand': dict(counter.counts),
+        'rpcCalls': proxy.calls,
+        'rpcWaitSeconds': proxy.wait,
+        # kilobytes on linux, peak for the whole process so far
+        'peakRss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    logging.info(f'{name}: {json.dumps(result)}')
+    return result
+
+
+def late_edit(timecards, now, rng, weeks=3, count=10):
+    '''
+    edit punches a few weeks back, returns the earliest edited date
+    '''
+    cutoff = now - timedelta(weeks=weeks)
+    candidates = [t for items in timecards.values() for t in items if cutoff <= t['Date'] < cutoff + timedelta(days=7)
+            and 'StopPunch' in t]
+    for t in rng.sample(candidates, min(count, len(candidates))):
+        t['StopPunch'] = {**t['StopPunch'], 'OriginalDate': t['StopPunch']['OriginalDate'] + timedelta(minutes=rng.randint(5, 60))}
+    return cutoff
+
+
+async def main(config, args):
+    timecards = mocking.Timecards(mocking.generate(args.employees, args.years, args.seed, END), args.latency, args.jitter)
+    runner = web.AppRunner(mocking.create_app(timecards))
+    await runner.setup()
+    await web.TCPSite(runner, 'localhost', args.port).start()
+
+    counter = CommandCounter()
+    mongo_client = await get_mongo_db(config['MONGO'], event_listeners=[counter])
+    await mongo_client.drop_database(args.database)
+    db = mongo_client[args.database]
+    await db.employees.insert_many([{'id': str(i)} for i in timecards.timecards])
+    await db.components.create_index('start')
+    await db.components.create_index('end')
+    await db.components.create_index('employee')
+
+    proxy = TimedProxy(get_async_rpc_connection({'host': 'localhost', 'port': args.port,
+        'username': 'admin', 'password': 'password'}))
+    kwargs = {'batched': not args.sequential, 'chunk_size': args.chunk_size, 'concurrency': args.concurrency}
+
+    results = {}
+    try:
+        start = END - timedelta(days=365 * args.years)
+        results['cold'] = await run('cold', db, proxy, counter, get_sunday(start), END, **kwargs)
+        results['steady'] = await run('steady', db, proxy, counter, get_sunday(END), END, **kwargs)
+        min_date = late_edit(timecards.timecards, END, random.Random(args.seed))
+        results['lateEdit'] = await run('lateEdit', db, proxy, counter, get_sunday(min_date), END, **kwargs)
+    finally:
+        await proxy.close()
+        await runner.cleanup()
+        if not args.keep:
+            await mongo_client.drop_database(args.database)
+        mongo_client.close()
+
+    return {'date': datetime.utcnow().isoformat(), 'args': vars(args), 'results': results}
+
+
+def compare(previous, current):
+    for scenario, result in current['results'].items():
+        if (before := previous['results'].get(scenario)) is None:
+            continue
+        for key in ['seconds', 'componentsPerSecond', 'mongoOpsPerComponent', 'rpcWaitSeconds', 'peakRss']:
+            a, b = before.get(key), result.get(key)
+            change = f'{b / a:.2f}x' if a and b is not None else '-'
+            print(f'{scenario:10} {key:22} {a!s:>24} {b!s:>24} {change:>8}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='sync throughput benchmarks')
+    parser.add_argument('--employees', type=int, default=20)
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--port', type=int, default=3013)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--chunk-size', type=int, default=50)
+    parser.add_argument('--sequential', action='store_true', help='use the per-component update path')
+    parser.add_argument('--database', default='timeclock_bench')
+    parser.add_argument('--keep', action='store_true', help='keep the benchmark database')
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--compare', help='previous results to compare with')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    if not config.has_section('MONGO'):
+        config['MONGO'] = {'host': 'localhost', 'port': '27017'}
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    result = asyncio.run(main(config, args))
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
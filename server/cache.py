@@ -0,0 +1,114 @@
+# in-process cache of encoded api responses
+# keys are normalized query parameters with dates quantized to a bucket, so clients asking for
+# "the last week" every few seconds share an entry. bodies are kept encoded, an entry per format (json,
+# bson...), bounded by entry count and total size, least recently used first out. entries are dropped when the daemon
+# finishes a sync (see api.watch_syncs) and after `ttl` so running durations stay fresh.
+# compressed variants are added to an entry as they are asked for
+import time
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def quantize(date: Optional[datetime], bucket: timedelta, up: bool = False) -> Optional[datetime]:
+    '''
+    floor `date` to a multiple of `bucket` (ceil if `up`), timezone aware dates keep their tzinfo
+    '''
+    if date is None or not bucket:
+        return date
+    epoch = EPOCH.replace(tzinfo=date.tzinfo)
+    offset = (date - epoch) % bucket
+    if not offset:
+        return date
+    return date - offset + (bucket if up else timedelta())
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 2 ** 20, ttl: float = 60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key: (created, {format: body})
+        self.entries = OrderedDict()
+        self.size = 0
+        # bumped on clear, results computed before that are not stored
+        self.generation = 0
+        self.pending: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: Hashable) -> Optional[Dict[str, bytes]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        created, bodies = entry
+        if self.ttl and time.monotonic() - created > self.ttl:
+            self.pop(key)
+            return None
+        self.entries.move_to_end(key)
+        return bodies
+
+    def put(self, key: Hashable, bodies: Dict[str, bytes]):
+        size = sum(map(len, bodies.values()))
+        if size > self.max_bytes:
+            return
+        self.pop(key)
+        self.entries[key] = (time.monotonic(), bodies)
+        self.size += size
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            self.pop(next(iter(self.entries)))
+
+    def add(self, key: Hashable, name: str, body: bytes):
+        '''
+        store another variant (compressed...) of a cached entry, dropped with it
+        '''
+        if (entry := self.entries.get(key)) is None or name in entry[1]:
+            return
+        entry[1][name] = body
+        self.size += len(body)
+        while self.size > self.max_bytes and self.entries:
+            self.pop(next(iter(self.entries)))
+
+    def pop(self, key: Hashable):
+        if (entry := self.entries.pop(key, None)) is not None:
+            self.size -= sum(map(len, entry[1].values()))
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+        self.generation += 1
+
+    async def fetch(self, key: Hashable, compute: Callable[[], Awaitable[Optional[Dict[str, bytes]]]]) -> Optional[Dict[str, bytes]]:
+        '''
+        cached bodies for `key`, or those returned by `compute` (not stored if None)
+        concurrent misses on the same key wait for the same computation, it runs in its own task so
+        a caller going away (a client disconnecting) does not cancel it for the others
+        '''
+        if (bodies := self.get(key)) is not None:
+            self.hits += 1
+            return bodies
+        if (task := self.pending.get(key)) is not None:
+            self.hits += 1
+            return await asyncio.shield(task)
+        self.misses += 1
+        generation = self.generation
+
+        async def run():
+            try:
+                bodies = await compute()
+            finally:
+                self.pending.pop(key, None)
+            if bodies is not None and generation == self.generation:
+                self.put(key, bodies)
+            return bodies
+
+        task = self.pending[key] = asyncio.ensure_future(run())
+        # retrieved here so an error nobody waited for is not logged
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return await asyncio.shield(task)
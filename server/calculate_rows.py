@@ -1,49 +1,240 @@
+# display rows for shifts
+# the layout state (which rows are busy until when) is saved at each day boundary in 'layout_frontiers'.
+# recalculating from a date restores the latest frontier before it and only lays out the shifts after that,
+# only rows that changed are written. shifts a sync moved are marked 'relayout', past the last of them the
+# layout stops at the first day it is back to the saved frontier
+import heapq
 import asyncio
 import pymongo
 import configparser
 from pprint import pprint
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Iterable, List
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
 
 from util import get_mongo_db
 
-PIPELINE = [
-    {'$unwind': {'path': '$components', 'preserveNullAndEmptyArrays': True}},
-    {'$lookup': {'from': 'components', 'localField': 'components', 'foreignField': '_id', 'as': 'components'}},
-    {'$unwind': {'path': '$components', 'preserveNullAndEmptyArrays': True}},
-    {'$addFields': {'components.duration': {'$subtract': [{'$ifNull': ['$components.end', '$$NOW']}, '$components.start']}}},
-    {'$group': {'_id': '$_id', 'components': {'$push': '$components'}, 'root': {'$first': '$$ROOT'}}},
-    {'$addFields': {'root.components': '$components'}},
-    {'$replaceRoot': {'newRoot': '$root'}},
-    {'$addFields': {'duration': {'$map': {'input': '$components', 'as': 'comp', 'in': '$$comp.duration'}}}},
-    {'$addFields': {'duration': {'$sum': '$duration'}, 'end': {'$ifNull': ['$end', '$$NOW']}}},
-    {'$sort': {'start': 1}},
-    #{'$match': {'duration': {'$lt': 16 * 60 * 60 * 1000}}},
-]
-
-async def recalculate(mongo_db, from_date = None):
-    rows = []
-    if from_date:
-        async for shift in mongo_db.shifts.find({'start': {'$lt': from_date}, 'end': {'$gt': from_date}}):
-            rows.append(shift)
-        rows = [s['end'] for s in sorted(rows, key=lambda s: s['row'])]
-        pipeline = [{'$match': {'start': {'$gt': from_date}}}, *PIPELINE]
+MAX_ROWS = 30
+# drawn on their own row, out of the way
+LONG_SHIFT = timedelta(hours=16)
+LONG_SHIFT_ROW = 18
+
+PROJECTION = {'start': True, 'end': True, 'row': True, 'components': True, 'parts': True, 'relayout': True}
+
+
+class Layout:
+    '''
+    first-fit display rows, each shift takes the lowest row that is free before it starts
+    free rows and busy rows (by end) are kept in heaps so each shift costs O(log rows)
+
+    shifts longer than `long_shift` go to `long_shift_row` without taking it, once all `max_rows`
+    rows are taken shifts overflow into the last one (again without taking it)
+    '''
+    def __init__(self, max_rows: int = MAX_ROWS, long_shift: timedelta = LONG_SHIFT, long_shift_row: int = LONG_SHIFT_ROW):
+        self.max_rows = max_rows
+        self.long_shift = long_shift
+        self.long_shift_row = long_shift_row
+        self.reset()
+
+    def reset(self):
+        self.size = 0
+        self.free = []
+        # (end, row, shift id if still open)
+        self.busy = []
+
+    @classmethod
+    def from_config(cls, section) -> 'Layout':
+        '''
+        from DAEMON.LAYOUT_* (configparser section or plain dict)
+        '''
+        return cls(int(section.get('layout_max_rows', MAX_ROWS)),
+                timedelta(hours=float(section.get('layout_long_shift_hours', LONG_SHIFT.total_seconds() / 3600))),
+                int(section.get('layout_long_shift_row', LONG_SHIFT_ROW)))
+
+    def occupy(self, end: datetime, open_id=None) -> int:
+        '''
+        take the next new row until `end`
+        '''
+        row = self.size
+        self.size += 1
+        heapq.heappush(self.busy, (end, row, open_id))
+        return row
+
+    def assign(self, start: datetime, end: datetime, duration: timedelta, open_id=None) -> int:
+        if duration > self.long_shift:
+            return self.long_shift_row
+        while self.busy and self.busy[0][0] < start:
+            if (row := heapq.heappop(self.busy)[1]) < self.max_rows:
+                heapq.heappush(self.free, row)
+        if self.free:
+            row = heapq.heappop(self.free)
+            heapq.heappush(self.busy, (end, row, open_id))
+            return row
+        if self.size < self.max_rows:
+            return self.occupy(end, open_id)
+        return self.max_rows - 1
+
+    def snapshot(self) -> dict:
+        return {'size': self.size, 'free': sorted(self.free), 'busy': [list(b) for b in sorted(self.busy)]}
+
+    def matches(self, frontier: dict) -> bool:
+        '''
+        in the state saved in `frontier`, so the same shifts after it get the same rows
+        open shifts are busy until whenever now was, each row is busy once
+        '''
+        def busy(entries):
+            return {row: (None if open_id is not None else end, open_id) for end, row, open_id in entries}
+        return (self.size == frontier['size'] and sorted(self.free) == frontier['free']
+                and busy(self.busy) == busy(frontier['busy']))
+
+    def restore(self, frontier: dict, ends: dict, now: datetime):
+        '''
+        continue from a snapshot, `ends` holds the current end of the shifts that were open then
+        (None if still open, missing if gone)
+        '''
+        self.reset()
+        self.size = frontier['size']
+        self.free = list(frontier['free'])
+        for end, row, open_id in frontier['busy']:
+            if open_id is not None:
+                if open_id not in ends:
+                    # removed since, the row is free from the frontier on
+                    end = frontier['position']
+                else:
+                    end = ends[open_id] or now
+                    open_id = open_id if ends[open_id] is None else None
+            self.busy.append((end, row, open_id))
+        heapq.heapify(self.free)
+        heapq.heapify(self.busy)
+
+
+def layout_rows(shifts: Iterable[dict], layout: Layout = None, now: datetime = None, key: str = '_id') -> dict:
+    '''
+    rows for `shifts` laid out on their own, by `key`
+    shifts need start, end and duration (ms, running duration for open shifts)
+    '''
+    layout = layout or Layout()
+    layout.reset()
+    now = now or datetime.utcnow()
+    return {shift[key]: layout.assign(shift['start'], shift['end'] or now, timedelta(milliseconds=shift['duration']))
+            for shift in sorted(shifts, key=lambda s: (s['start'], str(s[key])))}
+
+
+async def durations(mongo_db, shifts: List[dict], now: datetime) -> dict:
+    '''
+    duration of `shifts` as the sum of their components, open components counted until `now`
+    (the stored duration is 0 while any component is open, even after the shift has ended)
+    '''
+    # shifts written before components were embedded
+    components = {}
+    if missing := [cid for s in shifts if 'parts' not in s for cid in s['components']]:
+        components = {c['_id']: c async for c in mongo_db.components.find({'_id': {'$in': missing}},
+                projection={'start': True, 'end': True})}
+
+    def duration(shift):
+        parts = shift['parts'] if 'parts' in shift else [c for cid in shift['components'] if (c := components.get(cid))]
+        return sum(((c['end'] or now) - c['start'] for c in parts), timedelta())
+    return {s['_id']: duration(s) for s in shifts}
+
+
+async def recalculate(mongo_db, from_date = None, layout: Layout = None, batch_size: int = 1000,
+        converge: bool = True) -> int:
+    '''
+    assign rows to shifts starting after `from_date` (all if None), only changed rows are written
+    shifts marked 'relayout' (moved since they were laid out, see reconcile) are laid out even if earlier.
+    with `converge` it stops at the first day after the last marked shift where the layout is back to the
+    stored frontier, rows past it can not have changed
+    returns the number of shifts updated
+    '''
+    layout = layout or Layout()
+    now = datetime.utcnow()
+
+    if from_date is not None and (marked := await mongo_db.shifts.find_one({'relayout': True, 'start': {'$lt': from_date}},
+            projection={'start': True}, sort=[('start', 1)])) is not None:
+        from_date = marked['start']
+
+    frontier = None
+    if from_date is not None:
+        frontier = await mongo_db.layout_frontiers.find_one({'position': {'$lte': from_date}},
+                sort=[('position', pymongo.DESCENDING)])
+    if frontier is not None:
+        open_ids = [open_id for _, _, open_id in frontier['busy'] if open_id is not None]
+        ends = {s['_id']: s['end'] async for s in mongo_db.shifts.find({'_id': {'$in': open_ids}}, projection={'end': True})}
+        layout.restore(frontier, ends, now)
+        position = frontier['position']
+        query = {'start': {'$gte': position}}
     else:
-        pipeline = PIPELINE
+        layout.reset()
+        position = None
+        query = {}
+
+    until = None
+    if converge:
+        last = await mongo_db.shifts.find_one({**query, 'relayout': True}, projection={'start': True}, sort=[('start', -1)])
+        until = last['start'] if last is not None else (position or datetime.min)
+        # open shifts only move once they run past long_shift
+        open_shifts = await mongo_db.shifts.find({**query, 'end': None}, projection=PROJECTION).to_list(None)
+        times = await durations(mongo_db, open_shifts, now)
+        for shift in open_shifts:
+            if times[shift['_id']] > layout.long_shift and shift.get('row') != layout.long_shift_row:
+                until = max(until, shift['start'])
+
+    ops = []
+    frontiers = []
+    count = 0
+
+    async def flush():
+        # rows before the frontiers that cover them
+        nonlocal ops, frontiers, count
+        if ops:
+            await mongo_db.shifts.bulk_write(ops, ordered=False)
+            count += len(ops)
+        if frontiers:
+            await mongo_db.layout_frontiers.bulk_write(frontiers)
+        ops, frontiers = [], []
+
+    async def lay_out(shifts) -> bool:
+        '''
+        True once the layout converged
+        '''
+        nonlocal position
+        times = await durations(mongo_db, shifts, now)
+        for shift in shifts:
+            day = shift['start'].replace(hour=0, minute=0, second=0, microsecond=0)
+            if position is None or day > position:
+                if until is not None and day > until:
+                    stored = await mongo_db.layout_frontiers.find_one({'position': day})
+                    if stored is not None and layout.matches(stored):
+                        return True
+                # days without shifts anymore
+                frontiers.append(DeleteMany({'position': {'$gt': position, '$lt': day}} if position else {'position': {'$lt': day}}))
+                frontiers.append(ReplaceOne({'position': day}, {'position': day, **layout.snapshot()}, upsert=True))
+                position = day
+
+            if shift['end'] is None:
+                row = layout.assign(shift['start'], now, times[shift['_id']], shift['_id'])
+            else:
+                row = layout.assign(shift['start'], shift['end'], times[shift['_id']])
 
-    now = datetime.now()
-    async for shift in mongo_db.shifts.aggregate(pipeline):
-        if shift['duration'] > 16 * 60 * 60 * 1000:
-            await mongo_db.shifts.update_one({'_id': shift['_id']}, {'$set': {'row': 18}})
-            continue
-        for row in range(30):
-            if row > len(rows) - 1:
-                rows.append(shift['end'] or now)
-                break
-            elif (date := rows[row]) is None or date < shift['start']:
-                rows[row] = shift['end'] or now
-                break
+            update = {}
+            if shift.get('row') != row:
+                update['$set'] = {'row': row}
+            if shift.get('relayout'):
+                update['$unset'] = {'relayout': True}
+            if update:
+                ops.append(UpdateOne({'_id': shift['_id']}, update))
+            if len(ops) >= batch_size or len(frontiers) >= batch_size:
+                await flush()
+        return False
 
-        await mongo_db.shifts.update_one({'_id': shift['_id']}, {'$set': {'row': row}})
+    cursor = mongo_db.shifts.find(query, projection=PROJECTION, sort=[('start', 1), ('_id', 1)])
+    converged = False
+    while not converged and (shifts := await cursor.to_list(batch_size)):
+        converged = await lay_out(shifts)
+    if not converged:
+        frontiers.append(DeleteMany({'position': {'$gt': position}} if position else {}))
+    await flush()
+    return count
 
 
 async def main():
@@ -51,7 +242,8 @@ async def main():
     config.read('config.ini')
     mongo_client = await get_mongo_db(config['MONGO'])
     mongo_db = mongo_client.timeclock
-    await recalculate(mongo_db)
+    await recalculate(mongo_db, layout=Layout.from_config(config['DAEMON'] if config.has_section('DAEMON') else {}),
+            converge=False)
     mongo_client.close()
 
 
@@ -0,0 +1,55 @@
+# durable progress of long syncs in the 'sync_checkpoints' collection
+# a run's document is updated after each employee chunk is written and removed once the run finishes,
+# a restarted run resumes from the window it was in and skips the employees already written there.
+# a chunk written but not yet checkpointed is merged again, reconcile matches on (employee, start) so
+# nothing is duplicated
+#
+# {'_id': 'daemon', 'started': ..., 'min_date': ..., 'end_date': ..., 'window': ..., 'done': ['1', '2', ...], ...}
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+
+class Checkpoint:
+    def __init__(self, collection, doc: dict):
+        self.collection = collection
+        self.doc = doc
+
+    @classmethod
+    async def load(cls, mongo_db, name: str) -> Optional['Checkpoint']:
+        doc = await mongo_db.sync_checkpoints.find_one({'_id': name})
+        return cls(mongo_db.sync_checkpoints, doc) if doc is not None else None
+
+    @classmethod
+    async def start(cls, mongo_db, name: str, min_date: datetime, end_date: datetime, window: datetime = None,
+            **fields) -> 'Checkpoint':
+        '''
+        record a new run, `fields` are kept for resuming (mode, employee ids...)
+        '''
+        doc = {'_id': name, 'started': datetime.utcnow(), 'min_date': min_date, 'end_date': end_date,
+                'window': window or min_date, 'done': [], **fields}
+        await mongo_db.sync_checkpoints.replace_one({'_id': name}, doc, upsert=True)
+        return cls(mongo_db.sync_checkpoints, doc)
+
+    @property
+    def window(self) -> datetime:
+        '''
+        start of the window in progress
+        '''
+        return self.doc['window']
+
+    def pending(self, window: datetime, employee_ids: Iterable[str]) -> List[str]:
+        done = set(self.doc['done']) if window == self.doc['window'] else set()
+        return [employee_id for employee_id in employee_ids if employee_id not in done]
+
+    async def commit(self, window: datetime, employee_ids: Iterable[str]):
+        '''
+        `employee_ids` are written up to the end of `window`
+        '''
+        if window != self.doc['window']:
+            self.doc.update({'window': window, 'done': []})
+        self.doc['done'].extend(employee_ids)
+        await self.collection.update_one({'_id': self.doc['_id']},
+                {'$set': {'window': window, 'done': self.doc['done']}})
+
+    async def finish(self):
+        await self.collection.delete_one({'_id': self.doc['_id']})
@@ -0,0 +1,138 @@
+# compact columnar encoding of /data/shifts for the dashboard worker
+# one typed array per field instead of a document per shift, the client views each column in place
+#
+# 'TCS1' | uint32 meta length | meta (bson) | padding to 8 bytes | columns, each starting on an 8 byte boundary
+#
+# meta: {'employees': {...}, 'employeeIds': [...], 'expectedDuration': ms, 'count': shifts,
+#        'componentCount': components, 'next': page token or None, 'columns': [[name, type, offset, byte length], ...]}
+# column offsets are from the end of the padding
+#
+# per shift: id (12 bytes), start / end (float64 ms since epoch, end NaN while open), duration (int32 ms),
+# row (int16, -1 if none), employee (uint16 index into employeeIds), flags (uint8, 1 if complete) and
+# components (uint32 offsets, shift i has components components[i] to components[i + 1])
+# per component: componentId, componentStart, componentEnd, componentDuration, as above
+#
+# dates are float64 rather than int64 so they decode without BigInt, ms timestamps are exact in a double.
+# everything is little endian
+import sys
+import bson
+import struct
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+MAGIC = b'TCS1'
+CONTENT_TYPE = 'application/vnd.timeclock.shifts'
+
+# typed array name by array typecode
+TYPES = {'d': 'float64', 'i': 'int32', 'h': 'int16', 'H': 'uint16', 'B': 'uint8', 'I': 'uint32'}
+TYPECODES = {v: k for k, v in TYPES.items()}
+
+NO_ROW = -1
+NO_EMPLOYEE = 0xffff
+COMPLETE = 1
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_ms(date: Optional[datetime]) -> float:
+    if date is None:
+        return float('nan')
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return float((date - EPOCH) // timedelta(milliseconds=1))
+
+
+def from_ms(value: float) -> Optional[datetime]:
+    return None if value != value else EPOCH + timedelta(milliseconds=value)
+
+
+def align(n: int) -> int:
+    return -(-n // 8) * 8
+
+
+def encode_shifts(employees: dict, employee_ids: List[str], shifts: List[dict], expected_duration: int,
+        next_token: Optional[str] = None) -> bytes:
+    '''
+    shifts as SHIFTS_PIPELINE returns them
+    '''
+    index = {employee_id: i for i, employee_id in enumerate(employee_ids)}
+    columns = {
+        'id': array('B'), 'start': array('d'), 'end': array('d'), 'duration': array('i'), 'row': array('h'),
+        'employee': array('H'), 'flags': array('B'), 'components': array('I', [0]),
+        'componentId': array('B'), 'componentStart': array('d'), 'componentEnd': array('d'),
+        'componentDuration': array('i'),
+    }
+    for shift in shifts:
+        columns['id'].frombytes(bytes.fromhex(shift['id']))
+        columns['start'].append(to_ms(shift['start']))
+        columns['end'].append(to_ms(shift['end']))
+        columns['duration'].append(int(shift['duration'] or 0))
+        columns['row'].append(NO_ROW if (row := shift.get('row')) is None else row)
+        columns['employee'].append(index.get(shift['employee'], NO_EMPLOYEE))
+        columns['flags'].append(COMPLETE if shift['end'] is not None else 0)
+        # the join keeps a placeholder for missing components
+        components = [c for c in shift['components'] if '_id' in c]
+        for c in components:
+            columns['componentId'].frombytes(c['_id'].binary)
+            columns['componentStart'].append(to_ms(c['start']))
+            columns['componentEnd'].append(to_ms(c['end']))
+            columns['componentDuration'].append(int(c['duration'] or 0))
+        columns['components'].append(columns['components'][-1] + len(components))
+
+    layout = []
+    offset = 0
+    for name, column in columns.items():
+        layout.append([name, TYPES[column.typecode], offset, len(column) * column.itemsize])
+        offset += align(len(column) * column.itemsize)
+    meta = bson.encode({'employees': employees, 'employeeIds': employee_ids, 'expectedDuration': expected_duration,
+            'count': len(shifts), 'componentCount': len(columns['componentStart']), 'next': next_token,
+            'columns': layout})
+
+    buf = bytearray(MAGIC + struct.pack('<I', len(meta)) + meta)
+    for column in columns.values():
+        buf.extend(bytes(align(len(buf)) - len(buf)))
+        if sys.byteorder == 'big':
+            column.byteswap()
+        buf.extend(column.tobytes())
+    return bytes(buf)
+
+
+def decode_shifts(buf: bytes) -> dict:
+    '''
+    reference decoder, the response as shifts / employees like the other formats
+    '''
+    if buf[:4] != MAGIC:
+        raise ValueError('not a columnar shifts response')
+    length, = struct.unpack_from('<I', buf, 4)
+    meta = bson.decode(buf[8:8 + length])
+    base = align(8 + length)
+    columns = {}
+    for name, type, offset, size in meta['columns']:
+        offset += base
+        column = array(TYPECODES[type])
+        column.frombytes(buf[offset:offset + size])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        columns[name] = column
+
+    ids, component_ids, offsets = columns['id'].tobytes(), columns['componentId'].tobytes(), columns['components']
+    shifts = []
+    for i in range(meta['count']):
+        components = [{'_id': bson.ObjectId(component_ids[j * 12:j * 12 + 12]),
+                'id': component_ids[j * 12:j * 12 + 12].hex(),
+                'start': from_ms(columns['componentStart'][j]), 'end': from_ms(columns['componentEnd'][j]),
+                'duration': columns['componentDuration'][j]} for j in range(offsets[i], offsets[i + 1])]
+        employee = columns['employee'][i]
+        shifts.append({
+            'id': ids[i * 12:i * 12 + 12].hex(),
+            'employee': meta['employeeIds'][employee] if employee != NO_EMPLOYEE else None,
+            'start': from_ms(columns['start'][i]),
+            'end': from_ms(columns['end'][i]),
+            'duration': columns['duration'][i],
+            'row': None if columns['row'][i] == NO_ROW else columns['row'][i],
+            'state': 'complete' if columns['flags'][i] & COMPLETE else 'incomplete',
+            'expectedDuration': meta['expectedDuration'],
+            'components': components,
+        })
+    return {'employees': meta['employees'], 'employeeIds': meta['employeeIds'], 'shifts': shifts, 'next': meta.get('next')}
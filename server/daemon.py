@@ -9,17 +9,27 @@ import pytz
 import pymongo
 import logging
 import asyncio
-import aiomysql
 import configparser
-from typing import List
-from datetime import datetime, timedelta
+from enum import Enum
+from typing import List, Optional
+from collections import deque
+from datetime import datetime, timedelta, timezone
 from pymongo.errors import BulkWriteError
-from pymongo import ReplaceOne
 from bson.codec_options import CodecOptions, TypeRegistry
 
 import models
-from util import get_async_rpc_connection, get_mysql_db, get_mongo_db, EmployeeShiftColor
-from calculate_rows import recalculate
+import state
+import metrics
+import interval
+from util import get_async_rpc_connection, get_mysql_db, get_mongo_db, EmployeeShiftColor, DROPPED_CONNECTION_ERRORS
+from calculate_rows import Layout, recalculate
+from scheduler import HISTORY, Scheduler, watch_triggers
+from roster import roster_loop, sync_roster
+from reconcile import reconcile
+from punches import fetch_punches
+from checkpoint import Checkpoint
+from shifts import SHIFT_GAP, embed, get_duration
+from localtime import EASTERN
 
 tz = pytz.timezone('US/Eastern')
 
@@ -27,20 +37,14 @@ tz = pytz.timezone('US/Eastern')
 async def init(mongo_db, mysql_db):
     col_names = await mongo_db.list_collection_names()
 
-    mysql_cursor = await mysql_db.cursor(aiomysql.DictCursor)
-    ops = []
+    await mongo_db.employees.create_index('id', unique=True)
 
-    await mysql_cursor.execute('select id,Code,Name,MiddleName,LastName,HireDate from tam.inf_employee')
-    async for employee in mysql_cursor:
-        employee_id = employee['id']
-        color = models.EmployeeShiftColor(employee_id % len(models.EmployeeShiftColor))
-        employee_id = str(employee_id)
-        employee['id'] = employee_id
-        employee['Color'] = color
-        ops.append(ReplaceOne({'id': employee_id}, employee, upsert=True))
+    if 'roster_updates' not in col_names:
+        await mongo_db.create_collection('roster_updates', capped=True, size=100000)
+        # tailable cursors die on an empty collection
+        await mongo_db.roster_updates.insert_one({'date': datetime.utcnow(), 'ids': []})
 
-    await mongo_db.employees.create_index('id', unique=True)
-    await mongo_db.employees.bulk_write(ops)
+    await sync_roster(mongo_db, mysql_db)
 
     if 'polls' not in col_names:
         await mongo_db.create_collection('polls');
@@ -49,6 +53,11 @@ async def init(mongo_db, mysql_db):
     if 'state' not in col_names:
         await mongo_db.create_collection('state', capped=True, size=100000)
 
+    if 'triggers' not in col_names:
+        await mongo_db.create_collection('triggers', capped=True, size=10000)
+        # tailable cursors die on an empty collection
+        await mongo_db.triggers.insert_one({'date': datetime.utcnow()})
+
     # need to replace this to calculate duration on the fly
     #await mongo_db.command({
     #    'create': 'shifts',
@@ -100,6 +109,17 @@ async def init(mongo_db, mysql_db):
     await mongo_db.components.create_index('start')
     await mongo_db.components.create_index('end')
     await mongo_db.components.create_index('employee')
+    await mongo_db.components.create_index(interval.INDEX)
+    await mongo_db.shifts.create_index(interval.INDEX)
+    # documents written before interval keys, range queries would miss them
+    for collection in (mongo_db.shifts, mongo_db.components):
+        if await collection.find_one({'days': {'$exists': False}}, projection={'_id': True}):
+            await interval.add_days(collection)
+    await mongo_db.shifts.create_index('start')
+    await mongo_db.shifts.create_index('end')
+    await mongo_db.shifts.create_index('components')
+    await mongo_db.shifts.create_index([('relayout', 1), ('start', 1)], partialFilterExpression={'relayout': True})
+    await mongo_db.layout_frontiers.create_index('position')
 
 
 async def main(config):
@@ -115,154 +135,196 @@ async def main(config):
     logging.info('running init')
     await init(mongo_db, mysql_client)
 
-    interval = timedelta(hours=1)
-    buf = 60 # 1 minute. added to interval, or used as timeout between retries
+    batched = config.getboolean('DAEMON', 'batched', fallback=True)
+    chunk_size = config.getint('AMG', 'chunk_size', fallback=50)
+    concurrency = config.getint('AMG', 'concurrency', fallback=4)
+    incremental = config.getboolean('DAEMON', 'incremental', fallback=True)
+    full_sync_interval = timedelta(hours=config.getfloat('DAEMON', 'full_sync_interval', fallback=24))
+    keyframe_interval = config.getint('DAEMON', 'state_keyframe_interval', fallback=state.KEYFRAME_INTERVAL)
+    layout = Layout.from_config(config['DAEMON']) if config.has_section('DAEMON') else Layout()
+    # not needed if the api lays out rows itself (SERVER.LAYOUT = window)
+    write_rows = config.getboolean('DAEMON', 'write_rows', fallback=True)
+    # 'rpc' (GetTimecards) or 'mysql' (tam.tr_clock), see parity.py
+    ingest = config.get('DAEMON', 'ingest', fallback='rpc')
+
+    sync_interval = timedelta(hours=1)
+    scheduler = Scheduler([p['date'] for p in await mongo_db.polls.find({}, sort=[('date', pymongo.DESCENDING)],
+            limit=HISTORY).to_list(None)], sync_interval,
+            delay=timedelta(seconds=config.getfloat('DAEMON', 'poll_delay', fallback=120)),
+            min_backoff=config.getfloat('DAEMON', 'min_backoff', fallback=60),
+            max_backoff=config.getfloat('DAEMON', 'max_backoff', fallback=3600))
+    triggers = asyncio.create_task(watch_triggers(mongo_db, scheduler))
+    roster = asyncio.create_task(roster_loop(mongo_db, mysql_client,
+            config.getfloat('DAEMON', 'roster_interval', fallback=900)))
+    metrics_port = config.getint('DAEMON', 'metrics_port', fallback=0)
+    metrics_runner = await metrics.serve('0.0.0.0', metrics_port) if metrics_port else None
 
     try:
         # update polls, wait for next poll update after interval
         latest_poll = d.get('date') if (d := await mongo_db.polls.find_one({}, sort=[('date', pymongo.DESCENDING)])) else None
         latest_sync = d.get('date') if (d := await mongo_db.sync_history.find_one({}, sort=[('date', pymongo.DESCENDING)])) else None
+        watermark = d.get('watermark') if d else None
+        latest_full_sync = d.get('date') if (d := await mongo_db.sync_history.find_one({'mode': {'$ne': 'incremental'}},
+                sort=[('date', pymongo.DESCENDING)])) else None
+        checkpoint = await Checkpoint.load(mongo_db, 'daemon')
 
         while True:
-            async with mysql_client.cursor() as mysql_cursor:
-                if latest_poll:
-                    await mysql_cursor.execute('select StartTime from tam.polllog where StartTime > %s order by StartTime desc',
-                            (latest_poll + tz.utcoffset(latest_poll, is_dst=True),))
-                else:
-                    await mysql_cursor.execute('select StartTime from tam.polllog order by StartTime desc')
-                    
-                if mysql_cursor.rowcount:
-                    polls = [{'date': tz.localize(date).astimezone(pytz.UTC).replace(tzinfo=None)} for date, in
-                            await mysql_cursor.fetchall()]
+            if latest_poll:
+                query = ('select StartTime from tam.polllog where StartTime > %s order by StartTime',
+                        (EASTERN.to_local(latest_poll),))
+            else:
+                query = ('select StartTime from tam.polllog order by StartTime', None)
+
+            # oldest first so a dropped connection resumes where it left off
+            try:
+                async for rows in mysql_client.stream(*query):
+                    polls = [{'date': EASTERN.to_utc(date)} for date, in rows]
                     print(f'{len(polls)=}')
-                    latest_poll = polls[0]['date']
                     await mongo_db.polls.insert_many(polls)
+                    latest_poll = polls[-1]['date']
+                    scheduler.observe(p['date'] for p in polls)
+                    metrics.LAST_POLL.set(timestamp(latest_poll))
+            except DROPPED_CONNECTION_ERRORS as e:
+                metrics.ERRORS.inc(stage='polls')
+                logging.warning(f'failed to read polls ({e})')
+                await scheduler.wait(scheduler.backoff())
+                continue
 
             now = datetime.utcnow()
 
             logging.info(f'{now=}')
             logging.info(f'{latest_poll=}')
             logging.info(f'{latest_sync=}')
+            waiting = latest_poll and not (latest_sync and latest_sync > latest_poll)
+            metrics.SYNC_LAG.set((now - latest_poll).total_seconds() if waiting else 0)
 
-            if latest_poll and latest_sync and latest_sync > latest_poll:
-                timeout_duration = d if (d := (latest_poll + interval - now).total_seconds()) > 0 else 60
-                logging.info(f'sleeping for {timeout_duration} seconds')
-                await asyncio.sleep(timeout_duration)
+            if checkpoint is None and not scheduler.triggered() and latest_poll and latest_sync and latest_sync > latest_poll:
+                timeout_duration = scheduler.timeout(now)
+                logging.info(f'next poll expected {scheduler.next_poll()}, sleeping for {timeout_duration} seconds')
+                await scheduler.wait(timeout_duration)
                 continue
 
-            min_date = get_sunday((min(now, latest_sync) if latest_sync else (now - timedelta(days=365))).astimezone(tz)).replace(tzinfo=None)
-            #min_date = min(get_sunday(now.astimezone(tz)), get_sunday(latest_sync)) if latest_sync else get_sunday(now - timedelta(days=365) * 2)
+            if checkpoint is not None:
+                # interrupted run, finish it before anything else
+                now, min_date = checkpoint.doc['end_date'], checkpoint.doc['min_date']
+                mode, employee_ids, next_watermark = [checkpoint.doc.get(k) for k in ('mode', 'employee_ids', 'watermark')]
+                logging.info(f'resuming {mode} sync from {checkpoint.window}')
+            else:
+                next_watermark = await get_punch_watermark(mysql_client)
+
+                # watermarks from before they were tr_clock ids are dates, sweep once to replace them
+                if (incremental and isinstance(watermark, int) and latest_full_sync
+                        and now - latest_full_sync < full_sync_interval):
+                    employee_ids, min_date = await plan_incremental(mysql_client, watermark)
+                    mode = 'incremental'
+                else:
+                    employee_ids = None
+                    min_date = get_sunday((min(now, latest_sync) if latest_sync else (now - timedelta(days=365))).astimezone(tz)).replace(tzinfo=None)
+                    #min_date = min(get_sunday(now.astimezone(tz)), get_sunday(latest_sync)) if latest_sync else get_sunday(now - timedelta(days=365) * 2)
+                    mode = 'full'
+                if employee_ids is None or employee_ids:
+                    checkpoint = await Checkpoint.start(mongo_db, 'daemon', min_date, now, mode=mode,
+                            employee_ids=employee_ids, watermark=next_watermark)
             logging.info(f'{min_date=}')
 
-            await update(mongo_db, amg_rpc_proxy, min_date, now)
-            await recalculate(mongo_db, min_date)
+            if checkpoint is not None:
+                components, shifts = metrics.COMPONENTS.value(), metrics.SHIFTS.value()
+                try:
+                    with metrics.SYNC_SECONDS.time(mode=mode):
+                        await update(mongo_db, amg_rpc_proxy, checkpoint.window, now, batched, chunk_size, concurrency,
+                                employee_ids, keyframe_interval, mysql_client if ingest == 'mysql' else None, checkpoint)
+                        if write_rows:
+                            with metrics.RECALCULATE_SECONDS.time():
+                                await recalculate(mongo_db, min_date, layout)
+                except Exception:
+                    metrics.ERRORS.inc(stage='sync')
+                    raise
+                metrics.CYCLE_COMPONENTS.observe(metrics.COMPONENTS.value() - components)
+                metrics.CYCLE_SHIFTS.observe(metrics.SHIFTS.value() - shifts)
             print(f'inserting... {now}')
-            await mongo_db.sync_history.insert_one({'date': now})
+            await mongo_db.sync_history.insert_one({'date': now, 'mode': mode, 'watermark': next_watermark or watermark})
+            if checkpoint is not None:
+                await checkpoint.finish()
+                checkpoint = None
+            if mode == 'full':
+                latest_full_sync = now
+            watermark = next_watermark or watermark
             latest_sync = now
+            metrics.LAST_SYNC.set(timestamp(latest_sync))
+            metrics.SYNC_LAG.set(0)
 
     except asyncio.CancelledError:
         pass
 
     finally:
         logging.info('cancelled')
+        triggers.cancel()
+        roster.cancel()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         await amg_rpc_proxy.close()
         mysql_client.close()
+        await mysql_client.wait_closed()
         mongo_client.close()
 
 
-async def update(mongo_db, proxy, min_date: datetime, now: datetime):
-    # useful if encoding strange types
-    type_registry = TypeRegistry(fallback_encoder=timedelta_encoder)
-    codec_options = CodecOptions(type_registry=type_registry)
-    shifts_col = mongo_db.get_collection('shifts', codec_options=codec_options)
+async def get_punch_watermark(mysql_client) -> Optional[int]:
+    '''
+    latest punch inserted into tam.tr_clock, by its auto increment id
+    ids follow insertion, not punch time, so punches a clock uploads late are still after the watermark
+    '''
+    (watermark,) = await mysql_client.fetchone('select max(id) from tam.tr_clock')
+    return watermark
 
-    employee_ids = [int(empl['id']) for empl in await mongo_db.employees.find({}).to_list(None)]
 
-    logging.info('update')
-    interval = timedelta(days=14)
+async def get_punched_employees(mysql_client, since: int):
+    '''
+    employees with punches inserted after id `since`, mapped to their earliest new punch (naive local time)
+    '''
+    rows = await mysql_client.fetchall('select inf_employee_id, min(Date) from tam.tr_clock where id > %s '
+            'group by inf_employee_id', (since,))
+    return {int(employee_id): date for employee_id, date in rows}
 
-    while min_date < now:
-        max_date = min_date + interval
-        logging.info(f'{min_date} - {max_date}')
-    
-        employee_timecards = await proxy.GetTimecards(employee_ids, min_date, max_date, False)
-    
-        count = 0
-        for employee_id, components in parse_timecard(employee_timecards):
-            for component in components:
-                start, end = component['start'], component['end']
-
-                if start is None:
-                    continue
-
-                # existing component, perhaps it has been finished
-                existing_component = await mongo_db.components.find_one({'employee': employee_id, 'start': start})
-                
-                if existing_component is not None:
-                    component_id = existing_component['_id']
-                    await mongo_db.components.update_one({'_id': component_id}, {'$set': component})
-
-                    parent_shift = await mongo_db.shifts.find_one({'components': component_id});
-                    if parent_shift is None:
-                        raise Exception('missing parent_shift for component')
 
-                    peer_components = await mongo_db.components.find({'_id': {'$in': parent_shift['components']}}).sort([('start', pymongo.ASCENDING)]).to_list(None);
+async def plan_incremental(mysql_client, watermark: int):
+    '''
+    employees to sync and the date to sync them from for punches inserted after `watermark`
+    '''
+    punched = await get_punched_employees(mysql_client, watermark)
+    logging.info(f'incremental sync, {len(punched)} employees punched since {watermark}')
+    # a punch can close a shift that started the previous day
+    min_date = min(punched.values()).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1) if punched else None
+    return list(punched), min_date
 
-                    if len(peer_components) != len(parent_shift['components']):
-                        raise Exception('missing component for parent_shift')
 
-                    start = peer_components[0]['start']
-                    end = peer_components[-1]['end']
-                    duration = get_duration(peer_components)
-                    shift_state = models.ShiftState.Incomplete if end is None else models.ShiftState.Complete
-                    await shifts_col.find_one_and_update({'_id': parent_shift['_id']},
-                            {'$set': {'start': start, 'end': end, 'duration': duration, 'state': shift_state}})
-                else:
-                    result = await mongo_db.components.insert_one(component)
-                    component_id = result.inserted_id
+async def update(mongo_db, proxy, min_date: datetime, now: datetime, batched: bool = True,
+        chunk_size: int = 50, concurrency: int = 4, employee_ids: List[int] = None,
+        keyframe_interval: int = state.KEYFRAME_INTERVAL, mysql_db=None, checkpoint: Checkpoint = None):
+    '''
+    sync components / shifts from min_date, punches are read from tam.tr_clock instead of GetTimecards if
+    `mysql_db` is given. progress is recorded in `checkpoint` if given
+    '''
+    # useful if encoding strange types
+    type_registry = TypeRegistry(fallback_encoder=timedelta_encoder)
+    codec_options = CodecOptions(type_registry=type_registry)
+    shifts_col = mongo_db.get_collection('shifts', codec_options=codec_options)
 
-                    parent_shift = await shifts_col.find_one({
-                        'employee': employee_id,
-                        'end': {'$lte': start, '$gt': start - timedelta(hours=4)}
-                        }, sort=[('end', -1)])
+    if employee_ids is None:
+        employee_ids = [int(empl['id']) for empl in await mongo_db.employees.find({}).to_list(None)]
 
-                    shift_state = models.ShiftState.Incomplete if end is None else models.ShiftState.Complete
+    logging.info('update')
+    window = timedelta(days=14)
 
-                    if parent_shift is None:
-                        duration = end - start if end is not None else timedelta()
-                        result = await shifts_col.insert_one({'employee': employee_id,
-                            'components': [component_id], 'start': start, 'end': end,
-                            'duration': duration, 'state': shift_state })
-                    else:
-                        shift_id = parent_shift['_id']
-
-                        peer_components = await mongo_db.components.find({'_id': {'$in': parent_shift['components']}}).sort([('start', pymongo.ASCENDING)]).to_list(None);
-    
-                        if len(peer_components) != len(parent_shift['components']):
-                            raise Exception('missing component for parent_shift')
-
-                        peer_components.append(component)
-                        peer_components.sort(key=lambda c: c['start'])
-    
-                        start = peer_components[0]['start']
-                        end = peer_components[-1]['end']
-                        duration = get_duration(peer_components)
-
-                        await shifts_col.update_one({'_id': shift_id}, {
-                            '$push': {'components': component_id},
-                            '$set': {
-                                'end': end,
-                                'start': start,
-                                'state': shift_state,
-                                'duration': duration,
-                            }})
-                count += 1
-        logging.info(f'{count=}')
-        min_date = max_date
+    if mysql_db is None:
+        windows = ((a, b, parse_timecards(timecards)) async for a, b, timecards in fetch_timecards(proxy,
+                employee_ids, min_date, now, window, chunk_size, concurrency))
+    else:
+        windows = fetch_punches(mysql_db, employee_ids, min_date, now, window)
+
+    await merge_windows(mongo_db, shifts_col, windows, batched, chunk_size, checkpoint)
 
     values = []
-    next_state = {}
-    current_state = await mongo_db.state.find_one({}, sort=[('date', pymongo.DESCENDING)])
+    previous = await state.load(mongo_db)
 
     value_ids = set()
     async for value in mongo_db.shifts.aggregate([
@@ -275,38 +337,178 @@ async def update(mongo_db, proxy, min_date: datetime, now: datetime):
         value_ids.add(value['_id'])
         values.append(value)
 
-    async for value in mongo_db.state.aggregate([
-        {'$sort': {'date': -1}},
-        {'$limit': 1},
-        {'$unwind': '$values'},
-        {'$match': {'$expr': {'$eq': ['$values.end', None]}}}, # remove shifts that have ended
-        {'$lookup': {'from': 'shifts', 'localField': 'values._id', 'foreignField': '_id', 'as': 'nextValues'}},
-        {'$unwind': '$nextValues'},
-        {'$replaceRoot': {'newRoot': '$nextValues'}},
-        ]):
-        if value['_id'] not in value_ids:
-            values.append(value)
+    # keep shifts that were open in the previous state, ended ones are sent once more then dropped
+    if previous and (ids := [v['_id'] for v in previous['values'] if v.get('end') is None and v['_id'] not in value_ids]):
+        values.extend(await mongo_db.shifts.find({'_id': {'$in': ids}}).to_list(None))
 
-    await mongo_db.state.insert_one({'date': now, 'values': values})
+    await state.write(mongo_db, now, values, previous, keyframe_interval)
 
 
-async def update_shifts(proxy, employee_ids, min_date, end_date = datetime.now(), interval = timedelta(days=14)):
-    while min_date < end_date:
-        max_date = min_date + interval
+async def merge_windows(mongo_db, shifts_col, windows, batched: bool = True, chunk_size: int = 50,
+        checkpoint: Checkpoint = None):
+    '''
+    merge (window start, window end, [(employee_id, components)]) windows in order
+    with a checkpoint each window is written in employee chunks, skipping those already written
+    returns the number of components merged
+    '''
+    total = 0
+    async for min_date, max_date, employee_components in windows:
         logging.info(f'{min_date} - {max_date}')
 
-        employee_timecards = await proxy.GetTimecards(employee_ids, min_date, max_date, False)
-        now = datetime.now()
-        group = [item for tc in employee_timecards for item in parse_timecard(tc)]
+        if checkpoint is None:
+            chunks = [employee_components]
+        else:
+            employee_components = list(employee_components)
+            pending = set(checkpoint.pending(min_date, [employee_id for employee_id, _ in employee_components]))
+            employee_components = [item for item in employee_components if item[0] in pending]
+            chunks = [employee_components[i:i + chunk_size] for i in range(0, len(employee_components), chunk_size)]
+
+        for chunk in chunks:
+            if batched:
+                count = await reconcile(mongo_db, shifts_col, chunk)
+            else:
+                count = await update_components(mongo_db, shifts_col, chunk)
+                # one shift written per component
+                metrics.COMPONENTS.inc(count)
+                metrics.SHIFTS.inc(count)
+            logging.info(f'{count=}')
+            total += count
+            if checkpoint is not None:
+                await checkpoint.commit(min_date, [employee_id for employee_id, _ in chunk])
+    return total
+
+
+async def update_components(mongo_db, shifts_col, employee_timecards):
+    '''
+    merge components one at a time, several round-trips each
+    '''
+    count = 0
+    for employee_id, components in employee_timecards:
+        for component in components:
+            start, end = component['start'], component['end']
+
+            if start is None:
+                continue
+            component['days'] = interval.days(start, end)
+
+            # existing component, perhaps it has been finished
+            existing_component = await mongo_db.components.find_one({'employee': employee_id, 'start': start})
+            
+            if existing_component is not None:
+                component_id = existing_component['_id']
+                await mongo_db.components.update_one({'_id': component_id}, {'$set': component})
+
+                parent_shift = await mongo_db.shifts.find_one({'components': component_id});
+                if parent_shift is None:
+                    raise Exception('missing parent_shift for component')
+
+                peer_components = await mongo_db.components.find({'_id': {'$in': parent_shift['components']}}).sort([('start', pymongo.ASCENDING)]).to_list(None);
+
+                if len(peer_components) != len(parent_shift['components']):
+                    raise Exception('missing component for parent_shift')
+
+                start = peer_components[0]['start']
+                end = peer_components[-1]['end']
+                duration = get_duration(peer_components)
+                shift_state = models.ShiftState.Incomplete if end is None else models.ShiftState.Complete
+                await shifts_col.find_one_and_update({'_id': parent_shift['_id']},
+                        {'$set': {'start': start, 'end': end, 'duration': duration, 'state': shift_state,
+                            'parts': embed(peer_components), 'days': interval.days(start, end), 'relayout': True}})
+            else:
+                result = await mongo_db.components.insert_one(component)
+                component_id = result.inserted_id
+
+                parent_shift = await shifts_col.find_one({
+                    'employee': employee_id,
+                    'end': {'$lte': start, '$gt': start - SHIFT_GAP}
+                    }, sort=[('end', -1)])
+
+                shift_state = models.ShiftState.Incomplete if end is None else models.ShiftState.Complete
+
+                if parent_shift is None:
+                    duration = end - start if end is not None else timedelta()
+                    result = await shifts_col.insert_one({'employee': employee_id,
+                        'components': [component_id], 'parts': embed([component]), 'start': start, 'end': end,
+                        'duration': duration, 'state': shift_state, 'days': interval.days(start, end),
+                        'relayout': True})
+                else:
+                    shift_id = parent_shift['_id']
+
+                    peer_components = await mongo_db.components.find({'_id': {'$in': parent_shift['components']}}).sort([('start', pymongo.ASCENDING)]).to_list(None);
+
+                    if len(peer_components) != len(parent_shift['components']):
+                        raise Exception('missing component for parent_shift')
+
+                    peer_components.append(component)
+                    peer_components.sort(key=lambda c: c['start'])
+
+                    start = peer_components[0]['start']
+                    end = peer_components[-1]['end']
+                    duration = get_duration(peer_components)
 
-        yield group, max_date
-        min_date = max_date
+                    await shifts_col.update_one({'_id': shift_id}, {
+                        '$push': {'components': component_id},
+                        '$set': {
+                            'end': end,
+                            'start': start,
+                            'state': shift_state,
+                            'duration': duration,
+                            'parts': embed(peer_components),
+                            'days': interval.days(start, end),
+                            'relayout': True,
+                        }})
+            count += 1
+    return count
+
+
+async def fetch_timecards(proxy, employee_ids, min_date, end_date, interval = timedelta(days=14),
+        chunk_size: int = 50, concurrency: int = 4):
+    '''
+    split [min_date, end_date) into windows and employee_ids into chunks, fetch concurrently
+    yields (window start, window end, timecards) in date order
+    at most `concurrency` requests are in flight and windows are fetched at most `concurrency` ahead
+    '''
+    semaphore = asyncio.Semaphore(concurrency)
+    chunks = [employee_ids[i:i + chunk_size] for i in range(0, len(employee_ids), chunk_size)]
+
+    async def fetch(ids, a, b):
+        async with semaphore:
+            try:
+                with metrics.RPC_SECONDS.time():
+                    return await proxy.GetTimecards(ids, a, b, False)
+            except Exception:
+                metrics.ERRORS.inc(stage='rpc')
+                raise
+
+    def windows(min_date):
+        while min_date < end_date:
+            yield min_date, min_date + interval
+            min_date += interval
+
+    pending = deque()
+    it = windows(min_date)
+    try:
+        while True:
+            while len(pending) < concurrency and (w := next(it, None)):
+                pending.append((*w, [asyncio.create_task(fetch(ids, *w)) for ids in chunks]))
+            if not pending:
+                break
+            # left in pending until fetched, so its other requests are cancelled if one fails
+            a, b, tasks = pending[0]
+            timecards = [timecard for result in await asyncio.gather(*tasks) for timecard in result]
+            pending.popleft()
+            yield a, b, timecards
+    finally:
+        for _, _, tasks in pending:
+            for task in tasks:
+                task.cancel()
 
 
 def parse_timecard(timecards):
     for timecard in timecards:
         employee_id, items = str(timecard['EmployeeId']), timecard['Timecards']
-        def it():
+        # bound now, the generators may be consumed after the loop moved on
+        def it(employee_id=employee_id, items=items):
             for item in items:
                 punches = []
                 obj = {'punches': punches, 'employee': employee_id}
@@ -314,7 +516,7 @@ def parse_timecard(timecards):
                     obj[k0] = item.get(k1)
                 for k0, k1 in [('start', 'StartPunch'), ('end', 'StopPunch')]:
                     if (p := item.get(k1)):
-                        obj[k0] = tz.localize(p['OriginalDate']).astimezone(pytz.UTC).replace(tzinfo=None)
+                        obj[k0] = EASTERN.to_utc(p['OriginalDate'])
                         punches.append(p['Id'])
                     else:
                         obj[k0] = None
@@ -322,6 +524,21 @@ def parse_timecard(timecards):
         yield employee_id, it()
 
 
+def parse_timecards(timecards):
+    '''
+    parse_timecard, evaluated
+    '''
+    with metrics.PARSE_SECONDS.time():
+        return [(employee_id, list(it)) for employee_id, it in parse_timecard(timecards)]
+
+
+def timestamp(date: datetime) -> float:
+    '''
+    naive utc to unix time
+    '''
+    return date.replace(tzinfo=timezone.utc).timestamp()
+
+
 async def update_shift_stats(db):
     pipeline = [
       {'$match': {'end': {'$ne': None}}},
@@ -380,17 +597,6 @@ async def update_shift_stats(db):
         pass
 
 
-def get_duration(components: List[models.ShiftComponent]) -> timedelta:
-    '''
-    if all start & end not None, add deltas up
-    '''
-    duration = timedelta()
-    if all(arr := [t for c in components for t in (c['start'], c['end'])]):
-        for a, b in zip(arr[0::2], arr[1::2]):
-            duration += b - a
-    return duration
-
-
 def timedelta_encoder(value):
     if isinstance(value, timedelta):
         return int(value.total_seconds() * 1000)
@@ -0,0 +1,223 @@
+# in-memory stand-ins for the motor client / collections the tests use
+# queries support what the server sends: equality (array fields match an element), $in, $gt / $gte / $lt /
+# $lte, $ne, $exists, $and / $or. null and missing fields match None but never compare
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateOne
+
+COMPARISONS = {
+    '$gt': lambda a, b: a > b,
+    '$gte': lambda a, b: a >= b,
+    '$lt': lambda a, b: a < b,
+    '$lte': lambda a, b: a <= b,
+}
+
+
+class Missing:
+    '''
+    an absent field, equal to None
+    '''
+    def __eq__(self, other):
+        return other is None or isinstance(other, Missing)
+
+    def __hash__(self):
+        return hash(None)
+
+
+MISSING = Missing()
+
+
+def matches_value(value, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith('$') for k in condition):
+        return all(matches_operator(value, op, arg) for op, arg in condition.items())
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value == condition
+
+
+def matches_operator(value, op, arg) -> bool:
+    if op in COMPARISONS:
+        return value is not None and value is not MISSING and COMPARISONS[op](value, arg)
+    if op == '$in':
+        return any(v in arg for v in value) if isinstance(value, list) else value in arg
+    if op == '$ne':
+        return not matches_value(value, arg)
+    if op == '$exists':
+        return (value is not MISSING) == arg
+    raise NotImplementedError(op)
+
+
+def matches(doc: dict, query: dict) -> bool:
+    '''
+    `doc` is selected by `query`
+    '''
+    for key, condition in (query or {}).items():
+        if key == '$and':
+            if not all(matches(doc, q) for q in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(doc, q) for q in condition):
+                return False
+        elif not matches_value(doc.get(key, MISSING), condition):
+            return False
+    return True
+
+
+def sort_docs(docs: list, sort) -> list:
+    for key, direction in reversed(list(sort.items() if isinstance(sort, dict) else sort or [])):
+        docs = sorted(docs, key=lambda d: d[key], reverse=direction < 0)
+    return docs
+
+
+def project(doc: dict, projection) -> dict:
+    if not projection:
+        return dict(doc)
+    if isinstance(projection, (list, set, tuple)):
+        projection = dict.fromkeys(projection, True)
+    if any(v for k, v in projection.items() if k != '_id'):
+        keep = {k for k, v in projection.items() if v} | ({'_id'} if projection.get('_id', True) else set())
+        return {k: v for k, v in doc.items() if k in keep}
+    return {k: v for k, v in doc.items() if projection.get(k, True)}
+
+
+def update_doc(doc: dict, update: dict):
+    for key, value in update.get('$set', {}).items():
+        doc[key] = value
+    for key in update.get('$unset', {}):
+        doc.pop(key, None)
+    for key, value in update.get('$push', {}).items():
+        doc.setdefault(key, []).append(value)
+
+
+class Cursor:
+    '''
+    motor cursor over `docs`, read whole or `length` at a time
+    '''
+    def __init__(self, docs):
+        self.docs = docs
+        self.position = 0
+
+    async def to_list(self, length):
+        docs = self.docs[self.position:self.position + length if length else None]
+        self.position += len(docs)
+        return docs
+
+    def __aiter__(self):
+        return self.iterate()
+
+    async def iterate(self):
+        while self.position < len(self.docs):
+            self.position += 1
+            yield self.docs[self.position - 1]
+
+
+class InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class Collection:
+    '''
+    documents in insertion order, read as copies and written in place
+    '''
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+
+    def find(self, query=None, projection=None, sort=None, limit=0, **kwargs) -> Cursor:
+        docs = sort_docs([d for d in self.docs if matches(d, query)], sort)
+        return Cursor([project(d, projection) for d in docs[:limit or None]])
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        return next(iter(self.find(query, projection, sort, 1).docs), None)
+
+    async def count_documents(self, query):
+        return sum(matches(d, query) for d in self.docs)
+
+    async def insert_one(self, doc):
+        doc.setdefault('_id', ObjectId())
+        self.docs.append(doc)
+        return InsertOneResult(doc['_id'])
+
+    async def insert_many(self, docs):
+        for doc in docs:
+            await self.insert_one(doc)
+
+    async def update_one(self, query, update, upsert=False):
+        self.update(query, update, upsert)
+
+    async def update_many(self, query, update):
+        for doc in self.docs:
+            if matches(doc, query):
+                update_doc(doc, update)
+
+    async def replace_one(self, query, doc, upsert=False):
+        self.replace(query, doc, upsert)
+
+    async def delete_one(self, query):
+        self.delete(query, 1)
+
+    async def delete_many(self, query):
+        self.delete(query)
+
+    async def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            if isinstance(op, InsertOne):
+                await self.insert_one(op._doc)
+            elif isinstance(op, UpdateOne):
+                self.update(op._filter, op._doc, op._upsert)
+            elif isinstance(op, ReplaceOne):
+                self.replace(op._filter, op._doc, op._upsert)
+            elif isinstance(op, DeleteOne):
+                self.delete(op._filter, 1)
+            elif isinstance(op, DeleteMany):
+                self.delete(op._filter)
+            else:
+                raise NotImplementedError(op)
+
+    def update(self, query, update, upsert=False):
+        if (doc := next((d for d in self.docs if matches(d, query)), None)) is None and upsert:
+            doc = {k: v for k, v in query.items() if not k.startswith('$')}
+            self.docs.append(doc)
+        if doc is not None:
+            update_doc(doc, update)
+
+    def replace(self, query, replacement, upsert=False):
+        for i, doc in enumerate(self.docs):
+            if matches(doc, query):
+                self.docs[i] = {'_id': doc['_id'], **replacement} if '_id' in doc else dict(replacement)
+                return
+        if upsert:
+            self.docs.append({**{k: v for k, v in query.items() if not k.startswith('$')}, **replacement})
+
+    def delete(self, query, limit=0):
+        deleted = [d for d in self.docs if matches(d, query)][:limit or None]
+        self.docs = [d for d in self.docs if not any(d is e for e in deleted)]
+
+
+class DB:
+    '''
+    a database, collections are created on first use, given as document lists or stand-ins
+    '''
+    def __init__(self, **collections):
+        for name, docs in collections.items():
+            setattr(self, name, Collection(docs) if isinstance(docs, (list, tuple)) else docs)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        collection = Collection()
+        setattr(self, name, collection)
+        return collection
+
+    def get_collection(self, name, codec_options=None):
+        return getattr(self, name)
+
+
+class Client:
+    '''
+    motor client for the 'timeclock' database
+    '''
+    def __init__(self, db: DB = None):
+        self.timeclock = db if db is not None else DB()
+
+    def close(self):
+        pass
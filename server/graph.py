@@ -4,6 +4,7 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from pprint import pprint
 from datetime import datetime
 
+import interval
 from util import get_mongo_db
 from models import GraphDataResponse
 
@@ -63,8 +64,12 @@ async def get_graph_data(mongo_db: AsyncIOMotorDatabase) -> GraphDataResponse:
     return {'columns': columns, 'employees': employees, 'data': data}
 
 
-async def get_weekly_graph_data(mongo_db: AsyncIOMotorDatabase, _range = None):
-    interval = 60 / 4
+def iter_weekly_graph_data(mongo_db: AsyncIOMotorDatabase, _range = None):
+    '''
+    cursor over the weekly buckets, latest first
+    '''
+    # minutes
+    step = 60 / 4
 
     pipeline = [
     	{'$addFields': {'parts': {'$dateToParts': {'date': '$start', 'timezone': 'America/New_York'}}}},
@@ -74,11 +79,11 @@ async def get_weekly_graph_data(mongo_db: AsyncIOMotorDatabase, _range = None):
                 'month': '$parts.month',
                 'day': '$parts.day',
                 'hour': '$parts.hour',
-                'minute': {'$toInt': {'$multiply': [{'$floor': {'$divide': ['$parts.minute', interval]}}, interval]}},
+                'minute': {'$toInt': {'$multiply': [{'$floor': {'$divide': ['$parts.minute', step]}}, step]}},
                 'timezone': 'America/New_York'}},
-    	    'diff': {'$toInt': {'$divide': [{'$subtract': [{'$ifNull': ['$end', '$$NOW']}, '$start']}, interval*60*1000]}},
+    	    'diff': {'$toInt': {'$divide': [{'$subtract': [{'$ifNull': ['$end', '$$NOW']}, '$start']}, step*60*1000]}},
     	}},
-    	{'$addFields': {'diff': {'$map': {'input': {'$range': [0, {'$add': ['$diff', 1]}, 1]}, 'in': {'$add': [{'$multiply': ['$$this', interval*60*1000]}, '$parts']}}}}},
+    	{'$addFields': {'diff': {'$map': {'input': {'$range': [0, {'$add': ['$diff', 1]}, 1]}, 'in': {'$add': [{'$multiply': ['$$this', step*60*1000]}, '$parts']}}}}},
     	{'$unwind': '$diff'},
     	{'$group': {'_id': '$diff', 'active': {'$push': {'id': '$_id', 'employee': '$employee'}}, 'count': {'$sum': 1}}},
     	{'$sort': {'_id': -1}},
@@ -87,14 +92,14 @@ async def get_weekly_graph_data(mongo_db: AsyncIOMotorDatabase, _range = None):
 
     if _range:
         min_date, max_date = _range
-        pipeline.insert(0, {'$match': {'$or': [
-            {'start': {'$gte': min_date, '$lt': max_date}},
-            {'end': {'$gte': min_date, '$lt': max_date}},
-            {'start': {'$lte': min_date}, 'end': {'$gt': max_date}},
-        ]}})
+        pipeline.insert(0, {'$match': interval.overlaps(min_date, max_date)})
         pipeline.append({'$match': {'date': {'$gt': min_date, '$lt': max_date}}})
 
-    return await mongo_db.components.aggregate(pipeline).to_list(None)
+    return mongo_db.components.aggregate(pipeline)
+
+
+async def get_weekly_graph_data(mongo_db: AsyncIOMotorDatabase, _range = None):
+    return await iter_weekly_graph_data(mongo_db, _range).to_list(None)
 
 
 async def main():
@@ -0,0 +1,77 @@
+# bucketed interval keys for overlap queries on shifts / components
+# each document stores 'days', the utc days it covers (start day only while open), indexed together
+# with employee and start (see daemon.init). a range then matches on a few day keys instead of an $or
+# over start / end, open documents are matched separately on start
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from pymongo import UpdateOne
+
+BUCKET = timedelta(days=1)
+INDEX = [('days', 1), ('employee', 1), ('start', 1)]
+
+
+def naive(date: datetime) -> datetime:
+    '''
+    naive utc, as stored
+    '''
+    return date if date.tzinfo is None else date.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def floor(date: datetime) -> datetime:
+    return naive(date).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def days(start: datetime, end: Optional[datetime]) -> List[datetime]:
+    '''
+    buckets covered by [start, end]
+    '''
+    day, last = floor(start), floor(end if end is not None else start)
+    result = [day]
+    while day < last:
+        day += BUCKET
+        result.append(day)
+    return result
+
+
+def overlaps(min_date: Optional[datetime], max_date: Optional[datetime], employee_id: str = None) -> dict:
+    '''
+    query for documents overlapping (min_date, max_date), either may be None for no bound
+    '''
+    if min_date is None and max_date is None:
+        query = {}
+    elif min_date is None:
+        query = {'start': {'$lt': max_date}}
+    elif max_date is None:
+        query = {'$or': [{'start': {'$gt': min_date}, 'end': None}, {'end': {'$gt': min_date}}]}
+    else:
+        query = {'$or': [
+            {'days': {'$in': days(min_date, max_date)}, 'start': {'$lt': max_date}, 'end': {'$gt': min_date}},
+            {'end': None, 'start': {'$lt': max_date}},
+        ]}
+    if employee_id is not None:
+        # in every branch so each can use the index
+        for branch in query.get('$or', [query]):
+            branch['employee'] = employee_id
+    return query
+
+
+async def add_days(collection, everything: bool = False, batch_size: int = 1000) -> int:
+    '''
+    fill 'days' of documents that have none (all if `everything`), in _id order
+    returns the number of documents updated
+    '''
+    query = {} if everything else {'days': {'$exists': False}}
+    count = 0
+    last = None
+    while True:
+        docs = await collection.find({**query, **({'_id': {'$gt': last}} if last else {})},
+                projection={'start': True, 'end': True}, sort=[('_id', 1)], limit=batch_size).to_list(None)
+        if not docs:
+            return count
+        if ops := [UpdateOne({'_id': doc['_id']}, {'$set': {'days': days(doc['start'], doc['end'])}})
+                for doc in docs if doc.get('start') is not None]:
+            await collection.bulk_write(ops, ordered=False)
+        count += len(ops)
+        last = docs[-1]['_id']
+        logging.info(f'added days to {count} {collection.name}')
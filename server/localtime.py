@@ -0,0 +1,64 @@
+# fast conversion of naive local (US/Eastern) timestamps to naive UTC
+# precomputes the timezone's transitions once, each conversion is a bisect instead of tz.localize
+import pytz
+from bisect import bisect_right
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+
+class TransitionTable:
+    '''
+    utc offset periods of a pytz timezone
+
+    results match `tz.localize(dt, is_dst=is_dst).astimezone(pytz.UTC).replace(tzinfo=None)`
+    ambiguous local times (clocks wound back) resolve to the period with matching dst, missing local
+    times (clocks wound forward) use the offset from before the jump unless is_dst. is_dst=None raises
+    pytz.AmbiguousTimeError / pytz.NonExistentTimeError like pytz does.
+    '''
+    def __init__(self, tz):
+        self.tz = tz
+        # period k is in effect from utc[k] until utc[k + 1]
+        self.utc = list(tz._utc_transition_times)
+        self.offsets = [offset for offset, _, _ in tz._transition_info]
+        self.dst = [bool(dst) for _, dst, _ in tz._transition_info]
+        # local time at which each period starts
+        self.local = [t + offset if i else datetime.min for i, (t, offset) in enumerate(zip(self.utc, self.offsets))]
+
+    def _local_end(self, k: int) -> datetime:
+        return self.utc[k + 1] + self.offsets[k] if k + 1 < len(self.utc) else datetime.max
+
+    def to_utc(self, dt: datetime, is_dst: Optional[bool] = False) -> datetime:
+        k = max(0, bisect_right(self.local, dt) - 1)
+
+        if dt >= self._local_end(k):
+            # in the gap between period k and k + 1
+            if is_dst is None:
+                raise pytz.NonExistentTimeError(dt)
+            return dt - self.offsets[k + 1 if is_dst else k]
+
+        if k == 0 or dt >= self._local_end(k - 1):
+            return dt - self.offsets[k]
+
+        # also valid in period k - 1
+        if is_dst is None:
+            raise pytz.AmbiguousTimeError(dt)
+        candidates = [c for c in (k - 1, k) if self.dst[c] == is_dst] or [k - 1, k]
+        if len(candidates) == 1:
+            return dt - self.offsets[candidates[0]]
+        # same dst on both sides, earliest utc if is_dst else latest
+        return (min if is_dst else max)(dt - self.offsets[c] for c in candidates)
+
+    def to_utc_many(self, dates: Iterable[Optional[datetime]], is_dst: Optional[bool] = False) -> List[Optional[datetime]]:
+        '''
+        convert a batch, None passes through
+        '''
+        return [None if dt is None else self.to_utc(dt, is_dst) for dt in dates]
+
+    def to_local(self, dt: datetime) -> datetime:
+        '''
+        naive utc to naive local
+        '''
+        return dt + self.offsets[max(0, bisect_right(self.utc, dt) - 1)]
+
+
+EASTERN = TransitionTable(pytz.timezone('US/Eastern'))
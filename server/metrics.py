@@ -0,0 +1,141 @@
+# daemon metrics, served in prometheus text format at /metrics on DAEMON.METRICS_PORT
+# per stage timings (GetTimecards, parse, mongo reads / writes, recalculate), per cycle sizes, sync lag
+# and error counts
+import time
+from abc import ABC, abstractmethod
+from aiohttp import web
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Sequence
+
+SECONDS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZES = (0, 1, 10, 100, 1000, 10000, 100000)
+
+REGISTRY = []
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Metric(ABC):
+    type = None
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        REGISTRY.append(self)
+
+    @abstractmethod
+    def samples(self):
+        '''
+        (name, labels, value) per sample
+        '''
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        lines.extend(f'{name}{format_labels(labels)} {format_value(value)}' for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.values = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        self.values[tuple(sorted(labels.items()))] += amount
+
+    def value(self, **labels) -> float:
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield f'{self.name}_total', labels, value
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        self.values[tuple(sorted(labels.items()))] = value
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, labels, value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = SECONDS):
+        super().__init__(name, help)
+        self.buckets = sorted(buckets)
+        # per label set, counts per bucket (not cumulative) plus the overflow, sum
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        if (entry := self.values.get(key)) is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, **labels)
+
+    def samples(self):
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip([*self.buckets, float('inf')], counts):
+                cumulative += count
+                yield f'{self.name}_bucket', (*labels, ('le', format_value(bound))), cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+RPC_SECONDS = Histogram('timeclock_rpc_seconds', 'GetTimecards latency')
+PARSE_SECONDS = Histogram('timeclock_parse_seconds', 'time spent turning timecards / punches into components per window')
+MONGO_SECONDS = Histogram('timeclock_mongo_seconds', 'reconcile reads / writes')
+RECALCULATE_SECONDS = Histogram('timeclock_recalculate_seconds', 'calculate_rows.recalculate time')
+SYNC_SECONDS = Histogram('timeclock_sync_seconds', 'sync cycle time')
+CYCLE_COMPONENTS = Histogram('timeclock_cycle_components', 'components merged per sync cycle', SIZES)
+CYCLE_SHIFTS = Histogram('timeclock_cycle_shifts', 'shifts written per sync cycle', SIZES)
+COMPONENTS = Counter('timeclock_components', 'components merged')
+SHIFTS = Counter('timeclock_shifts', 'shifts written')
+ERRORS = Counter('timeclock_errors', 'errors by stage')
+SYNC_LAG = Gauge('timeclock_sync_lag_seconds', 'time the latest poll has been waiting for a sync')
+LAST_SYNC = Gauge('timeclock_last_sync_timestamp_seconds', 'end of the latest sync, unix time')
+LAST_POLL = Gauge('timeclock_last_poll_timestamp_seconds', 'latest device poll, unix time')
+
+
+async def get_metrics(request):
+    return web.Response(text=render(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+async def serve(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get('/metrics', get_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
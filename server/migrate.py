@@ -0,0 +1,77 @@
+# one-off schema migrations, safe to run again
+#
+# python migrate.py embed [--all]    copy components into their shift documents ('parts')
+# python migrate.py days [--all]     add interval keys ('days') to shifts and components
+import asyncio
+import logging
+import argparse
+import configparser
+from pymongo import UpdateOne
+from bson.codec_options import CodecOptions, TypeRegistry
+
+import interval
+from util import get_mongo_db
+from shifts import embed
+from daemon import timedelta_encoder
+
+
+async def embed_components(mongo_db, everything: bool = False, batch_size: int = 1000) -> int:
+    '''
+    fill 'parts' of shifts that have none (all shifts if `everything`), in _id order
+    returns the number of shifts updated
+    '''
+    shifts_col = mongo_db.get_collection('shifts',
+            codec_options=CodecOptions(type_registry=TypeRegistry(fallback_encoder=timedelta_encoder)))
+    query = {} if everything else {'parts': {'$exists': False}}
+    count = 0
+    last = None
+    while True:
+        shifts = await mongo_db.shifts.find({**query, **({'_id': {'$gt': last}} if last else {})},
+                projection={'components': True}, sort=[('_id', 1)], limit=batch_size).to_list(None)
+        if not shifts:
+            return count
+        components = {c['_id']: c async for c in mongo_db.components.find(
+                {'_id': {'$in': [cid for s in shifts for cid in s['components']]}},
+                projection={'start': True, 'end': True})}
+        ops = []
+        for shift in shifts:
+            parts = [components[cid] for cid in shift['components'] if cid in components]
+            if len(parts) != len(shift['components']):
+                logging.warning(f'shift {shift["_id"]} is missing {len(shift["components"]) - len(parts)} components')
+            ops.append(UpdateOne({'_id': shift['_id']}, {'$set': {'parts': embed(sorted(parts, key=lambda c: c['start']))}}))
+        await shifts_col.bulk_write(ops, ordered=False)
+        count += len(ops)
+        last = shifts[-1]['_id']
+        logging.info(f'embedded components in {count} shifts')
+
+
+async def main(config, args):
+    mongo_client = await get_mongo_db(config['MONGO'])
+    try:
+        if args.command == 'embed':
+            count = await embed_components(mongo_client.timeclock, args.all, args.batch_size)
+            logging.info(f'done, {count} shifts updated')
+        elif args.command == 'days':
+            for collection in (mongo_client.timeclock.shifts, mongo_client.timeclock.components):
+                count = await interval.add_days(collection, args.all, args.batch_size)
+                logging.info(f'done, {count} {collection.name} updated')
+    finally:
+        mongo_client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='schema migrations')
+    commands = parser.add_subparsers(dest='command', required=True)
+    embed_parser = commands.add_parser('embed', help='copy components into shift documents, see SERVER.EMBEDDED_COMPONENTS')
+    embed_parser.add_argument('--all', action='store_true', help='rewrite shifts that already have them')
+    embed_parser.add_argument('--batch-size', type=int, default=1000)
+    days_parser = commands.add_parser('days', help='add interval keys for overlap queries')
+    days_parser.add_argument('--all', action='store_true', help='rewrite documents that already have them')
+    days_parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(config, args))
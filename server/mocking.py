@@ -0,0 +1,130 @@
+# local stand-in for the AMG Timecard.ashx xml-rpc endpoint
+# serves GetTimecards from seeded synthetic punches, with configurable latency
+#
+# python mocking.py --employees 50 --years 2 --seed 1 --latency 0.2 --port 3003
+import random
+import asyncio
+import logging
+import argparse
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, List
+from aiohttp import web
+from aiohttp_xmlrpc import handler
+
+# (start hour, length in hours, chance of a lunch break)
+SCHEDULES = [
+    (7, 8.5, 0.6),   # day
+    (6, 10, 0.4),    # early, long
+    (15, 8, 0.3),    # second shift
+    (22, 8, 0.1),    # overnight
+]
+
+
+class Punches:
+    def __init__(self):
+        self.id = 0
+
+    def __call__(self, date: datetime) -> dict:
+        self.id += 1
+        return {'Id': self.id, 'OriginalDate': date.replace(second=0, microsecond=0)}
+
+
+def generate_employee(rng: random.Random, punch, min_date: datetime, max_date: datetime) -> List[dict]:
+    '''
+    timecards (local time) for one employee, sorted by date
+    includes split (lunch) components, split shifts, overnight shifts and a possibly open last shift
+    '''
+    start_hour, length, lunch = rng.choice(SCHEDULES)
+    workdays = set(rng.sample(range(7), rng.choice([4, 5, 5, 5, 6])))
+    timecards = []
+
+    day = min_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < max_date:
+        if day.weekday() in workdays and rng.random() > 0.04 or rng.random() < 0.02:
+            start = day + timedelta(hours=start_hour + rng.gauss(0, 0.25))
+            end = start + timedelta(hours=length + rng.gauss(0, 0.75))
+            if rng.random() < 0.05:
+                # split shift, back after more than four hours
+                breaks = [(start + timedelta(hours=3), timedelta(hours=rng.uniform(4.5, 6)))]
+            elif rng.random() < lunch:
+                breaks = [(start + timedelta(hours=length / 2 + rng.gauss(0, 0.3)), timedelta(minutes=rng.choice([30, 30, 45, 60])))]
+            else:
+                breaks = []
+
+            for b, gap in breaks:
+                if b >= max_date:
+                    break
+                timecards.append({'Date': day, 'IsManual': rng.random() < 0.01, 'Reg': (b - start).total_seconds() / 3600,
+                    'StartPunch': punch(start), 'StopPunch': punch(b)})
+                start, end = b + gap, end + gap
+            item = {'Date': day, 'IsManual': rng.random() < 0.01, 'Reg': (end - start).total_seconds() / 3600,
+                    'StartPunch': punch(start)}
+            if end < max_date:
+                item['StopPunch'] = punch(end)
+            if start < max_date:
+                timecards.append(item)
+        day += timedelta(days=1)
+
+    return timecards
+
+
+def generate(employees: int = 20, years: float = 1, seed: int = 0, end: datetime = None) -> Dict[int, List[dict]]:
+    '''
+    seeded timecards for `employees` employees over `years` years ending at `end`
+    '''
+    rng = random.Random(seed)
+    end = end or datetime.now()
+    start = end - timedelta(days=365 * years)
+    punch = Punches()
+    return {employee_id: generate_employee(rng, punch, start, end) for employee_id in range(1, employees + 1)}
+
+
+class TimecardView(handler.XMLRPCView):
+    async def rpc_GetTimecards(self, employee_ids, min_date, max_date, *args):
+        return await self.request.app['timecards'].get(employee_ids, min_date, max_date)
+
+
+class Timecards:
+    def __init__(self, timecards: Dict[int, List[dict]], latency: float = 0, jitter: float = 0):
+        self.timecards = timecards
+        self.dates = {employee_id: [t['Date'] for t in items] for employee_id, items in timecards.items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+
+    async def get(self, employee_ids, min_date, max_date):
+        self.calls += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        result = []
+        for employee_id in employee_ids:
+            if (dates := self.dates.get(int(employee_id))) is None:
+                continue
+            items = self.timecards[int(employee_id)][bisect_left(dates, min_date):bisect_left(dates, max_date)]
+            result.append({'EmployeeId': int(employee_id), 'Timecards': items})
+        return result
+
+
+def create_app(timecards: Timecards):
+    app = web.Application()
+    app['timecards'] = timecards
+    app.router.add_route('*', '/API/Timecard.ashx', TimecardView)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AMG timecard server stand-in')
+    parser.add_argument('--employees', type=int, default=20)
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end', type=datetime.fromisoformat, default=None)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to each call')
+    parser.add_argument('--jitter', type=float, default=0, help='random extra seconds, up to')
+    parser.add_argument('--port', type=int, default=3003)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    timecards = Timecards(generate(args.employees, args.years, args.seed, args.end), args.latency, args.jitter)
+    logging.info(f'generated {sum(len(t) for t in timecards.timecards.values())} timecards')
+    web.run_app(create_app(timecards), host='0.0.0.0', port=args.port)
@@ -0,0 +1,53 @@
+# keyset pagination of /data/shifts on (start, _id)
+# a page is at most `limit` shifts in (start, _id) order, the next one starts after the last shift read.
+# the position is handed to clients as an opaque token (urlsafe base64 of bson) with a digest of the
+# filters it was issued for, so it can not be replayed against another query
+import bson
+import base64
+import hashlib
+import binascii
+from datetime import datetime
+from typing import Hashable, Optional, Tuple
+
+SORT = [('start', 1), ('_id', 1)]
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def digest(filters: Hashable) -> bytes:
+    return hashlib.sha1(repr(filters).encode()).digest()[:8]
+
+
+def encode_token(start: datetime, _id: bson.ObjectId, filters: Hashable) -> str:
+    '''
+    token for the page after the shift at (start, _id)
+    '''
+    raw = bson.encode({'s': start, 'i': _id, 'f': digest(filters)})
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_token(token: str, filters: Hashable) -> Tuple[datetime, bson.ObjectId]:
+    '''
+    (start, _id) of a token issued for `filters`
+    '''
+    try:
+        doc = bson.decode(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        start, _id, issued = doc['s'], doc['i'], doc['f']
+    except (binascii.Error, bson.errors.BSONError, KeyError, ValueError):
+        raise InvalidToken('malformed page token')
+    if not isinstance(start, datetime) or not isinstance(_id, bson.ObjectId) or issued != digest(filters):
+        raise InvalidToken('page token does not match this query')
+    return start, _id
+
+
+def after(query: dict, position: Optional[Tuple[datetime, bson.ObjectId]]) -> dict:
+    '''
+    `query` restricted to documents after `position` in SORT order
+    '''
+    if position is None:
+        return query
+    start, _id = position
+    keyset = {'$or': [{'start': {'$gt': start}}, {'start': start, '_id': {'$gt': _id}}]}
+    return {'$and': [query, keyset]} if query else keyset
@@ -0,0 +1,93 @@
+# compare the components produced by GetTimecards and by pairing tam.tr_clock punches
+# run before trusting the mysql ingestion path (DAEMON.INGEST = mysql / backfill.py --ingest mysql)
+#
+# python parity.py --from 2020-01-01 [--to 2020-02-01] [--employees 1,2,3] [--show 20]
+import sys
+import asyncio
+import logging
+import argparse
+import configparser
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from util import get_async_rpc_connection, get_mysql_db, get_mongo_db
+from daemon import fetch_timecards, parse_timecard
+from punches import fetch_punches
+from localtime import EASTERN
+
+EDGE = timedelta(days=1)
+
+
+def compare(expected: Iterable[dict], actual: Iterable[dict]) -> dict:
+    '''
+    match components on (employee, start), returns counts and the differences
+    '''
+    def index(components):
+        return {(c['employee'], c['start']): c for c in components if c['start'] is not None}
+    expected, actual = index(expected), index(actual)
+    different = [(expected[k], actual[k]) for k in expected.keys() & actual.keys() if expected[k]['end'] != actual[k]['end']]
+    missing = [expected[k] for k in expected.keys() - actual.keys()]
+    extra = [actual[k] for k in actual.keys() - expected.keys()]
+    return {
+        'matched': len(expected.keys() & actual.keys()) - len(different),
+        'different': sorted(different, key=lambda p: (p[0]['employee'], p[0]['start'])),
+        'missing': sorted(missing, key=lambda c: (c['employee'], c['start'])),
+        'extra': sorted(extra, key=lambda c: (c['employee'], c['start'])),
+    }
+
+
+async def check(config, from_date: datetime, to_date: datetime, employee_ids=None) -> dict:
+    mysql_db = await get_mysql_db(config['MYSQL'])
+    proxy = get_async_rpc_connection(config['AMG'])
+    try:
+        if employee_ids is None:
+            mongo_client = await get_mongo_db(config['MONGO'])
+            employee_ids = sorted(int(empl['id']) for empl in await mongo_client.timeclock.employees.find({}).to_list(None))
+            mongo_client.close()
+
+        rpc = []
+        async for _, _, timecards in fetch_timecards(proxy, employee_ids, from_date, to_date,
+                chunk_size=config.getint('AMG', 'chunk_size', fallback=50),
+                concurrency=config.getint('AMG', 'concurrency', fallback=4)):
+            rpc.extend(c for _, it in parse_timecard(timecards) for c in it)
+
+        mysql = []
+        async for _, _, employee_components in fetch_punches(mysql_db, employee_ids, from_date, to_date):
+            mysql.extend(c for _, components in employee_components for c in components)
+
+        # AMG dates a component by its shift, the mysql path by its start, skip the edges
+        a, b = EASTERN.to_utc(from_date + EDGE), EASTERN.to_utc(to_date - EDGE)
+        return compare([c for c in rpc if c['start'] and a <= c['start'] < b],
+                [c for c in mysql if a <= c['start'] < b])
+    finally:
+        await proxy.close()
+        mysql_db.close()
+        await mysql_db.wait_closed()
+
+
+def describe(component: dict) -> str:
+    return f'{component["employee"]:>6} {component["start"]} - {component["end"]} punches={component["punches"]}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare GetTimecards and tam.tr_clock components')
+    parser.add_argument('--from', dest='from_date', type=datetime.fromisoformat, required=True)
+    parser.add_argument('--to', dest='to_date', type=datetime.fromisoformat, default=datetime.now())
+    parser.add_argument('--employees', type=lambda s: [int(v) for v in s.split(',')])
+    parser.add_argument('--show', type=int, default=20, help='differences to print per kind')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    result = asyncio.run(check(config, args.from_date, args.to_date, args.employees))
+    print(f'matched {result["matched"]}, different end {len(result["different"])}, '
+            f'missing from mysql {len(result["missing"])}, only in mysql {len(result["extra"])}')
+    for rpc, mysql in result['different'][:args.show]:
+        print(f'different  rpc {describe(rpc)}\n          mysql {describe(mysql)}')
+    for c in result['missing'][:args.show]:
+        print(f'missing    rpc {describe(c)}')
+    for c in result['extra'][:args.show]:
+        print(f'extra    mysql {describe(c)}')
+    sys.exit(0 if not (result['different'] or result['missing'] or result['extra']) else 1)
@@ -0,0 +1,127 @@
+# read punches straight from tam.tr_clock and pair them into components
+# alternative to GetTimecards for bulk history, output matches daemon.parse_timecard so it goes
+# through the same reconciliation path. parity.py compares the two over a date range
+#
+# punches are paired in order, a punch more than MAX_LENGTH after the previous (unpaired) one
+# starts a new component and leaves the previous one open. so a punch more than MAX_LENGTH after the
+# previous punch always starts a component, pairing starts from such a punch and carries over between windows
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+import metrics
+from localtime import EASTERN
+
+QUERY = ('select id, inf_employee_id, Date from tam.tr_clock where inf_employee_id in %s and Date >= %s and Date < %s '
+        'order by inf_employee_id, Date, id')
+
+# longest component that is still paired
+MAX_LENGTH = timedelta(hours=20)
+# read this far back (doubling) to find a punch to start pairing from
+LOOKBACK = timedelta(days=7)
+
+
+def to_component(employee_id: str, start: Tuple[int, datetime], end: Optional[Tuple[int, datetime]]) -> dict:
+    (start_id, start_date), (end_id, end_date) = start, end or (None, None)
+    return {
+        'punches': [start_id] if end is None else [start_id, end_id],
+        'employee': employee_id,
+        # timecard date, local day the component started
+        'date': start_date.replace(hour=0, minute=0, second=0, microsecond=0),
+        'hours': None if end is None else (end_date - start_date).total_seconds() / 3600,
+        'start': EASTERN.to_utc(start_date),
+        'end': None if end is None else EASTERN.to_utc(end_date),
+    }
+
+
+def pair_punches(employee_id: str, punches: Iterable[Tuple[int, datetime]], max_length: timedelta = MAX_LENGTH) -> List[dict]:
+    '''
+    components from (id, local date) punches sorted by date
+    '''
+    components = []
+    start = None
+    for punch in punches:
+        if start is not None and punch[1] - start[1] <= max_length:
+            components.append(to_component(employee_id, start, punch))
+            start = None
+            continue
+        if start is not None:
+            components.append(to_component(employee_id, start, None))
+        start = punch
+    if start is not None:
+        components.append(to_component(employee_id, start, None))
+    return components
+
+
+def find_anchor(dates: Iterable[datetime], since: datetime, before: datetime, max_length: timedelta = MAX_LENGTH) -> Optional[datetime]:
+    '''
+    latest time before `before` from which pairing is certain, the punch there (if any) starts a component
+    `dates` are sorted punch times from `since`, earlier punches are unknown
+    '''
+    anchor = None
+    previous = since
+    for date in dates:
+        if date >= before:
+            break
+        if date - previous > max_length:
+            anchor = date
+        previous = date
+    if before - previous > max_length:
+        anchor = before
+    return anchor
+
+
+async def find_anchors(mysql_db, ids, before: datetime, lookback: timedelta = LOOKBACK, max_length: timedelta = MAX_LENGTH,
+        attempts: int = 4) -> dict:
+    '''
+    anchor per employee, looking further back for employees that worked long streaks without a break
+    '''
+    anchors = {}
+    pending = ids
+    for attempt in range(attempts):
+        since = before - lookback * 2 ** attempt
+        dates = {}
+        async for rows in mysql_db.stream(QUERY, (pending, since, before)):
+            for _, employee_id, date in rows:
+                dates.setdefault(str(employee_id), []).append(date)
+        for employee_id in pending:
+            if (anchor := find_anchor(dates.get(str(employee_id), []), since, before, max_length)) is not None:
+                anchors[str(employee_id)] = anchor
+        if not (pending := tuple(i for i in pending if str(i) not in anchors)):
+            return anchors
+    logging.warning(f'no break found for {len(pending)} employees since {since}, pairing may be off')
+    return {**anchors, **{str(i): since for i in pending}}
+
+
+async def fetch_punches(mysql_db, employee_ids, min_date: datetime, end_date: datetime,
+        interval: timedelta = timedelta(days=14), max_length: timedelta = MAX_LENGTH, lookback: timedelta = LOOKBACK):
+    '''
+    split [min_date, end_date) into windows, yields (window start, window end, [(employee_id, components)])
+    like daemon.fetch_timecards + parse_timecard, components are those dated (local start day) in the window
+    '''
+    ids = tuple(int(employee_id) for employee_id in employee_ids)
+    if not ids:
+        return
+    # where pairing starts per employee, carried over from window to window
+    anchors = await find_anchors(mysql_db, ids, min_date, lookback, max_length)
+    while min_date < end_date:
+        max_date = min_date + interval
+        # components dated in the window start before the next day and end within max_length
+        horizon = max_date + timedelta(days=1) + max_length
+        punches = {str(i): [] for i in ids}
+        async for rows in mysql_db.stream(QUERY, (ids, min(anchors.values()), horizon)):
+            for punch_id, employee_id, date in rows:
+                if date >= anchors[str(employee_id)]:
+                    punches[str(employee_id)].append((punch_id, date))
+
+        result = []
+        with metrics.PARSE_SECONDS.time():
+            for employee_id, items in punches.items():
+                components = pair_punches(employee_id, items, max_length)
+                result.append((employee_id, [c for c in components if min_date <= c['date'] < max_date]))
+                # first component of the next window, or whatever comes after the punches read
+                dates = dict(items)
+                anchors[employee_id] = next((dates[c['punches'][0]] for c in components if c['date'] >= max_date), horizon)
+
+        yield min_date, max_date, result
+        min_date = max_date
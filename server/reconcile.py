@@ -0,0 +1,183 @@
+# batched reconciliation of parsed timecards with existing components / shifts
+# one bulk read per window, merge in memory, one bulk_write per collection
+import logging
+from collections import defaultdict
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+
+import metrics
+import interval
+from shifts import SHIFT_GAP, ShiftAssembler, embed
+
+
+def stored(date):
+    '''
+    `date` as mongo keeps it, datetimes are stored with millisecond precision
+    '''
+    return date if date is None else date.replace(microsecond=date.microsecond // 1000 * 1000)
+
+
+def key(component):
+    '''
+    (employee, start) as mongo compares it
+    '''
+    return component['employee'], stored(component['start'])
+
+
+def extent(components) -> tuple:
+    '''
+    what the row layout reads of a shift, the (start, end) of its components in order
+    '''
+    return tuple((stored(c['start']), stored(c['end'])) for c in components)
+
+
+class Window:
+    '''
+    in-memory view of the components / shifts touched by one batch of timecards
+    '''
+    def __init__(self, components, shifts):
+        self.components = {c['_id']: c for c in components}
+        self.by_key = {key(c): c for c in components}
+        # shift documents hold component ids, resolve them for the assembler
+        self.shifts = {s['_id']: {**s, 'components': [self.components.get(cid) for cid in s['components']]}
+                for s in shifts}
+        self.parent = {c['_id']: s for s in self.shifts.values() for c in s['components'] if c is not None}
+        # as last laid out, shifts without embedded components are always laid out again
+        self.extents = {s['_id']: extent(s['parts']) for s in shifts if 'parts' in s}
+        by_employee = defaultdict(list)
+        for shift in self.shifts.values():
+            by_employee[shift['employee']].append(shift)
+        self.assemblers = defaultdict(ShiftAssembler, {e: ShiftAssembler(s) for e, s in by_employee.items()})
+        self.new_components = {}
+        self.new_shifts = {}
+        self.dirty_components = set()
+        self.dirty_shifts = set()
+
+    def merge(self, component):
+        employee_id = component['employee']
+        assembler = self.assemblers[employee_id]
+
+        if (existing := self.by_key.get(key(component))) is not None:
+            component_id = existing['_id']
+            existing.update(component)
+            if component_id not in self.new_components:
+                self.dirty_components.add(component_id)
+
+            if (parent_shift := self.parent.get(component_id)) is None:
+                raise Exception('missing parent_shift for component')
+            assembler.update(parent_shift)
+        else:
+            component['_id'] = component_id = ObjectId()
+            self.components[component_id] = self.by_key[key(component)] = component
+            self.new_components[component_id] = component
+            parent_shift = self.attach(component)
+
+        if parent_shift['_id'] not in self.new_shifts:
+            self.dirty_shifts.add(parent_shift['_id'])
+
+    def attach(self, component):
+        parent_shift = self.assemblers[component['employee']].append(component)
+        if '_id' not in parent_shift:
+            parent_shift.update({'_id': ObjectId(), 'employee': component['employee']})
+            self.shifts[parent_shift['_id']] = self.new_shifts[parent_shift['_id']] = parent_shift
+        self.parent[component['_id']] = parent_shift
+        return parent_shift
+
+    def orphans(self):
+        '''
+        components without a shift, left by a sync interrupted between the two writes
+        '''
+        return sorted((c for c in self.components.values() if c['_id'] not in self.parent), key=lambda c: c['start'])
+
+    def adopt(self, components):
+        for component in components:
+            if (parent_shift := self.attach(component))['_id'] not in self.new_shifts:
+                self.dirty_shifts.add(parent_shift['_id'])
+
+    def component_doc(self, component):
+        return {**component, 'days': interval.days(component['start'], component['end'])}
+
+    def component_ops(self):
+        ops = [InsertOne(self.component_doc(c)) for c in self.new_components.values()]
+        for component_id in self.dirty_components:
+            c = self.component_doc(self.components[component_id])
+            ops.append(UpdateOne({'_id': component_id}, {'$set': {k: v for k, v in c.items() if k != '_id'}}))
+        return ops
+
+    def shift_doc(self, shift):
+        return {'_id': shift['_id'], 'employee': shift['employee'],
+                'components': [c['_id'] for c in shift['components']],
+                'parts': embed(shift['components']),
+                'days': interval.days(shift['start'], shift['end']),
+                **{k: shift[k] for k in ('start', 'end', 'duration', 'state')}}
+
+    def shift_ops(self):
+        '''
+        shifts that moved are marked 'relayout' for calculate_rows.recalculate
+        '''
+        ops = [InsertOne({**self.shift_doc(s), 'relayout': True}) for s in self.new_shifts.values()]
+        for shift_id in self.dirty_shifts:
+            shift = self.shifts[shift_id]
+            s = {k: v for k, v in self.shift_doc(shift).items() if k not in ('_id', 'employee')}
+            if self.extents.get(shift_id) != extent(shift['components']):
+                s['relayout'] = True
+            ops.append(UpdateOne({'_id': shift_id}, {'$set': s}))
+        return ops
+
+
+async def load_window(mongo_db, components):
+    '''
+    fetch every component / shift that merging `components` could touch
+    '''
+    employee_ids = list({c['employee'] for c in components})
+    # as stored, a start with microseconds is after its stored copy
+    starts = [stored(c['start']) for c in components]
+    min_start, max_start = min(starts), max(starts)
+
+    existing = await mongo_db.components.find({
+        'employee': {'$in': employee_ids},
+        'start': {'$gte': min_start, '$lte': max_start},
+    }).to_list(None)
+
+    shifts = await mongo_db.shifts.find({'$or': [
+        {'components': {'$in': [c['_id'] for c in existing]}},
+        {'employee': {'$in': employee_ids}, 'end': {'$gt': min_start - SHIFT_GAP, '$lte': max_start}},
+    ]}).to_list(None)
+
+    loaded = {c['_id'] for c in existing}
+    if missing := list({cid for s in shifts for cid in s['components']} - loaded):
+        existing.extend(await mongo_db.components.find({'_id': {'$in': missing}}).to_list(None))
+
+    return Window(existing, shifts)
+
+
+async def reconcile(mongo_db, shifts_col, employee_timecards):
+    '''
+    merge parsed timecards into components / shifts with a fixed number of round-trips
+    produces the same documents as merging one component at a time
+    '''
+    components = [component for _, it in employee_timecards for component in it
+            if component['start'] is not None]
+    if not components:
+        return 0
+
+    with metrics.MONGO_SECONDS.time(op='read'):
+        window = await load_window(mongo_db, components)
+    if orphans := window.orphans():
+        logging.warning(f'{len(orphans)} components without a shift, reattaching')
+        window.adopt(orphans)
+    for component in components:
+        window.merge(component)
+
+    shift_ops = window.shift_ops()
+    with metrics.MONGO_SECONDS.time(op='write'):
+        if ops := window.component_ops():
+            await mongo_db.components.bulk_write(ops)
+        if shift_ops:
+            await shifts_col.bulk_write(shift_ops)
+    metrics.COMPONENTS.inc(len(components))
+    metrics.SHIFTS.inc(len(shift_ops))
+
+    logging.info(f'reconciled {len(components)} components '
+            f'({len(window.new_components)} new, {len(window.new_shifts)} new shifts)')
+    return len(components)
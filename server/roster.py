@@ -0,0 +1,71 @@
+# employee roster sync from tam.inf_employee
+# rows are fingerprinted so only new / changed employees are written, changes are announced in the
+# capped 'roster_updates' collection so the api can drop its cached employee map
+import hashlib
+import logging
+import asyncio
+from datetime import datetime
+from pymongo import ReplaceOne
+
+import models
+import metrics
+from util import tail
+
+QUERY = 'select id,Code,Name,MiddleName,LastName,HireDate from tam.inf_employee'
+
+
+def fingerprint(row: dict) -> str:
+    return hashlib.sha1(repr(sorted(row.items())).encode()).hexdigest()
+
+
+def to_employee(row: dict) -> models.Employee:
+    employee_id = row['id']
+    return {**row, 'id': str(employee_id),
+            'Color': models.EmployeeShiftColor(employee_id % len(models.EmployeeShiftColor)),
+            'fingerprint': fingerprint(row)}
+
+
+async def sync_roster(mongo_db, mysql_db):
+    '''
+    upsert new / changed employees, returns their ids
+    '''
+    import aiomysql
+    known = {doc['id']: doc.get('fingerprint') async for doc in
+            mongo_db.employees.find({}, projection={'_id': False, 'id': True, 'fingerprint': True})}
+
+    changed = []
+    async for rows in mysql_db.stream(QUERY, cursor_class=aiomysql.SSDictCursor):
+        ops = []
+        for row in rows:
+            employee = to_employee(row)
+            if known.get(employee['id']) != employee['fingerprint']:
+                changed.append(employee['id'])
+                ops.append(ReplaceOne({'id': employee['id']}, employee, upsert=True))
+        if ops:
+            await mongo_db.employees.bulk_write(ops)
+
+    if changed:
+        logging.info(f'roster changed, {len(changed)} employees')
+        await mongo_db.roster_updates.insert_one({'date': datetime.utcnow(), 'ids': changed})
+    return changed
+
+
+async def roster_loop(mongo_db, mysql_db, interval: float):
+    '''
+    sync the roster every `interval` seconds
+    '''
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await sync_roster(mongo_db, mysql_db)
+        except Exception as e:
+            metrics.ERRORS.inc(stage='roster')
+            logging.exception(f'roster sync failed ({e})')
+
+
+async def watch_roster(mongo_db, callback):
+    '''
+    call `callback(doc)` for each roster update
+    '''
+    async for doc in tail(mongo_db.roster_updates):
+        callback(doc)
@@ -0,0 +1,87 @@
+# decide when the daemon wakes up next
+# learns the device poll cadence from polllog history, wakes shortly after the next expected poll,
+# backs off exponentially (with jitter) when nothing arrives, and wakes early on a trigger
+import random
+import asyncio
+import logging
+from statistics import median
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from util import tail
+
+HISTORY = 48
+
+
+class Scheduler:
+    def __init__(self, polls: Iterable[datetime] = (), default_interval: timedelta = timedelta(hours=1),
+            delay: timedelta = timedelta(minutes=2), min_backoff: float = 60, max_backoff: float = 3600,
+            jitter: float = 0.5, rng: random.Random = None):
+        self.polls = sorted(polls)[-HISTORY:]
+        self.default_interval = default_interval
+        self.delay = delay
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+        self.attempts = 0
+        self.event = asyncio.Event()
+
+    def observe(self, polls: Iterable[datetime]):
+        '''
+        record new polls, resets the backoff
+        '''
+        self.polls = sorted({*self.polls, *polls})[-HISTORY:]
+        self.attempts = 0
+
+    def cadence(self) -> timedelta:
+        '''
+        typical time between polls, median so the odd manual poll / outage does not skew it
+        '''
+        intervals = [b - a for a, b in zip(self.polls, self.polls[1:]) if b > a]
+        return median(intervals) if intervals else self.default_interval
+
+    def next_poll(self) -> Optional[datetime]:
+        return self.polls[-1] + self.cadence() if self.polls else None
+
+    def backoff(self) -> float:
+        delay = min(self.max_backoff, self.min_backoff * 2 ** self.attempts)
+        self.attempts += 1
+        return delay * self.rng.uniform(1 - self.jitter, 1)
+
+    def timeout(self, now: datetime) -> float:
+        '''
+        seconds to sleep, until just after the next expected poll or backing off if it is overdue
+        '''
+        if (expected := self.next_poll()) is not None and now < expected + self.delay:
+            return (expected + self.delay - now).total_seconds()
+        return self.backoff()
+
+    def trigger(self):
+        self.event.set()
+
+    def triggered(self) -> bool:
+        '''
+        true once per trigger
+        '''
+        triggered = self.event.is_set()
+        self.event.clear()
+        return triggered
+
+    async def wait(self, timeout: float):
+        '''
+        sleep for `timeout` seconds or until triggered
+        '''
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def watch_triggers(mongo_db, scheduler: Scheduler):
+    '''
+    tail the capped 'triggers' collection, any new document wakes the scheduler
+    '''
+    async for doc in tail(mongo_db.triggers):
+        logging.info(f'sync triggered {doc.get("date")}')
+        scheduler.trigger()
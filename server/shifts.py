@@ -0,0 +1,120 @@
+# shift assembly
+# group an employee's components (clock in / clock out pairs) into shifts
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+import models
+
+# components starting less than this long after a shift ends belong to that shift
+SHIFT_GAP = timedelta(hours=4)
+
+
+def joins(end: Optional[datetime], start: datetime, gap: timedelta = SHIFT_GAP) -> bool:
+    '''
+    a component starting at `start` continues a shift ending at `end`
+    '''
+    return end is not None and start - gap < end <= start
+
+
+def get_duration(components) -> timedelta:
+    '''
+    if all start & end not None, add deltas up
+    '''
+    duration = timedelta()
+    if all(arr := [t for c in components for t in (c['start'], c['end'])]):
+        for a, b in zip(arr[0::2], arr[1::2]):
+            duration += b - a
+    return duration
+
+
+def embed(components: Iterable[dict]) -> List[dict]:
+    '''
+    copies of a shift's components kept in the shift document as 'parts', enough to draw it without a lookup
+    duration is None while open
+    '''
+    return [{'_id': c['_id'], 'start': c['start'], 'end': c['end'],
+             'duration': None if c['end'] is None else c['end'] - c['start']} for c in components]
+
+
+def get_state(end: Optional[datetime]) -> models.ShiftState:
+    return models.ShiftState.Incomplete if end is None else models.ShiftState.Complete
+
+
+def summarize(components: List[dict]) -> dict:
+    '''
+    start, end, duration and state of a shift, sorts `components` by start in place
+    '''
+    if any(c is None for c in components):
+        raise Exception('missing component for parent_shift')
+    components.sort(key=lambda c: c['start'])
+    end = components[-1]['end']
+    return {'start': components[0]['start'], 'end': end, 'duration': get_duration(components), 'state': get_state(end)}
+
+
+class ShiftAssembler:
+    '''
+    incrementally group one employee's components into shifts
+
+    shifts are dicts with a 'components' list (of component dicts) plus the fields from `summarize`,
+    any other keys (_id, employee, row...) are left alone. components may be appended in any order
+    but appending in start order is cheapest.
+    '''
+    def __init__(self, shifts: Iterable[dict] = (), gap: timedelta = SHIFT_GAP):
+        self.gap = gap
+        self.shifts = sorted(shifts, key=lambda s: s['start'])
+        self.starts = [s['start'] for s in self.shifts]
+        # longest closed shift, bounds how far back a parent can start
+        self.span = max((s['end'] - s['start'] for s in self.shifts if s['end'] is not None), default=timedelta())
+
+    def find_parent(self, start: datetime) -> Optional[dict]:
+        '''
+        latest ending shift that a component starting at `start` joins
+        '''
+        best = None
+        limit = start - self.gap - self.span
+        for i in range(bisect_right(self.starts, start) - 1, -1, -1):
+            shift = self.shifts[i]
+            if shift['start'] < limit:
+                break
+            if joins(shift['end'], start, self.gap) and (best is None or shift['end'] > best['end']):
+                best = shift
+        return best
+
+    def append(self, component) -> dict:
+        '''
+        add a new component, returns the (new or existing) shift it belongs to
+        '''
+        start = component['start']
+        if (shift := self.find_parent(start)) is None:
+            shift = {'components': [component], **summarize([component])}
+            i = bisect_right(self.starts, start)
+            self.shifts.insert(i, shift)
+            self.starts.insert(i, start)
+        else:
+            shift['components'].append(component)
+            shift.update(summarize(shift['components']))
+        self._track(shift)
+        return shift
+
+    def update(self, shift: dict) -> dict:
+        '''
+        recalculate a shift after one of its components changed (same start, new end)
+        '''
+        shift.update(summarize(shift['components']))
+        self._track(shift)
+        return shift
+
+    def _track(self, shift):
+        if shift['end'] is not None:
+            self.span = max(self.span, shift['end'] - shift['start'])
+
+
+def assemble(components: Iterable[dict], gap: timedelta = SHIFT_GAP) -> List[dict]:
+    '''
+    group one employee's components into shifts
+    '''
+    assembler = ShiftAssembler(gap=gap)
+    for component in sorted((c for c in components if c['start'] is not None), key=lambda c: c['start']):
+        assembler.append(component)
+    return assembler.shifts
@@ -0,0 +1,83 @@
+# live state snapshots in the capped 'state' collection
+# a keyframe holds every live shift, deltas in between hold what changed since the previous snapshot
+#
+# {'type': 'keyframe', 'seq': 10, 'date': ..., 'values': [shift, ...]}
+# {'type': 'delta', 'seq': 11, 'date': ..., 'opened': [shift, ...], 'closed': [id, ...], 'changed': [{'_id': id, 'end': ...}, ...]}
+import pymongo
+from typing import List, Optional
+
+KEYFRAME_INTERVAL = 24
+KEYFRAME_QUERY = {'$or': [{'type': 'keyframe'}, {'type': {'$exists': False}}]}
+
+
+def diff(previous: List[dict], values: List[dict]) -> dict:
+    '''
+    delta turning `previous` into `values`, changed entries carry only the fields that differ
+    '''
+    before = {v['_id']: v for v in previous}
+    after = {v['_id']: v for v in values}
+    changed = []
+    for id, value in after.items():
+        if (old := before.get(id)) is not None and old != value:
+            fields = {k: v for k, v in value.items() if k not in old or old[k] != v}
+            fields.update({k: None for k in old.keys() - value.keys()})
+            changed.append({'_id': id, **fields})
+    return {
+        'opened': [v for id, v in after.items() if id not in before],
+        'closed': [id for id in before if id not in after],
+        'changed': changed,
+    }
+
+
+def apply(values: List[dict], delta: dict) -> List[dict]:
+    '''
+    values after `delta`
+    '''
+    closed = set(delta.get('closed', []))
+    changed = {c['_id']: c for c in delta.get('changed', [])}
+    values = [{**v, **changed[v['_id']]} if v['_id'] in changed else v for v in values if v['_id'] not in closed]
+    return values + delta.get('opened', [])
+
+
+async def load(mongo_db) -> Optional[dict]:
+    '''
+    rebuild the latest state from the latest keyframe and the deltas after it
+    '''
+    keyframe = await mongo_db.state.find_one(KEYFRAME_QUERY, sort=[('_id', pymongo.DESCENDING)])
+    if keyframe is None:
+        return None
+    state = {'seq': keyframe.get('seq', 0), 'keyframe': keyframe.get('seq', 0), 'date': keyframe['date'],
+            'values': keyframe['values']}
+    async for delta in mongo_db.state.find({'_id': {'$gt': keyframe['_id']}}, sort=[('_id', pymongo.ASCENDING)]):
+        advance(state, delta)
+    return state
+
+
+def advance(state: dict, doc: dict) -> dict:
+    '''
+    apply a keyframe or delta document to a rebuilt state, stale documents are ignored
+    '''
+    seq = doc.get('seq', 0)
+    if doc.get('type', 'keyframe') == 'keyframe':
+        state.update({'seq': seq, 'keyframe': seq, 'date': doc['date'], 'values': doc['values']})
+    elif seq > state['seq']:
+        state.update({'seq': seq, 'date': doc['date'], 'values': apply(state['values'], doc)})
+    return state
+
+
+async def write(mongo_db, date, values: List[dict], previous: Optional[dict] = None,
+        keyframe_interval: int = KEYFRAME_INTERVAL) -> dict:
+    '''
+    store `values` as a delta against `previous`, or as a keyframe every `keyframe_interval` snapshots
+    '''
+    seq = previous['seq'] + 1 if previous else 1
+    doc = None
+    if previous is not None and seq - previous['keyframe'] < keyframe_interval:
+        delta = diff(previous['values'], values)
+        # not worth it if most of the shifts changed anyway
+        if len(delta['opened']) + len(delta['changed']) < max(len(values), 1):
+            doc = {'type': 'delta', 'seq': seq, 'date': date, **delta}
+    if doc is None:
+        doc = {'type': 'keyframe', 'seq': seq, 'date': date, 'values': values}
+    await mongo_db.state.insert_one(doc)
+    return doc
@@ -0,0 +1,103 @@
+import asyncio
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import backfill
+from fakes import DB, Client
+
+
+class FakeProxy:
+    '''
+    one timecard per employee a day into each requested window
+    '''
+    async def GetTimecards(self, ids, a, b, flag):
+        start = a + timedelta(days=1, hours=8)
+        return [{'EmployeeId': i, 'Timecards': [{'Date': a, 'IsManual': False, 'Reg': 8,
+                'StartPunch': {'Id': i, 'OriginalDate': start},
+                'StopPunch': {'Id': i, 'OriginalDate': start + timedelta(hours=8)}}]} for i in ids]
+
+    async def close(self):
+        pass
+
+
+class TestBackfill(unittest.TestCase):
+    def setUp(self):
+        self.t = datetime(2020, 3, 2)
+        self.employee_ids = [1, 2, 3, 4]
+        # straddles the start of the range
+        self.db = DB(employees=[{'id': str(i)} for i in self.employee_ids], shifts=[{'employee': '2',
+                'start': self.t - timedelta(days=2, hours=-12), 'end': self.t + timedelta(hours=4)}])
+        self.merged = []
+        self.fail_at = None
+
+    async def reconcile(self, mongo_db, shifts_col, chunk):
+        if len(self.merged) == self.fail_at:
+            raise ConnectionError('mongo went away')
+        self.merged.append([(employee_id, c['start']) for employee_id, components in chunk for c in components])
+        return sum(len(components) for _, components in chunk)
+
+    def rebuild(self):
+        with mock.patch('backfill.get_mongo_db', mock.AsyncMock(return_value=Client(self.db))), \
+                mock.patch('backfill.get_async_rpc_connection', return_value=FakeProxy()), \
+                mock.patch('daemon.reconcile', self.reconcile):
+            return asyncio.run(backfill.rebuild({'MONGO': {}, 'AMG': {}}, self.employee_ids, self.t,
+                    self.t + timedelta(days=40), chunk_size=2))
+
+    def test_rebuild(self):
+        count, from_date = self.rebuild()
+        # widened to the straddling shift
+        self.assertEqual(from_date, self.t - timedelta(days=2, hours=-12))
+        # cleared, reconcile (patched out here) writes them again
+        self.assertEqual(self.db.shifts.docs, [])
+        written = [item for chunk in self.merged for item in chunk]
+        self.assertEqual(count, len(written))
+        self.assertEqual(len(written), len(set(written)))
+        self.assertEqual({employee_id for employee_id, _ in written}, {'1', '2', '3', '4'})
+        self.assertTrue(all(from_date <= start < self.t + timedelta(days=40) for _, start in written))
+        self.assertEqual(self.db.sync_checkpoints.docs, [])
+
+    def test_resume(self):
+        # interrupted halfway through the second window
+        self.fail_at = 3
+        with self.assertRaises(ConnectionError):
+            self.rebuild()
+        (checkpoint,) = self.db.sync_checkpoints.docs
+        self.assertEqual(checkpoint['done'], ['1', '2'])
+        # written before the interruption
+        kept = {'employee': '1', 'start': self.t + timedelta(days=1), 'end': self.t + timedelta(days=1, hours=8)}
+        self.db.shifts.docs.append(kept)
+
+        self.fail_at = None
+        count, _ = self.rebuild()
+        # each employee once per window, the range is not cleared again
+        written = [item for chunk in self.merged for item in chunk]
+        self.assertEqual(len(written), len(set(written)))
+        self.assertEqual(count + 6, len(written))
+        self.assertEqual({employee_id for employee_id, _ in written}, {'1', '2', '3', '4'})
+        self.assertEqual(self.db.shifts.docs, [kept])
+        self.assertEqual(self.db.sync_checkpoints.docs, [])
+
+    def test_workers(self):
+        partitions = []
+
+        def run_worker(config, employee_ids, from_date, to_date, *args):
+            partitions.append(employee_ids)
+            # widened to a shift straddling the start
+            return len(employee_ids), from_date - timedelta(days=employee_ids[0])
+        db = DB(employees=[{'id': str(i)} for i in range(1, 8)])
+        recalculate = mock.AsyncMock()
+        with mock.patch('backfill.get_mongo_db', mock.AsyncMock(return_value=Client(db))), \
+                mock.patch('backfill.ProcessPoolExecutor', ThreadPoolExecutor), \
+                mock.patch('backfill.run_worker', run_worker), \
+                mock.patch('backfill.recalculate', recalculate):
+            asyncio.run(backfill.main({'MONGO': {}, 'AMG': {}}, self.t, self.t + timedelta(days=7), workers=3))
+        self.assertEqual(sorted(partitions), [[1, 4, 7], [2, 5], [3, 6]])
+        (_, from_date, _), kwargs = recalculate.call_args
+        self.assertEqual(from_date, self.t - timedelta(days=3))
+        self.assertFalse(kwargs['converge'])
+
+
+if __name__ == '__main__':
+    unittest.main()
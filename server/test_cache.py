@@ -0,0 +1,120 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from cache import ResponseCache, quantize
+
+
+class TestCache(unittest.TestCase):
+    def test_quantize(self):
+        bucket = timedelta(minutes=5)
+        date = datetime(2020, 3, 2, 12, 3, 17)
+        self.assertEqual(quantize(date, bucket), datetime(2020, 3, 2, 12))
+        self.assertEqual(quantize(date, bucket, up=True), datetime(2020, 3, 2, 12, 5))
+        self.assertEqual(quantize(datetime(2020, 3, 2, 12), bucket, up=True), datetime(2020, 3, 2, 12))
+        aware = date.replace(tzinfo=timezone.utc)
+        self.assertEqual(quantize(aware, bucket), datetime(2020, 3, 2, 12, tzinfo=timezone.utc))
+        self.assertIsNone(quantize(None, bucket))
+
+    def test_lru(self):
+        cache = ResponseCache(max_entries=2, max_bytes=10, ttl=0)
+        cache.put('a', {'json': b'aaa'})
+        cache.put('b', {'json': b'bbb'})
+        cache.get('a')
+        cache.put('c', {'json': b'ccc'})
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        # over max_bytes, oldest first
+        cache.put('d', {'json': b'dddd', 'bson': b'dd'})
+        self.assertEqual(list(cache.entries), ['c', 'd'])
+        self.assertEqual(cache.size, 9)
+        # too large on its own
+        cache.put('e', {'json': b'e' * 11})
+        self.assertIsNone(cache.get('e'))
+
+    def test_add_variant(self):
+        cache = ResponseCache(max_entries=4, max_bytes=10, ttl=0)
+        cache.put('a', {'json': b'aaaa'})
+        cache.put('b', {'json': b'bbbb'})
+        cache.add('b', 'json.gzip', b'bb')
+        self.assertEqual(cache.get('b'), {'json': b'bbbb', 'json.gzip': b'bb'})
+        self.assertEqual(cache.size, 10)
+        # goes with its entry
+        cache.add('b', 'json.br', b'b')
+        self.assertEqual(list(cache.entries), ['b'])
+        self.assertEqual(cache.size, 7)
+        cache.add('c', 'json.gzip', b'c')
+        self.assertIsNone(cache.get('c'))
+
+    def test_ttl(self):
+        cache = ResponseCache(ttl=60)
+        cache.put('a', {'json': b'a'})
+        cache.entries['a'] = (cache.entries['a'][0] - 61, cache.entries['a'][1])
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 0)
+
+    def test_fetch(self):
+        cache = ResponseCache()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0)
+            return {'json': b'{}'}
+
+        async def run():
+            # concurrent misses share one computation
+            results = await asyncio.gather(*(cache.fetch('a', compute) for _ in range(3)))
+            await cache.fetch('a', compute)
+            return results
+        self.assertEqual(asyncio.run(run()), [{'json': b'{}'}] * 3)
+        self.assertEqual((len(calls), cache.misses, cache.hits), (1, 1, 3))
+
+    def test_fetch_caller_cancelled(self):
+        cache = ResponseCache()
+        started = asyncio.Event()
+
+        async def compute():
+            started.set()
+            await asyncio.sleep(0.01)
+            return {'json': b'{}'}
+
+        async def run():
+            first = asyncio.ensure_future(cache.fetch('a', compute))
+            await started.wait()
+            second = asyncio.ensure_future(cache.fetch('a', compute))
+            await asyncio.sleep(0)
+            # the client that started the computation disconnects
+            first.cancel()
+            result = await second
+            with self.assertRaises(asyncio.CancelledError):
+                await first
+            return result
+        self.assertEqual(asyncio.run(run()), {'json': b'{}'})
+        self.assertEqual(cache.get('a'), {'json': b'{}'})
+
+    def test_fetch_error(self):
+        cache = ResponseCache()
+
+        async def compute():
+            await asyncio.sleep(0)
+            raise ValueError('boom')
+
+        async def run():
+            return await asyncio.gather(*(cache.fetch('a', compute) for _ in range(2)), return_exceptions=True)
+        self.assertTrue(all(isinstance(e, ValueError) for e in asyncio.run(run())))
+        self.assertEqual(cache.pending, {})
+
+    def test_clear_during_fetch(self):
+        cache = ResponseCache()
+
+        async def compute():
+            # data changed while reading it
+            cache.clear()
+            return {'json': b'{}'}
+
+        self.assertEqual(asyncio.run(cache.fetch('a', compute)), {'json': b'{}'})
+        self.assertIsNone(cache.get('a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
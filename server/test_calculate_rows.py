@@ -0,0 +1,158 @@
+import copy
+import asyncio
+import unittest
+from bson import ObjectId
+from pymongo import ReplaceOne
+from datetime import datetime, timedelta
+
+from calculate_rows import Layout, durations, layout_rows, recalculate
+from fakes import DB
+
+
+class TestLayout(unittest.TestCase):
+    def setUp(self):
+        self.t = datetime(2020, 3, 2, 12)
+
+    def shift(self, start, hours):
+        return self.t + timedelta(hours=start), self.t + timedelta(hours=start + hours), timedelta(hours=hours)
+
+    def test_first_fit(self):
+        layout = Layout()
+        rows = [layout.assign(*self.shift(*s)) for s in [(0, 8), (1, 2), (2, 8), (3.5, 1), (9, 1)]]
+        # the lowest free row, row 1 frees before row 0
+        self.assertEqual(rows, [0, 1, 2, 1, 0])
+
+    def test_touching_shifts_do_not_share(self):
+        layout = Layout()
+        self.assertEqual([layout.assign(*self.shift(*s)) for s in [(0, 4), (4, 4)]], [0, 1])
+
+    def test_long_shift(self):
+        layout = Layout(long_shift=timedelta(hours=16), long_shift_row=18)
+        self.assertEqual(layout.assign(*self.shift(0, 17)), 18)
+        # did not take a row
+        self.assertEqual(layout.assign(*self.shift(1, 1)), 0)
+
+    def test_overflow(self):
+        layout = Layout(max_rows=3)
+        self.assertEqual([layout.assign(*self.shift(i * 0.1, 8)) for i in range(5)], [0, 1, 2, 2, 2])
+        self.assertEqual(layout.assign(*self.shift(9, 1)), 0)
+
+    def test_occupied(self):
+        layout = Layout()
+        layout.occupy(self.t + timedelta(hours=3))
+        layout.occupy(self.t + timedelta(hours=1))
+        self.assertEqual([layout.assign(*self.shift(*s)) for s in [(0.5, 1), (2, 1)]], [2, 1])
+
+    def test_snapshot_restore(self):
+        shifts = [self.shift(*s) for s in [(0, 8), (1, 2), (2, 8), (3.5, 1), (9, 1), (10, 3), (11, 1)]]
+        layout = Layout()
+        rows = [layout.assign(*s) for s in shifts]
+
+        layout = Layout()
+        for s in shifts[:4]:
+            layout.assign(*s)
+        frontier = {'position': self.t + timedelta(hours=5), **layout.snapshot()}
+        restored = Layout()
+        restored.restore(frontier, {}, self.t)
+        self.assertEqual([restored.assign(*s) for s in shifts[4:]], rows[4:])
+
+    def test_restore_open(self):
+        layout = Layout()
+        layout.assign(self.t, self.t + timedelta(hours=1), timedelta(hours=1), open_id='s0')
+        layout.assign(*self.shift(0.5, 1), open_id='s1')
+        frontier = {'position': self.t + timedelta(hours=2), **layout.snapshot()}
+
+        # s0 still open (busy until now), s1 removed
+        restored = Layout()
+        restored.restore(frontier, {'s0': None}, self.t + timedelta(hours=6))
+        self.assertEqual(restored.assign(*self.shift(3, 1)), 1)
+        # s0 closed since
+        restored.restore(frontier, {'s0': self.t + timedelta(hours=2), 's1': self.t + timedelta(hours=4)}, self.t)
+        self.assertEqual(restored.assign(*self.shift(3, 1)), 0)
+
+    def test_matches(self):
+        layout = Layout()
+        layout.assign(*self.shift(0, 8))
+        layout.assign(self.t, self.t + timedelta(hours=1), timedelta(hours=1), open_id='s0')
+        frontier = layout.snapshot()
+        self.assertTrue(layout.matches(frontier))
+
+        # the open shift was busy until an earlier now
+        moved = Layout()
+        moved.assign(*self.shift(0, 8))
+        moved.assign(self.t, self.t + timedelta(hours=3), timedelta(hours=3), open_id='s0')
+        self.assertTrue(moved.matches(frontier))
+        moved.assign(*self.shift(1, 1))
+        self.assertFalse(moved.matches(frontier))
+
+    def test_durations(self):
+        now = self.t + timedelta(hours=10)
+        parts = [{'_id': 'c0', 'start': self.t, 'end': None}, {'_id': 'c1', 'start': self.t + timedelta(hours=1), 'end': self.t + timedelta(hours=2)}]
+        shifts = [
+            # ended, with an open component inside (stored as 0)
+            {'_id': 's0', 'components': ['c0', 'c1'], 'parts': parts, 'duration': 0},
+            # written before components were embedded
+            {'_id': 's1', 'components': ['c1']},
+        ]
+        self.assertEqual(asyncio.run(durations(DB(components=parts), shifts, now)),
+                {'s0': timedelta(hours=11), 's1': timedelta(hours=1)})
+
+    def test_layout_rows(self):
+        def shift(id, start, hours):
+            return {'id': id, 'start': self.t + timedelta(hours=start),
+                    'end': self.t + timedelta(hours=start + hours) if hours else None,
+                    'duration': hours * 3600 * 1000}
+        shifts = [shift('c', 3, 1), shift('a', 0, 8), shift('b', 1, 0)]
+        self.assertEqual(layout_rows(shifts, now=self.t + timedelta(hours=2), key='id'), {'a': 0, 'b': 1, 'c': 1})
+
+
+class TestRecalculate(unittest.TestCase):
+    def setUp(self):
+        self.t = datetime(2020, 3, 2)
+        # the same four shifts every day, b overlaps d by an hour so d takes a fourth row
+        self.shifts = [self.shift(day, start, end) for day in range(10)
+                for start, end in [(8, 16), (9, 14), (10, 17), (13, 15)]]
+        self.db = DB(shifts=self.shifts)
+        asyncio.run(recalculate(self.db, converge=False))
+
+    def shift(self, day, start, end):
+        start, end = self.t + timedelta(days=day, hours=start), self.t + timedelta(days=day, hours=end)
+        return {'_id': ObjectId(), 'start': start, 'end': end, 'components': [],
+                'parts': [{'start': start, 'end': end}]}
+
+    def frontiers(self, db):
+        return sorted(({k: v for k, v in f.items() if k != '_id'} for f in db.layout_frontiers.docs),
+                key=lambda f: f['position'])
+
+    def test_full(self):
+        self.assertEqual([s['row'] for s in self.shifts[:8]], [0, 1, 2, 3] * 2)
+        self.assertEqual([f['position'] for f in self.frontiers(self.db)], [self.t + timedelta(days=i) for i in range(10)])
+
+    def test_recalculate(self):
+        # a sync ended b on the fourth day early, d fits in its row
+        edited = self.shifts[13]
+        edited['end'] = edited['parts'][0]['end'] = self.t + timedelta(days=3, hours=12)
+        edited['relayout'] = True
+        fresh = DB(shifts=copy.deepcopy(self.db.shifts.docs))
+        asyncio.run(recalculate(fresh, converge=False))
+
+        saved = []
+        bulk_write = self.db.layout_frontiers.bulk_write
+
+        async def record(ops, ordered=True):
+            saved.extend(op._filter['position'] for op in ops if isinstance(op, ReplaceOne))
+            await bulk_write(ops, ordered)
+        self.db.layout_frontiers.bulk_write = record
+        # resumed from the frontier stored at the start of the day
+        count = asyncio.run(recalculate(self.db, edited['start']))
+        self.assertEqual([s['row'] for s in self.shifts], [s['row'] for s in fresh.shifts.docs])
+        self.assertEqual(self.shifts[15]['row'], 1)
+        self.assertNotIn('relayout', edited)
+        self.assertEqual(self.frontiers(self.db), self.frontiers(fresh))
+        # d moved and the mark was cleared, the frontier of the next day holds the new end of b and the day
+        # after that is back to the stored one, nothing past it is laid out again
+        self.assertEqual(count, 2)
+        self.assertEqual(saved, [self.t + timedelta(days=4)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import bson
+import unittest
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+import columnar
+
+
+def component(start, end=None, now=None):
+    return {'_id': ObjectId(), 'start': start, 'end': end,
+            'duration': ((end or now) - start) // timedelta(milliseconds=1)}
+
+
+class TestColumnar(unittest.TestCase):
+    def setUp(self):
+        self.t = datetime(2020, 3, 2, 12, 0, 0, 123000)
+
+    def shift(self, employee, components, row=0):
+        end = components[-1]['end']
+        return {'id': str(ObjectId()), 'employee': employee, 'start': components[0]['start'], 'end': end,
+                'duration': sum(c['duration'] for c in components), 'row': row,
+                'state': 'complete' if end else 'incomplete', 'expectedDuration': 8 * 3600 * 1000,
+                'components': [{**c, 'id': str(c['_id'])} for c in components]}
+
+    def test_round_trip(self):
+        t = self.t
+        shifts = [
+            self.shift('1', [component(t, t + timedelta(hours=4)), component(t + timedelta(hours=5), t + timedelta(hours=8))]),
+            self.shift('2', [component(t, now=t + timedelta(hours=2))], row=None),
+            self.shift('9', [component(t, t + timedelta(hours=1))], row=18),
+        ]
+        employees = {'1': {'id': '1', 'Name': 'a'}, '2': {'id': '2', 'Name': 'b'}}
+        buf = columnar.encode_shifts(employees, ['1', '2'], shifts, 8 * 3600 * 1000)
+        result = columnar.decode_shifts(buf)
+
+        self.assertEqual(result['employees'], employees)
+        # employees not in the map decode to None
+        expected = [{**s, 'employee': s['employee'] if s['employee'] in employees else None} for s in shifts]
+        self.assertEqual(result['shifts'], expected)
+
+    def test_alignment(self):
+        buf = columnar.encode_shifts({}, [], [self.shift('1', [component(self.t, self.t + timedelta(hours=1))])], 0)
+        meta_length = int.from_bytes(buf[4:8], 'little')
+        base = columnar.align(8 + meta_length)
+        result = columnar.decode_shifts(buf)
+        self.assertEqual(len(result['shifts']), 1)
+        for name, type, offset, size in bson.decode(buf[8:8 + meta_length])['columns']:
+            self.assertEqual((base + offset) % 8, 0, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
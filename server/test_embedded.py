@@ -0,0 +1,85 @@
+import asyncio
+import unittest
+from bson import ObjectId
+from datetime import datetime, timedelta
+
+import api
+from fakes import DB, Client
+from migrate import embed_components
+from shifts import embed
+
+
+def ms(delta):
+    return delta // timedelta(milliseconds=1)
+
+
+class TestEmbedded(unittest.TestCase):
+    def setUp(self):
+        self.t = datetime(2020, 3, 2, 12)
+        self.now = self.t + timedelta(hours=10)
+        self.components = [
+            {'_id': ObjectId(), 'employee': '1', 'start': self.t, 'end': self.t + timedelta(hours=4)},
+            {'_id': ObjectId(), 'employee': '1', 'start': self.t + timedelta(hours=5), 'end': None},
+        ]
+        self.shift = {'_id': ObjectId(), 'employee': '1', 'components': [c['_id'] for c in self.components],
+                'start': self.t, 'end': None, 'duration': 0, 'state': 'incomplete', 'row': 2}
+
+    def parts(self):
+        return [{**p, 'duration': None if p['duration'] is None else ms(p['duration'])} for p in embed(self.components)]
+
+    def test_from_parts(self):
+        shift = api.from_parts({**self.shift, 'parts': self.parts()}, self.now)
+        self.assertEqual(shift['id'], str(self.shift['_id']))
+        self.assertNotIn('_id', shift)
+        self.assertEqual([c['id'] for c in shift['components']], [str(c['_id']) for c in self.components])
+        # the open component runs until now
+        self.assertEqual([c['duration'] for c in shift['components']], [ms(timedelta(hours=4)), ms(timedelta(hours=5))])
+        self.assertEqual(shift['duration'], ms(timedelta(hours=9)))
+        self.assertEqual((shift['row'], shift['expectedDuration']), (2, api.EXPECTED_DURATION))
+
+    def test_not_migrated(self):
+        app = {'db': Client(DB(shifts=[dict(self.shift)], components=self.components)), 'embedded': True}
+
+        async def run():
+            return [shift async for shift in api.iter_shifts(app, {})]
+        (shift,) = asyncio.run(run())
+        self.assertEqual([c['id'] for c in shift['components']], [str(c['_id']) for c in self.components])
+        self.assertEqual(shift['components'][0]['duration'], ms(timedelta(hours=4)))
+        self.assertGreater(shift['duration'], ms(timedelta(hours=4)))
+
+    def test_embed_components(self):
+        migrated = {**self.shift, '_id': ObjectId(), 'parts': []}
+        db = DB(shifts=[dict(self.shift), migrated], components=list(reversed(self.components)))
+        self.assertEqual(asyncio.run(embed_components(db, batch_size=1)), 1)
+        # in component order
+        self.assertEqual(db.shifts.docs[0]['parts'], embed(self.components))
+        self.assertEqual(migrated['parts'], [])
+        self.assertEqual(asyncio.run(embed_components(db)), 0)
+        self.assertEqual(asyncio.run(embed_components(db, everything=True)), 2)
+
+    def test_pipeline_parity(self):
+        try:
+            import pymongo
+            client = pymongo.MongoClient('localhost', 27017, serverSelectionTimeoutMS=500)
+            client.admin.command('ping')
+        except Exception:
+            self.skipTest('no mongod on localhost')
+        db = client.test_embedded
+        try:
+            db.components.insert_many(self.components)
+            db.shifts.insert_one({**self.shift, 'parts': self.parts()})
+            (joined,) = db.shifts.aggregate([*api.SHIFTS_PIPELINE])
+            (doc,) = db.shifts.find({}, projection={'days': False, 'relayout': False})
+            embedded = api.from_parts(doc, datetime.utcnow())
+            for key in ('id', 'employee', 'start', 'end', 'row', 'state', 'expectedDuration'):
+                self.assertEqual(embedded[key], joined[key])
+            for a, b in zip(embedded['components'], joined['components']):
+                self.assertEqual((a['id'], a['start'], a['end']), (b['id'], b['start'], b['end']))
+            # open components run until now, read a moment apart
+            self.assertAlmostEqual(embedded['duration'], joined['duration'], delta=5000)
+        finally:
+            client.drop_database('test_embedded')
+
+
+if __name__ == '__main__':
+    unittest.main()
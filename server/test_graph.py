@@ -0,0 +1,31 @@
+import unittest
+from datetime import datetime, timedelta
+
+import interval
+from fakes import DB
+from graph import iter_weekly_graph_data
+
+
+class Components:
+    def aggregate(self, pipeline):
+        self.pipeline = pipeline
+        return pipeline
+
+
+class TestWeeklyGraph(unittest.TestCase):
+    def test_range(self):
+        min_date = datetime(2020, 3, 2)
+        max_date = min_date + timedelta(days=7)
+        pipeline = iter_weekly_graph_data(DB(components=Components()), (min_date, max_date))
+        self.assertEqual(pipeline[0], {'$match': interval.overlaps(min_date, max_date)})
+        self.assertEqual(pipeline[-1], {'$match': {'date': {'$gt': min_date, '$lt': max_date}}})
+
+    def test_no_range(self):
+        pipeline = iter_weekly_graph_data(DB(components=Components()))
+        self.assertNotIn('$match', pipeline[0])
+        # quarter hour buckets
+        self.assertIn({'$multiply': ['$$this', 15 * 60 * 1000]}, pipeline[2]['$addFields']['diff']['$map']['in']['$add'])
+
+
+if __name__ == '__main__':
+    unittest.main()
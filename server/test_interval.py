@@ -0,0 +1,80 @@
+import random
+import unittest
+from datetime import datetime, timedelta, timezone
+
+import interval
+
+
+def plan_stages(plan):
+    '''
+    every stage in an explain plan
+    '''
+    yield plan
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from plan_stages(plan[key])
+    for stage in plan.get('inputStages', []):
+        yield from plan_stages(stage)
+
+
+class TestInterval(unittest.TestCase):
+    def setUp(self):
+        self.t = datetime(2020, 3, 2, 20)
+
+    def test_days(self):
+        day = datetime(2020, 3, 2)
+        self.assertEqual(interval.days(self.t, self.t + timedelta(hours=2)), [day])
+        self.assertEqual(interval.days(self.t, self.t + timedelta(hours=8)), [day, day + timedelta(days=1)])
+        # open, start day only
+        self.assertEqual(interval.days(self.t, None), [day])
+        # aware dates in utc
+        aware = datetime(2020, 3, 2, 22, tzinfo=timezone(timedelta(hours=-5)))
+        self.assertEqual(interval.days(aware, aware), [datetime(2020, 3, 3)])
+
+    def test_overlaps_matches_every_overlapping_interval(self):
+        random.seed(1)
+        for _ in range(2000):
+            start = self.t + timedelta(minutes=random.randrange(-5000, 5000))
+            end = start + timedelta(minutes=random.randrange(1, 1200))
+            min_date = self.t + timedelta(minutes=random.randrange(-5000, 5000))
+            max_date = min_date + timedelta(minutes=random.randrange(1, 5000))
+            branch = interval.overlaps(min_date, max_date)['$or'][0]
+            matched = (bool(set(interval.days(start, end)) & set(branch['days']['$in']))
+                    and start < branch['start']['$lt'] and end > branch['end']['$gt'])
+            self.assertEqual(matched, start < max_date and end > min_date)
+
+    def test_employee_in_every_branch(self):
+        query = interval.overlaps(self.t, self.t + timedelta(days=1), '5')
+        self.assertTrue(all(branch['employee'] == '5' for branch in query['$or']))
+        self.assertEqual(interval.overlaps(None, self.t, '5'), {'start': {'$lt': self.t}, 'employee': '5'})
+
+    def test_explain(self):
+        try:
+            import pymongo
+            client = pymongo.MongoClient('localhost', 27017, serverSelectionTimeoutMS=500)
+            client.admin.command('ping')
+        except Exception:
+            self.skipTest('no mongod on localhost')
+        db = client.test_interval
+        try:
+            db.shifts.create_index(interval.INDEX)
+            db.shifts.create_index('end')
+            docs = []
+            for i in range(2000):
+                start = self.t + timedelta(hours=6 * i)
+                end = start + timedelta(hours=8) if i % 50 else None
+                docs.append({'employee': str(i % 20), 'start': start, 'end': end, 'days': interval.days(start, end)})
+            db.shifts.insert_many(docs)
+
+            for employee_id in (None, '3'):
+                query = interval.overlaps(self.t + timedelta(days=30), self.t + timedelta(days=37), employee_id)
+                plan = db.shifts.find(query).explain()['queryPlanner']['winningPlan']
+                stages = list(plan_stages(plan))
+                self.assertNotIn('COLLSCAN', [s['stage'] for s in stages])
+                self.assertIn('days_1_employee_1_start_1', [s.get('indexName') for s in stages])
+        finally:
+            client.drop_database('test_interval')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import pytz
+import random
+import unittest
+from datetime import datetime, timedelta
+
+from localtime import EASTERN
+
+tz = pytz.timezone('US/Eastern')
+
+
+def localize(dt, is_dst=False):
+    return tz.localize(dt, is_dst=is_dst).astimezone(pytz.UTC).replace(tzinfo=None)
+
+
+class TestTransitionTable(unittest.TestCase):
+    def test_matches_pytz(self):
+        rng = random.Random(0)
+        dates = [datetime(1970, 1, 1) + timedelta(minutes=rng.randint(0, 70 * 365 * 24 * 60)) for _ in range(5000)]
+        # minutes around every transition since 1970
+        dates += [t - timedelta(hours=5) + timedelta(minutes=m) for t in EASTERN.utc if t.year >= 1970
+                for m in range(-180, 180, 10)]
+        for dt in dates:
+            for is_dst in (False, True):
+                self.assertEqual(EASTERN.to_utc(dt, is_dst), localize(dt, is_dst), (dt, is_dst))
+
+    def test_ambiguous(self):
+        dt = datetime(2020, 11, 1, 1, 30)
+        self.assertEqual(EASTERN.to_utc(dt), datetime(2020, 11, 1, 6, 30))
+        self.assertEqual(EASTERN.to_utc(dt, is_dst=True), datetime(2020, 11, 1, 5, 30))
+        with self.assertRaises(pytz.AmbiguousTimeError):
+            EASTERN.to_utc(dt, is_dst=None)
+
+    def test_missing(self):
+        dt = datetime(2020, 3, 8, 2, 30)
+        self.assertEqual(EASTERN.to_utc(dt), datetime(2020, 3, 8, 7, 30))
+        self.assertEqual(EASTERN.to_utc(dt, is_dst=True), datetime(2020, 3, 8, 6, 30))
+        with self.assertRaises(pytz.NonExistentTimeError):
+            EASTERN.to_utc(dt, is_dst=None)
+
+    def test_to_local(self):
+        for dt in [datetime(2020, 1, 1, 12), datetime(2020, 7, 1, 12), datetime(2020, 11, 1, 5, 30), datetime(2020, 11, 1, 6, 30)]:
+            self.assertEqual(EASTERN.to_local(dt), pytz.UTC.localize(dt).astimezone(tz).replace(tzinfo=None))
+
+    def test_many(self):
+        dates = [datetime(2020, 1, 1, 8), None, datetime(2020, 7, 1, 8)]
+        self.assertEqual(EASTERN.to_utc_many(dates), [datetime(2020, 1, 1, 13), None, datetime(2020, 7, 1, 12)])
+
+
+if __name__ == '__main__':
+    unittest.main()
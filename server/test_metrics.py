@@ -0,0 +1,67 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import daemon
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.REGISTRY[:]
+
+    def tearDown(self):
+        metrics.REGISTRY[:] = self.registry
+
+    def test_counter(self):
+        counter = metrics.Counter('test_errors', 'errors')
+        counter.inc(stage='rpc')
+        counter.inc(2, stage='rpc')
+        counter.inc(stage='say "hi"')
+        self.assertEqual(counter.value(stage='rpc'), 3)
+        self.assertEqual(counter.render().splitlines(), [
+            '# HELP test_errors errors',
+            '# TYPE test_errors counter',
+            'test_errors_total{stage="rpc"} 3.0',
+            'test_errors_total{stage="say \\"hi\\""} 1.0',
+        ])
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('test_seconds', 'latency', buckets=(1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value, op='read')
+        self.assertEqual(histogram.render().splitlines()[2:], [
+            'test_seconds_bucket{op="read",le="1.0"} 2.0',
+            'test_seconds_bucket{op="read",le="5.0"} 3.0',
+            'test_seconds_bucket{op="read",le="+Inf"} 4.0',
+            'test_seconds_sum{op="read"} 14.5',
+            'test_seconds_count{op="read"} 4.0',
+        ])
+
+    def test_render(self):
+        gauge = metrics.Gauge('test_lag_seconds', 'lag')
+        gauge.set(12)
+        text = metrics.render()
+        self.assertTrue(text.endswith('\n'))
+        self.assertIn('# TYPE timeclock_rpc_seconds histogram', text)
+        self.assertIn('test_lag_seconds 12.0', text)
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            metrics.Metric('test_metric', 'no samples')
+
+    def test_unbatched_shifts(self):
+        async def windows():
+            yield None, None, [('1', [{}, {}]), ('2', [{}])]
+
+        async def update_components(mongo_db, shifts_col, chunk):
+            return sum(len(components) for _, components in chunk)
+        components, shifts = metrics.COMPONENTS.value(), metrics.SHIFTS.value()
+        with mock.patch('daemon.update_components', update_components):
+            self.assertEqual(asyncio.run(daemon.merge_windows(None, None, windows(), batched=False)), 3)
+        self.assertEqual(metrics.COMPONENTS.value() - components, 3)
+        self.assertEqual(metrics.SHIFTS.value() - shifts, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import asyncio
+import unittest
+from unittest import mock
+from contextlib import asynccontextmanager
+from pymysql.err import OperationalError, ProgrammingError
+
+from util import MySQLPool
+
+
+class FakeCursor:
+    def __init__(self, conn, cursor_class):
+        self.conn = conn
+        self.cursor_class = cursor_class
+        self.rows = []
+
+    async def execute(self, query, args=None):
+        self.conn.pool.executed.append((query, args, self.cursor_class))
+        if self.conn.pool.error is not None:
+            raise self.conn.pool.error
+        if self.conn.pool.drops:
+            self.conn.pool.drops -= 1
+            raise OperationalError(2013, 'Lost connection to MySQL server during query')
+        self.rows = list(self.conn.pool.rows)
+
+    async def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    async def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    async def fetchmany(self, size):
+        if self.conn.pool.drop_after is not None and self.conn.pool.fetched >= self.conn.pool.drop_after:
+            raise OperationalError(2013, 'Lost connection to MySQL server during query')
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        self.conn.pool.fetched += len(rows)
+        return rows
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.closed = False
+
+    @asynccontextmanager
+    async def cursor(self, cursor_class=None):
+        yield FakeCursor(self, cursor_class)
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool:
+    '''
+    aiomysql pool whose connections drop the first `drops` queries
+    '''
+    def __init__(self, rows, drops=0, drop_after=None):
+        self.rows = rows
+        self.drops = drops
+        self.drop_after = drop_after
+        self.error = None
+        self.fetched = 0
+        self.executed = []
+        self.connections = []
+
+    @asynccontextmanager
+    async def acquire(self):
+        conn = FakeConnection(self)
+        self.connections.append(conn)
+        yield conn
+
+
+async def no_sleep(delay):
+    pass
+
+
+class TestMySQLPool(unittest.TestCase):
+    def setUp(self):
+        self.rows = [(i, 'a') for i in range(10)]
+        patcher = mock.patch('asyncio.sleep', no_sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retry(self):
+        pool = FakePool(self.rows, drops=2)
+        self.assertEqual(asyncio.run(MySQLPool(pool).fetchall('select', (1,))), self.rows)
+        self.assertEqual(len(pool.executed), 3)
+        # dropped connections are not handed back to the pool
+        self.assertEqual([conn.closed for conn in pool.connections], [True, True, False])
+        self.assertEqual(asyncio.run(MySQLPool(FakePool(self.rows, drops=1)).fetchone('select')), self.rows[0])
+
+    def test_retries_exhausted(self):
+        pool = FakePool(self.rows, drops=3)
+        with self.assertRaises(OperationalError):
+            asyncio.run(MySQLPool(pool, retries=2).fetchall('select'))
+        self.assertEqual(len(pool.executed), 3)
+
+    def test_query_error_not_retried(self):
+        pool = FakePool(self.rows)
+        pool.error = ProgrammingError(1064, 'You have an error in your SQL syntax')
+        with self.assertRaises(ProgrammingError):
+            asyncio.run(MySQLPool(pool).fetchall('selct'))
+        self.assertEqual(len(pool.executed), 1)
+        self.assertFalse(pool.connections[0].closed)
+
+    def stream(self, pool, **kwargs):
+        async def run():
+            return [rows async for rows in MySQLPool(pool, batch_size=4).stream('select', **kwargs)]
+        return asyncio.run(run())
+
+    def test_stream(self):
+        import aiomysql
+        pool = FakePool(self.rows, drops=1)
+        batches = self.stream(pool)
+        self.assertEqual(batches, [self.rows[:4], self.rows[4:8], self.rows[8:]])
+        # unbuffered unless asked otherwise, retried before the first batch
+        self.assertEqual([cursor_class for _, _, cursor_class in pool.executed], [aiomysql.SSCursor] * 2)
+        self.assertEqual(self.stream(FakePool(self.rows), batch_size=20), [self.rows])
+        pool = FakePool(self.rows)
+        self.stream(pool, cursor_class=aiomysql.SSDictCursor)
+        self.assertEqual(pool.executed[0][2], aiomysql.SSDictCursor)
+
+    def test_stream_dropped_midway(self):
+        pool = FakePool(self.rows, drop_after=4)
+        batches = []
+
+        async def run():
+            async for rows in MySQLPool(pool, batch_size=4).stream('select'):
+                batches.append(rows)
+        # rows already yielded would be read twice
+        with self.assertRaises(OperationalError):
+            asyncio.run(run())
+        self.assertEqual(batches, [self.rows[:4]])
+        self.assertEqual(len(pool.executed), 1)
+        self.assertTrue(pool.connections[0].closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
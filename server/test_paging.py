@@ -0,0 +1,81 @@
+import random
+import asyncio
+import unittest
+from bson import ObjectId
+from datetime import datetime, timedelta
+
+import api
+import paging
+from fakes import DB, Client, Collection, matches, sort_docs
+
+
+class Shifts(Collection):
+    '''
+    shifts collection, aggregate joins as SHIFTS_PIPELINE does
+    '''
+    async def aggregate(self, pipeline):
+        for doc in sort_docs([d for d in self.docs if matches(d, pipeline[0]['$match'])], paging.SORT):
+            # $unwind drops shifts without components
+            if doc['components']:
+                yield {'id': str(doc['_id']), 'start': doc['start'], 'duration': 0}
+
+
+def app(docs, embedded=False):
+    return {'db': Client(DB(shifts=Shifts(docs))), 'embedded': embedded}
+
+
+class TestPaging(unittest.TestCase):
+    def setUp(self):
+        self.t = datetime(2020, 3, 2, 20)
+        self.filters = (self.t, self.t + timedelta(days=7), '5')
+
+    def test_token_round_trip(self):
+        _id = ObjectId()
+        token = paging.encode_token(self.t, _id, self.filters)
+        self.assertNotIn('=', token)
+        self.assertEqual(paging.decode_token(token, self.filters), (self.t, _id))
+
+    def test_token_for_other_query(self):
+        token = paging.encode_token(self.t, ObjectId(), self.filters)
+        with self.assertRaises(paging.InvalidToken):
+            paging.decode_token(token, (self.t, self.t + timedelta(days=7), None))
+
+    def test_malformed_token(self):
+        for token in ('', 'abc', '!!!!', paging.encode_token(self.t, ObjectId(), self.filters)[:-4]):
+            with self.assertRaises(paging.InvalidToken):
+                paging.decode_token(token, self.filters)
+
+    def test_pages_cover_everything_once(self):
+        random.seed(1)
+        # shared starts so pages end between shifts that start together
+        docs = sorted(({'_id': ObjectId(), 'start': self.t + timedelta(hours=random.randrange(20))} for _ in range(100)),
+                key=lambda d: (d['start'], d['_id']))
+        seen = []
+        position = None
+        while True:
+            page = [d for d in docs if position is None or matches(d, paging.after({}, position))][:7]
+            if not page:
+                break
+            seen.extend(page)
+            position = paging.decode_token(paging.encode_token(page[-1]['start'], page[-1]['_id'], None), None)
+        self.assertEqual(seen, docs)
+
+    def test_page_cut_before_join(self):
+        docs = [{'_id': ObjectId(), 'start': self.t + timedelta(hours=i), 'components': [ObjectId()] if i % 3 == 0 else []}
+                for i in range(7)]
+        shifts, last = asyncio.run(api.shifts_page(app(docs), {}, 3))
+        # two of the three were dropped by the join, there are still more
+        self.assertEqual([s['id'] for s in shifts], [str(docs[0]['_id'])])
+        self.assertEqual(last, (docs[2]['start'], docs[2]['_id']))
+        shifts, last = asyncio.run(api.shifts_page(app(docs), {}, 7))
+        self.assertEqual(len(shifts), 3)
+        self.assertIsNone(last)
+
+    def test_after_keeps_query(self):
+        query = {'$or': [{'end': None}, {'end': {'$gt': self.t}}]}
+        self.assertIs(paging.after(query, None), query)
+        self.assertEqual(paging.after(query, (self.t, ObjectId()))['$and'][0], query)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+
+import mocking
+from daemon import get_punch_watermark, parse_timecard, plan_incremental
+from parity import compare
+from punches import fetch_punches, find_anchor, pair_punches
+
+
+def to_punches(timecards):
+    '''
+    tam.tr_clock rows behind mocked timecards
+    '''
+    return sorted(((p['Id'], employee_id, p['OriginalDate']) for employee_id, items in timecards.items()
+            for t in items for p in (t.get('StartPunch'), t.get('StopPunch')) if p), key=lambda r: (r[1], r[2], r[0]))
+
+
+class FakeMySQL:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def stream(self, query, args):
+        ids, a, b = args
+        yield [r for r in self.rows if r[1] in ids and a <= r[2] < b]
+
+
+class FakeClock:
+    '''
+    tam.tr_clock as (id, employee, local date) rows in insertion order
+    '''
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def fetchone(self, query, args=None):
+        return (max((r[0] for r in self.rows), default=None),)
+
+    async def fetchall(self, query, args):
+        since, = args
+        first = {}
+        for _id, employee_id, date in self.rows:
+            if _id > since:
+                first[employee_id] = min(first.get(employee_id, date), date)
+        return list(first.items())
+
+
+class TestPunches(unittest.TestCase):
+    def setUp(self):
+        self.t = datetime(2020, 3, 2, 7)
+
+    def hours(self, h):
+        return self.t + timedelta(hours=h)
+
+    def test_pair(self):
+        components = pair_punches('1', [(1, self.hours(0)), (2, self.hours(4)), (3, self.hours(4.5)),
+                (4, self.hours(8.5)), (5, self.hours(24)), (6, self.hours(48))])
+        self.assertEqual([c['punches'] for c in components], [[1, 2], [3, 4], [5], [6]])
+        self.assertEqual(components[0]['hours'], 4)
+        self.assertEqual(components[0]['date'], datetime(2020, 3, 2))
+        # naive utc
+        self.assertEqual(components[0]['start'], datetime(2020, 3, 2, 12))
+        self.assertIsNone(components[2]['end'])
+
+    def test_find_anchor(self):
+        dates = [self.hours(0), self.hours(8), self.hours(24), self.hours(32), self.hours(48)]
+        # a punch after a long enough gap
+        self.assertEqual(find_anchor(dates, self.hours(-48), self.hours(60)), self.hours(0))
+        # no break since the first punch read, earlier punches are unknown
+        self.assertIsNone(find_anchor(dates[1:], self.hours(0), self.hours(60)))
+        # nothing for a while before the window
+        self.assertEqual(find_anchor(dates, self.hours(-48), self.hours(80)), self.hours(80))
+
+    def test_parse_timecard_late_consumption(self):
+        timecards = mocking.generate(2, 0.25, 1, datetime(2020, 6, 3, 12))
+        # generators kept and read after parse_timecard moved on, as the rpc window loop does
+        employee_components = list(parse_timecard([{'EmployeeId': k, 'Timecards': v} for k, v in timecards.items()]))
+        self.assertEqual(len(employee_components), 2)
+        for employee_id, it in employee_components:
+            components = list(it)
+            self.assertTrue(components)
+            self.assertTrue(all(c['employee'] == employee_id for c in components))
+            self.assertEqual([c['punches'][0] for c in components],
+                    [t['StartPunch']['Id'] for t in timecards[int(employee_id)] if t.get('StartPunch')])
+
+    def test_incremental_late_upload(self):
+        clock = FakeClock([(1, 1, self.hours(0)), (2, 2, self.hours(1)), (3, 1, self.hours(8))])
+        watermark = asyncio.run(get_punch_watermark(clock))
+        self.assertEqual(watermark, 3)
+        self.assertEqual(asyncio.run(plan_incremental(clock, watermark)), ([], None))
+        # a clock uploads punches from before the latest one already read
+        clock.rows += [(4, 2, self.hours(-30)), (5, 3, self.hours(9))]
+        employee_ids, min_date = asyncio.run(plan_incremental(clock, watermark))
+        self.assertEqual(sorted(employee_ids), [2, 3])
+        # from the day before the earliest new punch
+        self.assertEqual(min_date, datetime(2020, 2, 29))
+
+    def test_parity(self):
+        end = datetime(2020, 6, 3, 12)
+        timecards = mocking.generate(5, 0.25, 1, end)
+        expected = [c for _, it in parse_timecard([{'EmployeeId': k, 'Timecards': v} for k, v in timecards.items()])
+                for c in it]
+
+        async def fetch():
+            actual = []
+            async for _, _, result in fetch_punches(FakeMySQL(to_punches(timecards)), list(timecards),
+                    end - timedelta(days=120), end + timedelta(days=1), interval=timedelta(days=7)):
+                actual.extend(c for _, components in result for c in components)
+            return actual
+        result = compare(expected, asyncio.run(fetch()))
+
+        self.assertEqual(result['matched'], len(expected))
+        self.assertFalse(result['different'] or result['missing'] or result['extra'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+
+import models
+from fakes import DB
+from reconcile import Window, load_window
+
+
+def component(employee, start, end=None):
+    return {'employee': employee, 'start': start, 'end': end, 'punches': [], 'date': None,
+            'isManual': False, 'hours': None}
+
+
+class TestWindow(unittest.TestCase):
+    def setUp(self):
+        self.t = datetime(2020, 3, 2, 12)
+
+    def test_nearby_components_share_shift(self):
+        window = Window([], [])
+        window.merge(component('1', self.t, self.t + timedelta(hours=4)))
+        window.merge(component('1', self.t + timedelta(hours=5), self.t + timedelta(hours=8)))
+        window.merge(component('1', self.t + timedelta(hours=13), self.t + timedelta(hours=14)))
+
+        shifts = list(window.new_shifts.values())
+        self.assertEqual(len(shifts), 2)
+        self.assertEqual(len(shifts[0]['components']), 2)
+        self.assertEqual(shifts[0]['duration'], timedelta(hours=7))
+        self.assertEqual(shifts[0]['end'], self.t + timedelta(hours=8))
+        self.assertEqual(len(window.shift_ops()), 2)
+        self.assertEqual(len(window.component_ops()), 3)
+
+    def test_existing_component_closes_shift(self):
+        c = {**component('1', self.t), '_id': 'c0'}
+        s = {'_id': 's0', 'employee': '1', 'components': ['c0'], 'start': self.t, 'end': None,
+             'duration': 0, 'state': models.ShiftState.Incomplete}
+        window = Window([c], [s])
+        window.merge(component('1', self.t, self.t + timedelta(hours=8)))
+        s = window.shifts['s0']
+
+        self.assertEqual(window.new_components, {})
+        self.assertEqual(window.dirty_components, {'c0'})
+        self.assertEqual(window.dirty_shifts, {'s0'})
+        self.assertEqual(s['end'], self.t + timedelta(hours=8))
+        self.assertEqual(s['duration'], timedelta(hours=8))
+        self.assertEqual(s['state'], models.ShiftState.Complete)
+        # embedded copies follow the component
+        (op,) = window.shift_ops()
+        self.assertEqual(op._doc['$set']['parts'],
+                [{'_id': 'c0', 'start': self.t, 'end': self.t + timedelta(hours=8), 'duration': timedelta(hours=8)}])
+
+    def test_relayout_only_moved_shifts(self):
+        c = {**component('1', self.t, self.t + timedelta(hours=8)), '_id': 'c0'}
+        s = {'_id': 's0', 'employee': '1', 'components': ['c0'], 'start': self.t, 'end': c['end'],
+             'duration': timedelta(hours=8), 'state': models.ShiftState.Complete,
+             'parts': [{'_id': 'c0', 'start': self.t, 'end': c['end'], 'duration': timedelta(hours=8)}]}
+
+        window = Window([dict(c)], [dict(s)])
+        window.merge(component('1', self.t, self.t + timedelta(hours=8)))
+        (op,) = window.shift_ops()
+        self.assertNotIn('relayout', op._doc['$set'])
+
+        window = Window([dict(c)], [dict(s)])
+        window.merge(component('1', self.t, self.t + timedelta(hours=9)))
+        window.merge(component('1', self.t + timedelta(days=1)))
+        ops = window.shift_ops()
+        self.assertTrue(all(op._doc.get('relayout') or op._doc['$set']['relayout'] for op in ops))
+
+    def test_load_window_microseconds(self):
+        c = {**component('1', self.t), '_id': 'c0'}
+        window = asyncio.run(load_window(DB(components=[c]), [component('1', self.t + timedelta(microseconds=500))]))
+        self.assertEqual(list(window.components), ['c0'])
+
+    def test_missing_parent_shift(self):
+        window = Window([{**component('1', self.t), '_id': 'c0'}], [])
+        with self.assertRaises(Exception):
+            window.merge(component('1', self.t, self.t + timedelta(hours=1)))
+
+    def test_adopt_orphans(self):
+        # components written by a sync interrupted before its shifts
+        window = Window([{**component('1', self.t, self.t + timedelta(hours=4)), '_id': 'c0'},
+                         {**component('1', self.t + timedelta(hours=5)), '_id': 'c1'}], [])
+        window.adopt(window.orphans())
+        window.merge(component('1', self.t + timedelta(hours=5), self.t + timedelta(hours=8)))
+
+        self.assertEqual(window.orphans(), [])
+        self.assertEqual(window.new_components, {})
+        self.assertEqual(window.dirty_components, {'c1'})
+        (shift,) = window.new_shifts.values()
+        self.assertEqual([c['_id'] for c in shift['components']], ['c0', 'c1'])
+        self.assertEqual(shift['duration'], timedelta(hours=7))
+
+
+if __name__ == '__main__':
+    unittest.main()
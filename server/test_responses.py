@@ -0,0 +1,155 @@
+import gzip
+import asyncio
+import unittest
+from datetime import timedelta
+from unittest import mock
+from aiohttp import web
+from aiohttp.test_utils import AioHTTPTestCase
+
+import api
+from cache import ResponseCache
+from fakes import DB, Client
+
+
+class Request:
+    def __init__(self, **headers):
+        self.headers = headers
+
+
+class TestNegotiation(unittest.TestCase):
+    def test_negotiate_encoding(self):
+        self.assertEqual(api.negotiate_encoding('gzip, deflate'), 'gzip')
+        self.assertIsNone(api.negotiate_encoding('gzip;q=0'))
+        self.assertIsNone(api.negotiate_encoding(''))
+        self.assertIsNone(api.negotiate_encoding('identity'))
+        self.assertEqual(api.negotiate_encoding('*'), next(iter(api.ENCODINGS)))
+        # refused by name, anything else by *
+        self.assertNotEqual(api.negotiate_encoding('gzip;q=0, *'), 'gzip')
+        self.assertEqual(api.negotiate_encoding('GZIP;q=0.5, br;q=0'), 'gzip')
+        self.assertEqual(api.negotiate_encoding('gzip;q=bad, *;q=0.1'), next(iter(api.ENCODINGS)))
+
+    def test_not_modified(self):
+        tag = '"abc"'
+        self.assertTrue(api.not_modified(Request(**{'if-none-match': tag}), tag))
+        self.assertTrue(api.not_modified(Request(**{'if-none-match': '"x", W/"abc"'}), tag))
+        self.assertTrue(api.not_modified(Request(**{'if-none-match': '*'}), tag))
+        self.assertFalse(api.not_modified(Request(**{'if-none-match': '"abcd"'}), tag))
+        self.assertFalse(api.not_modified(Request(), tag))
+
+    def test_etag(self):
+        app = {'version': {'state': 1, 'sync': 2, 'roster': 3}, 'cache': ResponseCache(ttl=60),
+                'cache_bucket': timedelta(minutes=5)}
+        tag = api.etag(app, ('shifts',), 'json')
+        self.assertNotEqual(tag, api.etag(app, ('shifts',), 'json.gzip'))
+        self.assertNotEqual(tag, api.etag(app, ('weekly',), 'json'))
+        app['version']['sync'] = 4
+        self.assertNotEqual(tag, api.etag(app, ('shifts',), 'json'))
+
+    def test_etag_period(self):
+        app = {'version': {}, 'cache': ResponseCache(ttl=0), 'cache_bucket': timedelta(minutes=5)}
+        with mock.patch('api.time.time', return_value=600):
+            tag = api.etag(app, ('shifts',), 'json')
+        with mock.patch('api.time.time', return_value=899):
+            self.assertEqual(api.etag(app, ('shifts',), 'json'), tag)
+        # no ttl, still changes with the cache bucket
+        with mock.patch('api.time.time', return_value=900):
+            self.assertNotEqual(api.etag(app, ('shifts',), 'json'), tag)
+
+
+class TestCached(AioHTTPTestCase):
+    async def get_application(self):
+        self.calls = 0
+        self.computed = []
+        self.clear = False
+
+        async def compute(name):
+            self.calls += 1
+            self.computed.append(name)
+            if self.clear:
+                # a sync finished while computing
+                self.app['cache'].clear()
+            return api.encode({'value': 'x' * 2000}, name)
+
+        async def handler(request):
+            return await api.cached(request, ('key', self.clear), compute)
+
+        app = web.Application()
+        app.router.add_get('/', handler)
+        app['version'] = {'sync': 1}
+        app['cache'] = ResponseCache(ttl=60)
+        app['cache_bucket'] = timedelta(minutes=5)
+        return app
+
+    async def test_not_modified(self):
+        resp = await self.client.get('/', headers={'accept-encoding': 'identity'})
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.headers['Vary'], 'Accept, Accept-Encoding')
+        tag = resp.headers['ETag']
+        resp = await self.client.get('/', headers={'accept-encoding': 'identity', 'if-none-match': f'W/{tag}'})
+        self.assertEqual(resp.status, 304)
+        # another variant, another tag
+        resp = await self.client.get('/', headers={'accept-encoding': 'gzip', 'if-none-match': tag})
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(self.calls, 1)
+        # a sync
+        self.app['version']['sync'] = 2
+        resp = await self.client.get('/', headers={'accept-encoding': 'identity', 'if-none-match': tag})
+        self.assertEqual(resp.status, 200)
+
+    async def test_compressed_variant(self):
+        resp = await self.client.get('/', headers={'accept-encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        bodies = self.app['cache'].get(('key', False, 'json'))
+        self.assertEqual(await resp.read(), bodies['json'])
+        self.assertEqual(gzip.decompress(bodies['json.gzip']), bodies['json'])
+
+    async def test_formats(self):
+        await self.client.get('/')
+        self.assertEqual(self.computed, ['json'])
+        # only the format asked for is encoded, the other one is computed when it is asked for
+        self.assertNotIn('bson', self.app['cache'].get(('key', False, 'json')))
+        resp = await self.client.get('/', headers={'accept': 'application/bson'})
+        self.assertEqual(resp.content_type, 'application/bson')
+        await self.client.get('/', headers={'accept': 'application/bson'})
+        self.assertEqual(self.computed, ['json', 'bson'])
+
+    async def test_generation_changed(self):
+        self.clear = True
+        resp = await self.client.get('/')
+        self.assertEqual(resp.status, 200)
+        self.assertNotIn('ETag', resp.headers)
+
+
+class TestWatchSyncs(unittest.TestCase):
+    def test_tail_not_held_up(self):
+        states = asyncio.Queue()
+
+        async def tail(collection):
+            while True:
+                yield await states.get()
+        db = DB()
+        app = {'db': Client(db), 'version': {'state': None, 'sync': None}, 'cache': ResponseCache(ttl=60),
+                'layouts': {}}
+
+        async def run():
+            task = asyncio.create_task(api.watch_syncs(app))
+            await states.put({'_id': 1})
+            await states.put({'_id': 2})
+            await asyncio.sleep(0.05)
+            # the second snapshot is read while the first waits for its sync
+            self.assertEqual(app['version']['state'], 2)
+            app['cache'].put('key', {'json': b''})
+            db.sync_history.docs.append({'_id': 3})
+            await asyncio.sleep(0.05)
+            task.cancel()
+            # the wait is cancelled along with the tail
+            await asyncio.sleep(0)
+            return len(asyncio.all_tasks())
+        with mock.patch('api.tail', tail), mock.patch('api.SYNC_POLL', 0.01):
+            self.assertEqual(asyncio.run(run()), 1)
+        self.assertEqual(app['version']['sync'], 3)
+        self.assertIsNone(app['cache'].get('key'))
+
+
+if __name__ == '__main__':
+    unittest.main()
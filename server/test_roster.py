@@ -0,0 +1,74 @@
+import asyncio
+import unittest
+from datetime import datetime
+
+import api
+from fakes import DB, Client
+from roster import fingerprint, sync_roster, to_employee
+
+
+class FakeMySQL:
+    '''
+    tam.inf_employee in one batch
+    '''
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def stream(self, query, args=None, cursor_class=None):
+        yield [dict(row) for row in self.rows]
+
+
+def row(employee_id, name):
+    return {'id': employee_id, 'Code': str(employee_id), 'Name': name, 'MiddleName': '', 'LastName': 'x',
+            'HireDate': datetime(2019, 1, 1)}
+
+
+class TestRoster(unittest.TestCase):
+    def test_fingerprint(self):
+        a = row(1, 'a')
+        self.assertEqual(fingerprint(a), fingerprint(dict(reversed(list(a.items())))))
+        self.assertNotEqual(fingerprint(a), fingerprint({**a, 'Name': 'b'}))
+        self.assertEqual(to_employee(a)['fingerprint'], fingerprint(a))
+        self.assertEqual(to_employee(a)['id'], '1')
+
+    def test_sync_roster(self):
+        db, rows = DB(), [row(1, 'a'), row(2, 'b')]
+        self.assertEqual(asyncio.run(sync_roster(db, FakeMySQL(rows))), ['1', '2'])
+        # nothing changed, nothing written or announced
+        self.assertEqual(asyncio.run(sync_roster(db, FakeMySQL(rows))), [])
+        self.assertEqual(len(db.roster_updates.docs), 1)
+        rows[1]['Name'] = 'c'
+        self.assertEqual(asyncio.run(sync_roster(db, FakeMySQL(rows))), ['2'])
+        self.assertEqual(asyncio.run(db.employees.find_one({'id': '2'}))['Name'], 'c')
+        self.assertEqual([doc['ids'] for doc in db.roster_updates.docs], [['1', '2'], ['2']])
+
+
+class TestEmployeeMap(unittest.TestCase):
+    def app(self, db):
+        return {'db': Client(db), 'employees': None, 'version': {'roster': 1}}
+
+    def test_cached(self):
+        db = DB(employees=[to_employee(row(1, 'a'))])
+        app = self.app(db)
+        employees = asyncio.run(api.get_employees(app))
+        self.assertEqual(list(employees), ['1'])
+        db.employees.docs = []
+        self.assertIs(asyncio.run(api.get_employees(app)), employees)
+
+    def test_invalidated_while_loading(self):
+        db = DB(employees=[to_employee(row(1, 'a'))])
+        app = self.app(db)
+        find = db.employees.find
+
+        def invalidated(*args, **kwargs):
+            # a roster update arrives before the old map is read
+            app['employees'] = None
+            app['version']['roster'] = 2
+            return find(*args, **kwargs)
+        db.employees.find = invalidated
+        self.assertEqual(list(asyncio.run(api.get_employees(app))), ['1'])
+        self.assertIsNone(app['employees'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import random
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+
+from scheduler import Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.t = datetime(2020, 3, 2, 12)
+        polls = [self.t + timedelta(minutes=30 * i) for i in range(10)]
+        # an odd manual poll
+        polls.append(self.t + timedelta(minutes=95))
+        self.scheduler = Scheduler(polls, delay=timedelta(minutes=2), min_backoff=60, max_backoff=600,
+                rng=random.Random(0))
+
+    def test_cadence(self):
+        self.assertEqual(self.scheduler.cadence(), timedelta(minutes=30))
+        self.assertEqual(self.scheduler.next_poll(), self.t + timedelta(minutes=300))
+
+    def test_wakes_after_expected_poll(self):
+        now = self.t + timedelta(minutes=280)
+        self.assertEqual(self.scheduler.timeout(now), 22 * 60)
+
+    def test_backoff(self):
+        now = self.t + timedelta(minutes=310)
+        timeouts = [self.scheduler.timeout(now) for _ in range(6)]
+        for timeout, limit in zip(timeouts, [60, 120, 240, 480, 600, 600]):
+            self.assertLessEqual(timeout, limit)
+            self.assertGreaterEqual(timeout, limit / 2)
+
+        self.scheduler.observe([now])
+        self.assertEqual(self.scheduler.attempts, 0)
+        self.assertEqual(self.scheduler.timeout(now), 32 * 60)
+
+    def test_default_cadence(self):
+        self.assertEqual(Scheduler().cadence(), timedelta(hours=1))
+        self.assertIsNone(Scheduler().next_poll())
+
+    def test_trigger(self):
+        async def run():
+            scheduler = Scheduler()
+            asyncio.get_running_loop().call_later(0.01, scheduler.trigger)
+            await asyncio.wait_for(scheduler.wait(60), 1)
+            self.assertTrue(scheduler.triggered())
+            self.assertFalse(scheduler.triggered())
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from datetime import datetime, timedelta
+
+import models
+from shifts import ShiftAssembler, assemble, joins
+from util import merge_nearby_shifts, third_transform
+
+
+def component(start, end=None):
+    return {'start': start, 'end': end}
+
+
+class TestShifts(unittest.TestCase):
+    def setUp(self):
+        self.t = datetime(2020, 3, 2, 12)
+
+    def hours(self, h):
+        return self.t + timedelta(hours=h)
+
+    def test_joins(self):
+        self.assertTrue(joins(self.hours(0), self.hours(3)))
+        self.assertTrue(joins(self.hours(0), self.hours(0)))
+        self.assertFalse(joins(self.hours(0), self.hours(4)))
+        self.assertFalse(joins(self.hours(1), self.hours(0)))
+        self.assertFalse(joins(None, self.hours(0)))
+
+    def test_assemble(self):
+        shifts = assemble([
+            component(self.hours(5), self.hours(8)),
+            component(self.hours(0), self.hours(4)),
+            component(self.hours(13), self.hours(14)),
+            component(self.hours(15)),
+        ])
+        self.assertEqual(len(shifts), 2)
+        first, second = shifts
+        self.assertEqual((first['start'], first['end']), (self.hours(0), self.hours(8)))
+        self.assertEqual(first['duration'], timedelta(hours=7))
+        self.assertEqual(first['state'], models.ShiftState.Complete)
+        self.assertEqual(second['start'], self.hours(13))
+        self.assertIsNone(second['end'])
+        self.assertEqual(second['duration'], timedelta())
+        self.assertEqual(second['state'], models.ShiftState.Incomplete)
+
+    def test_open_shift_is_not_a_parent(self):
+        shifts = assemble([component(self.hours(0)), component(self.hours(1), self.hours(2))])
+        self.assertEqual(len(shifts), 2)
+
+    def test_incremental_append_and_update(self):
+        assembler = ShiftAssembler()
+        c = component(self.hours(0))
+        shift = assembler.append(c)
+        self.assertEqual(shift['state'], models.ShiftState.Incomplete)
+
+        c['end'] = self.hours(30)
+        assembler.update(shift)
+        self.assertEqual(shift['duration'], timedelta(hours=30))
+
+        # found through the span of the long shift
+        self.assertIs(assembler.append(component(self.hours(32), self.hours(33))), shift)
+        self.assertEqual(shift['end'], self.hours(33))
+        self.assertEqual(len(assembler.shifts), 1)
+
+    def test_matches_existing_shifts(self):
+        existing = {'_id': 1, 'components': [component(self.hours(0), self.hours(2))],
+                    'start': self.hours(0), 'end': self.hours(2)}
+        assembler = ShiftAssembler([existing])
+        self.assertIs(assembler.append(component(self.hours(3), self.hours(5))), existing)
+        self.assertEqual(existing['duration'], timedelta(hours=4))
+
+    def test_legacy_overlap(self):
+        # the timecard helpers keep grouping overlapping components, joins does not
+        pairs = [(self.hours(0), self.hours(4)), (self.hours(3), self.hours(6)), (self.hours(12), self.hours(13))]
+        self.assertFalse(joins(self.hours(4), self.hours(3)))
+        self.assertEqual(list(merge_nearby_shifts(pairs)), [pairs[:2], pairs[2:]])
+        items = [{'start': start, 'end': end} for start, end in pairs]
+        self.assertEqual(list(third_transform(items)), [items[:2], items[2:]])
+
+
+if __name__ == '__main__':
+    unittest.main()
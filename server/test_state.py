@@ -0,0 +1,47 @@
+import unittest
+from datetime import datetime, timedelta
+
+import state
+
+
+def shift(id, start, end=None):
+    return {'_id': id, 'employee': str(id), 'start': start, 'end': end, 'duration': 0, 'state': 'incomplete'}
+
+
+class TestState(unittest.TestCase):
+    def setUp(self):
+        self.t = datetime(2020, 3, 2, 12)
+
+    def test_diff_apply(self):
+        previous = [shift(1, self.t), shift(2, self.t), shift(3, self.t)]
+        values = [shift(1, self.t), {**shift(2, self.t), 'end': self.t + timedelta(hours=8), 'state': 'complete'},
+                  shift(4, self.t + timedelta(hours=1))]
+        delta = state.diff(previous, values)
+
+        self.assertEqual(delta['opened'], [values[2]])
+        self.assertEqual(delta['closed'], [3])
+        self.assertEqual(delta['changed'], [{'_id': 2, 'end': self.t + timedelta(hours=8), 'state': 'complete'}])
+        self.assertEqual(state.apply(previous, delta), values)
+
+    def test_advance(self):
+        values = [shift(1, self.t)]
+        s = {'seq': 0, 'keyframe': 0, 'date': None, 'values': []}
+        state.advance(s, {'type': 'keyframe', 'seq': 5, 'date': self.t, 'values': values})
+        self.assertEqual((s['seq'], s['keyframe']), (5, 5))
+
+        delta = {'type': 'delta', 'seq': 6, 'date': self.t, **state.diff(values, [])}
+        state.advance(s, delta)
+        self.assertEqual((s['seq'], s['values']), (6, []))
+
+        # stale deltas are ignored
+        state.advance(s, {'type': 'delta', 'seq': 4, 'date': self.t, **state.diff([], values)})
+        self.assertEqual(s['values'], [])
+
+    def test_legacy_documents_are_keyframes(self):
+        s = {'seq': 3, 'keyframe': 0, 'date': None, 'values': []}
+        state.advance(s, {'date': self.t, 'values': [shift(1, self.t)]})
+        self.assertEqual(len(s['values']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import json
+import unittest
+import bson
+from bson.json_util import loads
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from aiohttp import web
+from aiohttp.test_utils import AioHTTPTestCase
+
+import api
+from cache import ResponseCache
+from fakes import DB, Client, Collection, Cursor
+
+
+class Buckets(Collection):
+    '''
+    components as the weekly pipeline sees them, its result given
+    '''
+    def aggregate(self, pipeline):
+        self.pipeline = pipeline
+        return Cursor(self.docs)
+
+
+def shift(employee, start, hours):
+    end = start + timedelta(hours=hours)
+    parts = [{'_id': bson.ObjectId(), 'start': start, 'end': end, 'duration': hours * 60 * 60 * 1000}]
+    return {'_id': bson.ObjectId(), 'employee': employee, 'start': start, 'end': end, 'row': 0,
+            'state': 'complete', 'components': [p['_id'] for p in parts], 'parts': parts}
+
+
+class TestStream(AioHTTPTestCase):
+    async def get_application(self):
+        t = datetime(2020, 3, 2, 12)
+        self.shifts = [shift('1', t, 8), shift('2', t + timedelta(hours=1), 4), shift('1', t + timedelta(days=1), 8),
+                # too long, left out
+                shift('2', t + timedelta(days=1), 20)]
+        self.buckets = [{'_id': {'year': 2020, 'week': 10}, 'buckets': [1, 2]}, {'_id': {'year': 2020, 'week': 9}, 'buckets': [3]}]
+        app = web.Application()
+        app.add_routes(api.routes)
+        app['db'] = Client(DB(shifts=self.shifts, components=Buckets(self.buckets),
+                employees=[{'id': '1', 'name': 'a'}, {'id': '2', 'name': 'b'}]))
+        app['employees'] = None
+        app['embedded'] = True
+        app['layout'] = 'stored'
+        app['layout_rows'] = None
+        app['layouts'] = OrderedDict()
+        app['cache'] = ResponseCache(ttl=60)
+        app['cache_bucket'] = timedelta(minutes=5)
+        app['page_size'] = api.PAGE_SIZE
+        app['version'] = {}
+        return app
+
+    async def get(self, path, content_type):
+        resp = await self.client.get(path, headers={'accept': content_type})
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.content_type, content_type)
+        body = await resp.read()
+        if content_type == 'application/x-ndjson':
+            self.assertTrue(body.endswith(b'\n'))
+            return [loads(line) for line in body.decode().splitlines()]
+        return bson.decode_all(body)
+
+    async def test_shifts(self):
+        for content_type in api.STREAM_TYPES:
+            header, *docs = await self.get('/data/shifts', content_type)
+            self.assertEqual(header['employeeIds'], ['1', '2'])
+            self.assertEqual([doc['id'] for doc in docs], [str(s['_id']) for s in self.shifts[:3]])
+            self.assertEqual([len(doc['components']) for doc in docs], [1, 1, 1])
+        # not cached
+        self.assertEqual(len(self.app['cache']), 0)
+
+    async def test_weekly(self):
+        for content_type in api.STREAM_TYPES:
+            header, *docs = await self.get('/data/weekly?minDate=2020-03-01T00:00:00Z', content_type)
+            self.assertEqual(header['minDate'], datetime(2020, 3, 1))
+            self.assertIsNone(header['maxDate'])
+            self.assertEqual(docs, self.buckets)
+            self.assertIn('$match', self.app['db'].timeclock.components.pipeline[0])
+
+    async def test_ndjson_lines(self):
+        resp = await self.client.get('/data/weekly', headers={'accept': 'application/x-ndjson'})
+        # extended json, one document per line
+        for line in (await resp.read()).splitlines():
+            self.assertIsInstance(json.loads(line), dict)
+
+    async def test_not_streamed(self):
+        resp = await self.client.get('/data/weekly', headers={'accept': 'application/json'})
+        self.assertNotIn(resp.content_type, api.STREAM_TYPES)
+        self.assertEqual(len(loads(await resp.text())['data']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
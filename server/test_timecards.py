@@ -0,0 +1,76 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+
+from daemon import fetch_timecards
+
+
+class FakeProxy:
+    '''
+    GetTimecards answering later windows first, one (ids, window start) item per employee
+    '''
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.calls = []
+        self.cancelled = []
+        self.active = self.most_active = 0
+
+    async def GetTimecards(self, ids, a, b, flag):
+        self.calls.append((ids[0], a))
+        self.active += 1
+        self.most_active = max(self.most_active, self.active)
+        try:
+            if (ids[0], a) == self.fail:
+                await asyncio.sleep(0.01)
+                raise ConnectionError('rpc failed')
+            await asyncio.sleep(0.05 / (len(self.calls) + 1))
+            if self.fail is not None:
+                # outlasts the failing request
+                await asyncio.sleep(1)
+            return [(i, a) for i in ids]
+        except asyncio.CancelledError:
+            self.cancelled.append((ids[0], a))
+            raise
+        finally:
+            self.active -= 1
+
+
+class TestFetchTimecards(unittest.TestCase):
+    def setUp(self):
+        self.t = datetime(2020, 3, 2)
+        self.ids = list(range(10))
+
+    def fetch(self, proxy, **kwargs):
+        async def run():
+            return [item async for item in fetch_timecards(proxy, self.ids, self.t, self.t + timedelta(days=70),
+                    interval=timedelta(days=14), chunk_size=4, **kwargs)]
+        return asyncio.run(run())
+
+    def test_order(self):
+        proxy = FakeProxy()
+        windows = self.fetch(proxy, concurrency=3)
+        self.assertEqual([a for a, _, _ in windows], [self.t + timedelta(days=14 * i) for i in range(5)])
+        for a, b, timecards in windows:
+            self.assertEqual(b - a, timedelta(days=14))
+            self.assertEqual(timecards, [(i, a) for i in self.ids])
+        self.assertLessEqual(proxy.most_active, 3)
+
+    def test_cancel_on_error(self):
+        proxy = FakeProxy(fail=(4, self.t))
+
+        async def run():
+            with self.assertRaises(ConnectionError):
+                async for _ in fetch_timecards(proxy, self.ids, self.t, self.t + timedelta(days=70),
+                        interval=timedelta(days=14), chunk_size=4, concurrency=3):
+                    pass
+            # let cancellations land
+            await asyncio.sleep(0)
+            return len(asyncio.all_tasks())
+        self.assertEqual(asyncio.run(run()), 1)
+        self.assertEqual(proxy.active, 0)
+        # the failed window's other chunks included
+        self.assertIn((0, self.t), proxy.cancelled)
+
+
+if __name__ == '__main__':
+    unittest.main()
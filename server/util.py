@@ -1,7 +1,90 @@
 # util.py
 import os
+import asyncio
 import logging
-from datetime import timedelta
+from contextlib import asynccontextmanager
+from pymysql.err import InterfaceError, OperationalError
+
+from shifts import SHIFT_GAP
+from localtime import EASTERN
+
+DROPPED_CONNECTION_ERRORS = (InterfaceError, OperationalError)
+
+
+class MySQLPool:
+    '''
+    pooled mysql connections
+    queries are retried on a fresh connection if the connection was dropped, large results can be
+    streamed in batches through an unbuffered (SS) cursor
+    '''
+    def __init__(self, pool, batch_size=1000, retries=2):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.retries = retries
+
+    @asynccontextmanager
+    async def cursor(self, cursor_class=None):
+        async with self.pool.acquire() as conn:
+            try:
+                async with conn.cursor(*[cursor_class] if cursor_class else []) as cursor:
+                    yield cursor
+            except DROPPED_CONNECTION_ERRORS:
+                # so the pool discards it
+                conn.close()
+                raise
+
+    async def _retry(self, fn):
+        for attempt in range(self.retries + 1):
+            try:
+                return await fn()
+            except DROPPED_CONNECTION_ERRORS as e:
+                if attempt == self.retries:
+                    raise
+                logging.warning(f'mysql connection dropped ({e}), retrying')
+                await asyncio.sleep(2 ** attempt)
+
+    async def fetchall(self, query, args=None, cursor_class=None):
+        async def fn():
+            async with self.cursor(cursor_class) as cursor:
+                await cursor.execute(query, args)
+                return await cursor.fetchall()
+        return await self._retry(fn)
+
+    async def fetchone(self, query, args=None, cursor_class=None):
+        async def fn():
+            async with self.cursor(cursor_class) as cursor:
+                await cursor.execute(query, args)
+                return await cursor.fetchone()
+        return await self._retry(fn)
+
+    async def stream(self, query, args=None, cursor_class=None, batch_size=None):
+        '''
+        yield lists of up to batch_size rows without buffering the whole result
+        retried only if the connection drops before the first batch
+        '''
+        import aiomysql
+        cursor_class = cursor_class or aiomysql.SSCursor
+        batch_size = batch_size or self.batch_size
+        for attempt in range(self.retries + 1):
+            started = False
+            try:
+                async with self.cursor(cursor_class) as cursor:
+                    await cursor.execute(query, args)
+                    while rows := await cursor.fetchmany(batch_size):
+                        started = True
+                        yield rows
+                return
+            except DROPPED_CONNECTION_ERRORS as e:
+                if started or attempt == self.retries:
+                    raise
+                logging.warning(f'mysql connection dropped ({e}), retrying')
+                await asyncio.sleep(2 ** attempt)
+
+    def close(self):
+        self.pool.close()
+
+    async def wait_closed(self):
+        await self.pool.wait_closed()
 
 
 async def get_mysql_db(config):
@@ -11,19 +94,21 @@ async def get_mysql_db(config):
     '''
     host, port, user, password, db = [os.environ.get(f'MYSQL_{k.upper()}') or config.get(k) for k in ['host', 'port', 'user', 'password', 'db']]
     port = int(port)
-    conn = await aiomysql.connect(host=host, port=port, user=user, password=password, autocommit=True)
-    return conn
+    pool = await aiomysql.create_pool(host=host, port=port, user=user, password=password, autocommit=True,
+            minsize=1, maxsize=int(config.get('pool_size', 4)), pool_recycle=3600)
+    return MySQLPool(pool, int(config.get('batch_size', 1000)))
 
 
-async def get_mongo_db(config):
+async def get_mongo_db(config, **kwargs):
     import motor.motor_asyncio
     from pymongo.errors import ConnectionFailure
     '''
     connect to mongodb, check connection
+    kwargs are passed to the client (event_listeners...)
     '''
     host, port, user, password = [os.environ.get(f'MONGO_{k.upper()}') or config.get(k) for k in ['host', 'port', 'user', 'password']]
     url = f'mongodb://{host}:{port}'
-    conn = motor.motor_asyncio.AsyncIOMotorClient(url)
+    conn = motor.motor_asyncio.AsyncIOMotorClient(url, **kwargs)
 
     logging.info(f'connecting to mongo at {url}')
     try:
@@ -34,6 +119,21 @@ async def get_mongo_db(config):
     return conn
 
 
+async def tail(collection):
+    '''
+    yield documents inserted into a capped collection from now on
+    '''
+    import pymongo
+    from pymongo.cursor import CursorType
+    while True:
+        latest = await collection.find_one({}, sort=[('_id', pymongo.DESCENDING)])
+        cursor = collection.find({'_id': {'$gt': latest['_id']}} if latest else {}, cursor_type=CursorType.TAILABLE_AWAIT)
+        while cursor.alive:
+            async for doc in cursor:
+                yield doc
+        await asyncio.sleep(1)
+
+
 def get_async_rpc_connection(config):
     import asyncio
     import xmlrpc.client
@@ -71,11 +171,12 @@ def merge_dups(arr):
     yield (aa, ab)
 
 
-def merge_nearby_shifts(it, threshold=timedelta(hours=4)):
+def merge_nearby_shifts(it, threshold=SHIFT_GAP):
     last_end = None
     components = []
     for shift in it:
         start_date, end_date = shift
+        # overlapping components group too, unlike shifts.joins
         if last_end is not None and (start_date - last_end) < threshold:
             components.append(shift)
         else:
@@ -90,14 +191,16 @@ def merge_nearby_shifts(it, threshold=timedelta(hours=4)):
         yield components
 
 
-def first_transform(it, offset=timedelta(hours=5)):
+def first_transform(it, offset=None):
+    ''' offset is added to local punch times, or None to convert them from US/Eastern
+    '''
     for item in it:
         obj = {'Punches': []}
         for k in ['Date', 'IsManual', 'Reg']:
             obj[k] = item.get(k)
         for k in ['StartPunch', 'StopPunch']:
             if (p := item.get(k)):
-                obj[k] = p['OriginalDate'] + offset
+                obj[k] = EASTERN.to_utc(p['OriginalDate']) if offset is None else p['OriginalDate'] + offset
                 obj['Punches'].append(p['Id'])
             else:
                 obj[k] = None
@@ -150,7 +253,7 @@ def second_transform(it):
     yield timecard
 
 
-def third_transform(it, threshold=timedelta(hours=4)):
+def third_transform(it, threshold=SHIFT_GAP):
     last_end = None
     group = []
     for item in it:
@@ -171,15 +274,17 @@ def third_transform(it, threshold=timedelta(hours=4)):
         yield group
 
 
-def parse_timecards_2(employee_id, timecards, offset=timedelta(hours=5)):
-    yield from third_transform(rename_fields(second_transform(first_transform(timecards))))
+def parse_timecards_2(employee_id, timecards, offset=None):
+    yield from third_transform(rename_fields(second_transform(first_transform(timecards, offset))))
 
 
-def parse_timecards(employee_id, timecards, offset=timedelta(hours=5)):
+def parse_timecards(employee_id, timecards, offset=None):
     shifts = []
 
-    timecards = [[punch['OriginalDate'] + offset if (punch := timecard.get(key)) else None for key in ('StartPunch', 'StopPunch')]
+    timecards = [[punch['OriginalDate'] if (punch := timecard.get(key)) else None for key in ('StartPunch', 'StopPunch')]
             for timecard in timecards]
+    timecards = [[d if d is None else EASTERN.to_utc(d) if offset is None else d + offset for d in pair]
+            for pair in timecards]
 
     timecards = merge_dups(timecards)
     # not sure why start would be None
@@ -1,7 +1,7 @@
 # connect to mongo
 # tail cursor on 'state' collection
 # accept websocket connections at /socket
-# update clients as required
+# update clients as required, with keyframes / deltas (see state.py)
 # log?
 import asyncio
 import pymongo
@@ -11,6 +11,7 @@ from aiohttp import web, WSCloseCode
 from pymongo.cursor import CursorType
 from bson.json_util import dumps
 
+import state
 from util import get_mongo_db
 
 
@@ -20,7 +21,10 @@ async def websocket_handler(request):
 
     request.app['websockets'].add(ws)
     db = request.app['db'].timeclock
-    latest_state = await db.state.find_one({}, sort=[('_id', pymongo.DESCENDING)])
+    # rebuilt keyframe, later keyframes / deltas are applied by seq and stale ones ignored
+    latest_state = await state.load(db)
+    if latest_state is not None:
+        latest_state = {'type': 'keyframe', **latest_state}
     await ws.send_str(dumps(latest_state))
     try:
         async for msg in ws: